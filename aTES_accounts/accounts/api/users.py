@@ -1,8 +1,7 @@
 """
 Implementation of a service
 """
-import json
-from typing import List
+from typing import List, Union
 
 from aiohttp_jsonrpc.handler import JSONRPCView
 from aiohttp_cors import CorsViewMixin
@@ -108,7 +107,7 @@ class UsersService(CorsViewMixin, JSONRPCView):
 
         await self._user_publisher.publish(
             self._streaming_routing_key,
-            json.dumps(self._message(user, const.EVENT__USER_CREATED))
+            self._message(user, const.EVENT__USER_CREATED)
         )
         return user_id
 
@@ -130,7 +129,7 @@ class UsersService(CorsViewMixin, JSONRPCView):
         user = await self._dao_users.get(user[const.ID])
         await self._user_publisher.publish(
             self._streaming_routing_key,
-            json.dumps(self._message(user, const.EVENT__USER_UPDATED))
+            self._message(user, const.EVENT__USER_UPDATED)
         )
 
     async def rpc_delete(self, id):
@@ -146,7 +145,7 @@ class UsersService(CorsViewMixin, JSONRPCView):
         await self._dao_users.delete(id)
         await self._user_publisher.publish(
             self._streaming_routing_key,
-            json.dumps(self._message(user, const.EVENT__USER_DELETED))
+            self._message(user, const.EVENT__USER_DELETED)
         )
 
     # @validated(schemas.GET_COUNT_BY_FILTER)
@@ -169,7 +168,8 @@ class UsersService(CorsViewMixin, JSONRPCView):
                                      filter: dict,  # pylint: disable = redefined-builtin
                                      order: List[dict],
                                      limit: int,
-                                     offset: int) -> List[dict]:
+                                     offset: int = 0,
+                                     cursor: str = None) -> Union[List[dict], dict]:
         """
         Get items by filter
 
@@ -191,11 +191,49 @@ class UsersService(CorsViewMixin, JSONRPCView):
                     ...
                 ]
             limit: maximum count of items
-            offset: offset from the beginning of the query
+            offset: offset from the beginning of the query, isn't used with cursor
+            cursor: turns on cursor mode: "" for the first page, then "next_cursor" of the previous page.
+                Page is found by seek on sort keys instead of skipping `offset` items,
+                so it takes the same time at any depth
 
         Returns:
-            List of dicts with entities
+            List of dicts with entities, in cursor mode
+                {
+                    "items": [...],
+                    "next_cursor": "..." or null on the last page
+                }
 
         """
         self._authenticated()
+        if cursor is not None:
+            items, next_cursor = await self._dao_users.get_list_by_cursor(filter, order, limit, cursor)
+            return {'items': items, 'next_cursor': next_cursor}
         return await self._dao_users.get_list_by_filter(filter, order, limit, offset)
+
+    # @validated(schemas.GET_PAGE)
+    async def rpc_get_page(self,
+                           filter: dict,  # pylint: disable = redefined-builtin
+                           order: List[dict],
+                           limit: int,
+                           offset: int = 0) -> dict:
+        """
+        Get page of items by filter with total count of filtered items.
+        Replaces get_count_by_filter + get_list_by_filter: both are read by one query
+
+        Args:
+            filter: same as in get_list_by_filter
+            order: same as in get_list_by_filter
+            limit: maximum count of items
+            offset: offset from the beginning of the query
+
+        Returns:
+            {
+                "items": [...],
+                "total": count of filtered items,
+                "total_exact": false if total of not filtered large table is estimated by database statistics
+            }
+
+        """
+        self._authenticated()
+        items, total, total_exact = await self._dao_users.get_page(filter, order, limit, offset)
+        return {'items': items, 'total': total, 'total_exact': total_exact}
@@ -7,10 +7,13 @@ import aio_pika
 from aiohttp import web
 import aiohttp_cors
 
+from accounts.dao.scoped_engine import connection_scope_middleware
 from accounts.db import init_engine
+from accounts.metrics import handle_metrics
 from accounts.dao.dao_users import DAOUsers
 
 from accounts.api.users import UsersService
+from accounts.rmq.codecs import get_codec
 from accounts.rmq.publisher import RabbitMQPublisher
 
 
@@ -34,10 +37,19 @@ async def on_app_start(app):
     )
 
     app['rabbit_connection'] = rabbit_connection
+    codec = get_codec(rabbitmq_config.get('content_type'))
+    exchange_options = {
+        'exchange_durable': rabbitmq_config.get('exchange_durable', False),
+        'exchange_auto_delete': rabbitmq_config.get('exchange_auto_delete', True)
+    }
     user_publisher = RabbitMQPublisher(
         rabbit_connection,
         exchange_name=config['exchanges']['user_streaming']['name'],
-        exchange_type=config['exchanges']['user_streaming']['type']
+        exchange_type=config['exchanges']['user_streaming']['type'],
+        batch_size=rabbitmq_config.get('publish_batch_size', 1),
+        linger=rabbitmq_config.get('publish_linger', 0.005),
+        codec=codec,
+        **exchange_options
     )
     await user_publisher.connect()
     app['user_publisher'] = user_publisher
@@ -49,8 +61,8 @@ async def on_app_stop(app):
     """
     Stop accounts on application destroy
     """
-    await app['rabbit_connection'].close()
     await app['user_publisher'].disconnect()
+    await app['rabbit_connection'].close()
 
     app['engine'].close()
     await app['engine'].wait_closed()
@@ -73,7 +85,7 @@ def create_app(loop: AbstractEventLoop = None, config: dict = None) -> web.Appli
         application
 
     """
-    app = web.Application()
+    app = web.Application(middlewares=[connection_scope_middleware()])
     cors = aiohttp_cors.setup(app, defaults={
         "*": aiohttp_cors.ResourceOptions(
             allow_credentials=True,
@@ -82,6 +94,7 @@ def create_app(loop: AbstractEventLoop = None, config: dict = None) -> web.Appli
         )
     })
 
+    app.router.add_route('GET', '/metrics', handle_metrics)
     cors.add(app.router.add_route('*', '/jsonrpc/users', UsersService))
     cors.add(app.router.add_route('*', '/jsonrpc/auth', UsersService))  # todo need new endpoint view
 
@@ -1,16 +1,21 @@
 """
 Manipulate in database with 'user' table
 """
-from typing import List
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import uuid
 
 import sqlalchemy
-from sqlalchemy import func
+from sqlalchemy import any_, bindparam, func
 
 from accounts.api import const
 from accounts.exceptions import NotFound
 from accounts.db import User
-from accounts.dao.filters import make_string_filter
+from accounts.dao.bulk import chunked, grouped_by_fields, make_update_from_values, make_upsert
+from accounts.dao.cursor import decode_cursor, get_next_cursor, get_order_keys, ordered_by_keys, seek_condition
+from accounts.dao.filters import get_filter_shape, get_order_shape, make_search_rank, make_string_filter
+from accounts.dao.page import split_total_count, with_total_count
+from accounts.dao.server_cursor import DEFAULT_FETCH_SIZE, iter_rows
+from accounts.dao.statement_cache import StatementCache
 
 
 class DAOUsers:
@@ -19,45 +24,88 @@ class DAOUsers:
     """
     def __init__(self, engine):
         self.engine = engine
+        self._statements = StatementCache()
 
     async def _add(self, conn, obj: dict) -> str:
-        if const.ID not in obj:
-            obj[const.ID] = uuid.uuid4().hex
-        await conn.execute(
-            User.insert().values(**obj)
-        )
-        return obj[const.ID]
+        return (await self._add_many(conn, [obj]))[0]
 
     async def _set(self, conn, obj: dict) -> None:
-        await conn.execute(
-            User.update().values(**obj).
-            where(User.c.id == obj[const.ID])
-        )
+        await self._set_many(conn, [obj])
+
+    async def _add_many(self, conn, objects: List[dict]) -> List[str]:
+        for obj in objects:
+            if const.ID not in obj:
+                obj[const.ID] = uuid.uuid4().hex
+        for chunk in grouped_by_fields(objects):
+            await conn.execute(User.insert().values(chunk))
+        return [obj[const.ID] for obj in objects]
+
+    async def _set_many(self, conn, objects: List[dict]) -> None:
+        for chunk in grouped_by_fields(objects):
+            if len(chunk[0]) > 1:
+                await conn.execute(*make_update_from_values(User, chunk))
+
+    async def _upsert_many(self, conn, objects: List[dict]) -> List[str]:
+        for obj in objects:
+            if const.ID not in obj:
+                obj[const.ID] = uuid.uuid4().hex
+        for chunk in grouped_by_fields(objects):
+            await conn.execute(make_upsert(User, chunk))
+        return [obj[const.ID] for obj in objects]
 
     async def _delete(self, conn, object_id: str):
         await conn.execute(User.delete().where(User.c.id == object_id))
 
     async def _get(self, conn, object_id: str):
-        row = await (
-            await conn.execute(User.select().where(User.c.id == object_id))
-        ).first()
-
-        if row is None:
+        objects = await self._get_many(conn, [object_id])
+        if object_id not in objects:
             raise NotFound()
-        return dict(row)
+        return objects[object_id]
+
+    async def _get_many(self, conn, object_ids: List[str]) -> Dict[str, dict]:
+        result = {}
+        for chunk in chunked(list(object_ids)):
+            rows = await self._statements.execute(
+                conn,
+                'get_many',
+                lambda: User.select().where(User.c.id == any_(bindparam('ids'))),
+                {'ids': chunk}
+            )
+            async for row in rows:
+                result[row[const.ID]] = dict(row)
+        return result
+
+    # fields of filter, which are used by _filtered_query
+    _filter_fields = (const.LOGIN, const.ID, const.ROLE)
+
+    # fields, which rows are ranked by in "search" mode of their filter
+    _search_fields = (User.c.login,)
 
     def _filtered_query(self, query, filter_: dict):
         if const.LOGIN in filter_:
             query = query.where(make_string_filter(User.c.login, filter_[const.LOGIN]))
         if const.ID in filter_:
-            values = filter_[const.ID]['values']
-            query = query.where(User.c.id.in_(values))
+            query = query.where(make_string_filter(User.c.id, filter_[const.ID]))
+        if const.ROLE in filter_:
+            query = query.where(make_string_filter(User.c.role, filter_[const.ROLE]))
+        return query
+
+    def _ranked_query(self, query, filter_: dict, order: List[dict]):
+        """
+        Orders rows found by "search" condition by rank, the best are the first. Explicit order wins
+        """
+        if order:
+            return query
+        for field in self._search_fields:
+            field_filter = filter_.get(field.key)
+            if field_filter and field_filter.get('search'):
+                return query.order_by(make_search_rank(field, field_filter).desc())
         return query
 
     @staticmethod
     def _ordered_query(query, filter_: List[dict]):
         if not filter_:
-            return query.order_by(User.c.name)
+            return query.order_by(User.c.login)
         for item in filter_:
             field_name = item['field']
             direction = item.get('direction', 'asc')
@@ -68,22 +116,96 @@ class DAOUsers:
         return query
 
     async def _get_count_by_filter(self, conn, filter_: dict) -> int:
-        query = sqlalchemy.select([func.count(User.c.id)])
-        query = self._filtered_query(query, filter_)
-        return await conn.scalar(query)
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+
+        def build():
+            query = sqlalchemy.select([func.count(User.c.id)])
+            return self._filtered_query(query, filter_)
+
+        result = await self._statements.execute(conn, ('count', filter_shape), build, parameters)
+        return await result.scalar()
 
     async def _get_list_by_filter(self, conn, filter_: dict, order: List[dict], limit: int, offset: int) -> List[dict]:
-        query = User.select()
-        query = self._filtered_query(query, filter_)
-        query = self._ordered_query(query, order)
-        query = query.limit(limit)
-        query = query.offset(offset)
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
 
+        def build():
+            query = User.select()
+            query = self._filtered_query(query, filter_)
+            query = self._ranked_query(query, filter_, order)
+            query = self._ordered_query(query, order)
+            return query.limit(bindparam('limit')).offset(bindparam('offset'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('list', filter_shape, get_order_shape(order)),
+            build,
+            {**parameters, 'limit': limit, 'offset': offset}
+        )
         result = []
-        async for row in conn.execute(query):
+        async for row in rows:
             result.append(dict(row))
         return result
 
+    async def _get_list_by_cursor(
+            self,
+            conn,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            cursor: str = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        keys = get_order_keys(User, order)
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+        if cursor:
+            parameters.update(decode_cursor(cursor, User, keys))
+
+        def build():
+            query = self._filtered_query(User.select(), filter_)
+            if cursor:
+                query = query.where(seek_condition(User, keys, parameters))
+            return ordered_by_keys(query, User, keys).limit(bindparam('limit'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('cursor', filter_shape, keys, bool(cursor)),
+            build,
+            # one more row shows if there is the next page
+            {**parameters, 'limit': limit + 1}
+        )
+        result = []
+        async for row in rows:
+            result.append(dict(row))
+        return result[:limit], get_next_cursor(result, limit, keys)
+
+    async def _get_page(
+            self,
+            conn,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            offset: int
+    ) -> Tuple[List[dict], int, bool]:
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+
+        def build():
+            query = self._filtered_query(User.select(), filter_)
+            query = with_total_count(query, User, bool(filter_shape))
+            query = self._ranked_query(query, filter_, order)
+            query = self._ordered_query(query, order)
+            return query.limit(bindparam('limit')).offset(bindparam('offset'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('page', filter_shape, get_order_shape(order)),
+            build,
+            {**parameters, 'limit': limit, 'offset': offset}
+        )
+        items, total, exact = split_total_count([dict(row) async for row in rows], limit, offset)
+        if total is None:
+            # page is after the last row
+            total, exact = await self._get_count_by_filter(conn, filter_), True
+        return items, total, exact
+
     async def add(self, obj: dict) -> str:
         async with self.engine.acquire() as conn:
             async with conn.begin():
@@ -103,6 +225,32 @@ class DAOUsers:
         async with self.engine.acquire() as conn:
             return await self._get(conn, object_id)
 
+    async def get_many(self, object_ids: List[str]) -> Dict[str, dict]:
+        """
+        Returns:
+            objects by id, missing ids are skipped
+        """
+        async with self.engine.acquire() as conn:
+            return await self._get_many(conn, object_ids)
+
+    async def add_many(self, objects: List[dict]) -> List[str]:
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                return await self._add_many(conn, objects)
+
+    async def set_many(self, objects: List[dict]):
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                await self._set_many(conn, objects)
+
+    async def upsert_many(self, objects: List[dict]) -> List[str]:
+        """
+        Adds new objects and sets existent ones
+        """
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                return await self._upsert_many(conn, objects)
+
     async def get_count_by_filter(self, filter_: dict) -> int:
         async with self.engine.acquire() as conn:
             return await self._get_count_by_filter(conn, filter_)
@@ -110,3 +258,52 @@ class DAOUsers:
     async def get_list_by_filter(self, filter_: dict, order: List[dict], limit: int, offset: int) -> List[dict]:
         async with self.engine.acquire() as conn:
             return await self._get_list_by_filter(conn, filter_, order, limit, offset)
+
+    async def get_list_by_cursor(
+            self,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            cursor: str = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        Returns:
+            page after the cursor (the first page without it) and cursor of the next page,
+            which is None for the last page
+        """
+        async with self.engine.acquire() as conn:
+            return await self._get_list_by_cursor(conn, filter_, order, limit, cursor)
+
+    async def get_page(
+            self,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            offset: int
+    ) -> Tuple[List[dict], int, bool]:
+        """
+        Returns:
+            page of filtered objects, total count of filtered objects and flag of exact count.
+            Total count of page and its rows are read by one query
+        """
+        async with self.engine.acquire() as conn:
+            return await self._get_page(conn, filter_, order, limit, offset)
+
+    async def iter_by_filter(
+            self,
+            filter_: dict,
+            order: List[dict] = None,
+            fetch_size: int = DEFAULT_FETCH_SIZE
+    ) -> AsyncIterator[dict]:
+        """
+        Iterates all filtered objects without limit, only `fetch_size` of them are kept in memory at once
+        """
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+
+        def build():
+            query = self._filtered_query(User.select(), filter_)
+            return self._ordered_query(query, order) if order else query
+
+        sql = self._statements.get_sql(('iter', filter_shape, get_order_shape(order or [])), build)
+        async for row in iter_rows(self.engine, sql, parameters, fetch_size):
+            yield row
@@ -0,0 +1,66 @@
+"""
+Iteration of query rows by server-side cursor
+"""
+from typing import AsyncIterator, List, Union
+import uuid
+
+from aiopg.sa.engine import get_dialect
+from sqlalchemy.sql import ClauseElement
+
+
+DEFAULT_FETCH_SIZE = 500
+
+_dialect = get_dialect()
+
+
+async def iter_rows(
+        engine,
+        query: Union[ClauseElement, str],
+        parameters: dict = None,
+        fetch_size: int = DEFAULT_FETCH_SIZE
+) -> AsyncIterator[dict]:
+    """
+    Iterates rows of query by named server-side cursor, so only `fetch_size` rows
+    are kept in memory at once whatever count of rows the query has.
+
+    psycopg2 doesn't support named cursors on async connections, so cursor is declared
+    by SQL. It lives in a transaction, which lasts until iteration ends. The transaction is
+    on its own connection, not on the one of connection scope, so DAO calls made while rows
+    are iterated run their own transactions and don't wait for the end of iteration.
+
+    Args:
+        engine: ScopedEngine of DAO
+        query: SQLAlchemy query or SQL with parameters
+        parameters: parameters of SQL
+        fetch_size: count of rows fetched from the server at once
+
+    """
+    if isinstance(query, ClauseElement):
+        compiled = query.compile(dialect=_dialect)
+        query, parameters = str(compiled), compiled.construct_params()
+
+    name = 'cursor_{}'.format(uuid.uuid4().hex)
+    async with engine.acquire_unscoped() as conn:
+        async with conn.begin():
+            await conn.execute('DECLARE {} NO SCROLL CURSOR FOR {}'.format(name, query), parameters or {})
+            while True:
+                rows = await (await conn.execute('FETCH FORWARD {:d} FROM {}'.format(fetch_size, name))).fetchall()
+                for row in rows:
+                    yield dict(row)
+                if len(rows) < fetch_size:
+                    break
+            await conn.execute('CLOSE {}'.format(name))
+
+
+async def iter_chunks(iterator: AsyncIterator, size: int) -> AsyncIterator[List]:
+    """
+    Groups items of async iterator to lists of `size` items
+    """
+    chunk = []
+    async for item in iterator:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
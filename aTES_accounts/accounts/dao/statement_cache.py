@@ -0,0 +1,60 @@
+"""
+Provides cache of compiled SQL statements
+"""
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from aiopg.sa.engine import get_dialect
+from aiopg.sa.result import ResultProxy
+from sqlalchemy.sql import ClauseElement
+
+
+DEFAULT_STATEMENT_CACHE_SIZE = 256
+
+_dialect = get_dialect()
+
+
+class StatementCache:
+    """
+    Keeps SQL text of queries by their shape.
+
+    Query of a shape is built by `build` with named bound parameters instead of values
+    and compiled on the first call only. Later calls execute ready SQL with new parameters,
+    so SQLAlchemy expression is neither built nor compiled again.
+    """
+    def __init__(self, max_size: int = DEFAULT_STATEMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._statements = OrderedDict()  # type: OrderedDict[Hashable, str]
+
+    def get_sql(self, shape: Hashable, build: Callable[[], ClauseElement]) -> str:
+        sql = self._statements.get(shape)
+        if sql is not None:
+            self.hits += 1
+            self._statements.move_to_end(shape)
+            return sql
+
+        self.misses += 1
+        sql = str(build().compile(dialect=_dialect))
+        self._statements[shape] = sql
+        if len(self._statements) > self.max_size:
+            self._statements.popitem(last=False)
+        return sql
+
+    async def execute(
+            self,
+            conn,
+            shape: Hashable,
+            build: Callable[[], ClauseElement],
+            parameters: dict
+    ) -> ResultProxy:
+        """
+        Args:
+            conn: connection
+            shape: key of the query, which defines its SQL
+            build: makes query of the shape
+            parameters: values of all bound parameters of the query
+
+        """
+        return await conn.execute(self.get_sql(shape, build), parameters)
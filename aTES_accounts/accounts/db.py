@@ -4,16 +4,22 @@ Database objects definitions
 from aiopg.sa import create_engine
 from sqlalchemy import MetaData, Table, Column, String, PrimaryKeyConstraint
 
+from accounts.dao.scoped_engine import ScopedEngine
 
-async def init_engine(db_config) -> 'Engine':
+
+async def init_engine(db_config) -> ScopedEngine:
     """
     Engine initialization
     """
-    return await create_engine(
+    engine = await create_engine(
         database=db_config['name'],
         host=db_config['host'],
         user=db_config['user'],
-        password=db_config['password'])
+        password=db_config['password'],
+        minsize=db_config.get('pool_min_size', 1),
+        maxsize=db_config.get('pool_max_size', 10),
+        pool_recycle=db_config.get('pool_recycle', -1))
+    return ScopedEngine(engine, acquire_timeout=db_config.get('acquire_timeout'))
 
 
 metadata = MetaData()
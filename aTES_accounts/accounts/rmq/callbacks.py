@@ -1,13 +1,11 @@
 """
 Provides callbacks for rabbitmq
 """
-import json
-
 from accounts.api import const
 
 
 async def user_callback(message, data):
-    message_body = json.loads(message['body'])
+    message_body = message['body']
     app = data
     obj = message_body['object']
     event = message_body['event']
@@ -1,13 +1,56 @@
 """
 Provides tool publishing messages to rabbitmq
 """
-from typing import Any, Callable
+import asyncio
+import itertools
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from aio_pika import IncomingMessage, Message
-from aio_pika.abc import AbstractRobustConnection, DeliveryMode
+from aio_pika.abc import AbstractQueue, AbstractRobustConnection, DeliveryMode
+
+from accounts.metrics import REGISTRY, get_event_name
+from accounts.rmq import codecs
+from accounts.rmq.retry import HEADER__ATTEMPT, HEADER__EXCEPTION, HEADER__QUEUE, RetryPolicy
+
+
+CONSUMED_MESSAGES = REGISTRY.counter(
+    'rmq_consumer_messages_total',
+    'Consumed messages by result: ack, nack, retry, parked or reject',
+    ('consumer', 'exchange', 'routing_key', 'event', 'result')
+)
+HANDLER_SECONDS = REGISTRY.histogram(
+    'rmq_consumer_handler_seconds',
+    'Time of message handling by consumer callback',
+    ('consumer', 'exchange', 'routing_key', 'event')
+)
 
 
 class RabbitMQConsumer:
+    """
+    Consumes messages of the queue bound to exchange.
+
+    Messages are processed by `concurrency` handlers at once. Every message is routed to
+    one of handlers by `partition_key(message)`, so messages with the same key (e.g. events
+    of one task or one worker) are processed one by one in order of delivery,
+    while messages with different keys are processed in parallel.
+    Messages without key are spread between handlers evenly.
+
+    Message body is decoded according to its content type before partitioning,
+    so callbacks and partition keys get the message as dict whatever codec producer uses.
+
+    Without `queue_name` consumer has its own server-named queue, which is deleted on disconnect,
+    so every process gets all messages. Named queue is shared by all processes of the service:
+    they compete for its messages, so load is split between them, and messages are kept
+    in a durable queue while processes restart. Order of messages with the same partition key
+    is kept within one process only.
+
+    Without `retry_policy` failed message is requeued immediately. With it, failed message
+    is acknowledged and republished to a delay queue of its attempt, which dead-letters
+    it back to the consumer's queue when TTL expires. Attempt number is carried
+    in the headers, and after the last attempt message is parked in '<name>.parked'
+    queue, where it stays until replay_parked() is called.
+    """
     def __init__(
             self,
             rabbit_connection: AbstractRobustConnection,
@@ -17,7 +60,14 @@ class RabbitMQConsumer:
             callback: Callable,
             callback_data: Any,
             exchange_durable: bool = False,
-            exchange_auto_delete: bool = True
+            exchange_auto_delete: bool = True,
+            prefetch_count: int = 1,
+            concurrency: int = 1,
+            partition_key: Callable[[dict], Optional[str]] = None,
+            name: str = None,
+            retry_policy: RetryPolicy = None,
+            queue_name: str = None,
+            queue_durable: bool = False
     ):
         self.connection = rabbit_connection
         self.exchange_name = exchange_name
@@ -27,15 +77,27 @@ class RabbitMQConsumer:
         self.callback = callback
         self.callback_data = callback_data
         self.routing_key = routing_key
+        # there is no sense to have more handlers than unacknowledged messages
+        self.concurrency = max(1, concurrency)
+        self.prefetch_count = max(prefetch_count, self.concurrency)
+        self.partition_key = partition_key
+        self.name = name or queue_name or exchange_name
+        self.retry_policy = retry_policy
         self.channel = None
         self.exchange = None
         self.queue = None
-        self.queue_name = None
+        self.queue_name = queue_name
+        self.queue_durable = queue_durable
         self.consumer_tag = None
+        self.parked_queue = None
+        self._delay_queues = {}  # type: Dict[int, AbstractQueue]
+        self._partitions = []  # type: List[asyncio.Queue]
+        self._handlers = []  # type: List[asyncio.Task]
+        self._round_robin = itertools.count()
 
     async def connect(self):
         self.channel = await self.connection.channel()
-        await self.channel.set_qos(prefetch_count=1)
+        await self.channel.set_qos(prefetch_count=self.prefetch_count)
 
         self.exchange = await self.channel.declare_exchange(
             self.exchange_name,
@@ -46,10 +108,16 @@ class RabbitMQConsumer:
 
         self.queue = await self.channel.declare_queue(
             name=self.queue_name,
-            auto_delete=True,
-            durable=False,
+            # server-named queue is private for the process, named one is shared and outlives it
+            auto_delete=self.queue_name is None,
+            durable=self.queue_durable,
         )
         await self.queue.bind(self.exchange, routing_key=self.routing_key)
+        if self.retry_policy is not None:
+            await self._declare_retry_queues()
+
+        self._partitions = [asyncio.Queue() for _ in range(self.concurrency)]
+        self._handlers = [asyncio.ensure_future(self._handle_partition(partition)) for partition in self._partitions]
         self.consumer_tag = await self.queue.consume(self._on_consume_message)
 
     async def disconnect(self) -> None:
@@ -58,26 +126,215 @@ class RabbitMQConsumer:
         """
         if not self.channel.is_closed:
             await self.queue.cancel(self.consumer_tag)
-            await self.queue.unbind(self.exchange, routing_key=self.routing_key, timeout=1)
-            if self.queue and self.queue_name is None:
+            # messages which were already delivered have to be processed and acknowledged
+            # before the channel is closed, otherwise they are redelivered after restart
+            for partition in self._partitions:
+                await partition.join()
+            if self.queue_name is None:
+                # shared queue has to stay bound for other processes of the service
+                await self.queue.unbind(self.exchange, routing_key=self.routing_key, timeout=1)
                 await self.queue.delete()
             await self.channel.close()
 
+        for handler in self._handlers:
+            handler.cancel()
+        self._handlers = []
+
+    async def _declare_retry_queues(self) -> None:
+        self.parked_queue = await self.channel.declare_queue(
+            name='{}.parked'.format(self.name),
+            durable=True
+        )
+        for delay in self.retry_policy.delays:
+            arguments = {
+                'x-message-ttl': delay,
+                'x-dead-letter-exchange': '',
+                'x-dead-letter-routing-key': self.queue.name
+            }
+            if self.queue_name is None:
+                # consumer's queue is server-named and lives as long as the connection,
+                # so do its delay queues
+                self._delay_queues[delay] = await self.channel.declare_queue(
+                    exclusive=True,
+                    arguments=arguments
+                )
+            else:
+                self._delay_queues[delay] = await self.channel.declare_queue(
+                    name='{}.retry.{}'.format(self.queue_name, delay),
+                    durable=self.queue_durable,
+                    arguments=arguments
+                )
+
+    @staticmethod
+    def _copy_message(incoming_message: IncomingMessage, headers: dict) -> Message:
+        return Message(
+            incoming_message.body,
+            headers=headers,
+            content_type=incoming_message.content_type,
+            correlation_id=incoming_message.correlation_id,
+            message_id=incoming_message.message_id,
+            delivery_mode=DeliveryMode.PERSISTENT
+        )
+
+    async def _retry(self, incoming_message: IncomingMessage, error: Exception) -> str:
+        """
+        Returns:
+            result of message handling for metrics
+        """
+        headers = dict(incoming_message.headers or {})
+        # it is added by RabbitMQ on every dead-lettering and isn't needed in a copy
+        headers.pop('x-death', None)
+        attempt = int(headers.get(HEADER__ATTEMPT, 1))
+        headers[HEADER__ATTEMPT] = attempt + 1
+
+        if attempt < self.retry_policy.max_attempts:
+            routing_key = self._delay_queues[self.retry_policy.get_delay(attempt)].name
+            result = 'retry'
+        else:
+            headers[HEADER__EXCEPTION] = repr(error)
+            headers[HEADER__QUEUE] = self.queue.name
+            routing_key = self.parked_queue.name
+            result = 'parked'
+            print('Message is parked in {}: {}'.format(routing_key, error))
+
+        try:
+            await self.channel.default_exchange.publish(
+                self._copy_message(incoming_message, headers),
+                routing_key=routing_key
+            )
+        except Exception as e:  # pylint: disable = broad-except
+            print(e)
+            await incoming_message.nack()
+            return 'nack'
+        await incoming_message.ack()
+        return result
+
+    async def replay_parked(self, limit: int = None) -> int:
+        """
+        Moves parked messages back to consumer's queue, attempts are counted from the beginning
+
+        Args:
+            limit: max count of messages to replay, all of them by default
+
+        Returns:
+            count of replayed messages
+
+        """
+        if self.parked_queue is None:
+            return 0
+        replayed = 0
+        while limit is None or replayed < limit:
+            parked_message = await self.parked_queue.get(no_ack=False, fail=False)
+            if parked_message is None:
+                break
+            headers = {
+                key: value for key, value in (parked_message.headers or {}).items()
+                if key not in (HEADER__ATTEMPT, HEADER__EXCEPTION, HEADER__QUEUE, 'x-death')
+            }
+            await self.channel.default_exchange.publish(
+                self._copy_message(parked_message, headers),
+                routing_key=self.queue.name
+            )
+            await parked_message.ack()
+            replayed += 1
+        return replayed
+
+    async def get_queue_depths(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Reads state of consumer's queues by passive declare. Separate channel is used,
+        because declare of missing queue closes the channel.
+
+        Returns:
+            {queue name: (count of ready messages, count of consumers)},
+            delay queues are summed up as '<name>.retry'
+        """
+        result = {}
+        channel = await self.connection.channel()
+        try:
+            queues = [(self.queue.name, self.queue)]
+            if self.parked_queue is not None:
+                queues.append((self.parked_queue.name, self.parked_queue))
+            queues += [('{}.retry'.format(self.name), queue) for queue in self._delay_queues.values()]
+            for name, queue in queues:
+                declared = await channel.declare_queue(queue.name, passive=True, robust=False)
+                message_count, consumer_count = result.get(name, (0, 0))
+                result[name] = (
+                    message_count + declared.declaration_result.message_count,
+                    consumer_count + declared.declaration_result.consumer_count
+                )
+        finally:
+            if not channel.is_closed:
+                await channel.close()
+        return result
+
+    def _get_partition(self, message_dict: dict) -> asyncio.Queue:
+        key = None
+        if self.partition_key is not None:
+            try:
+                key = self.partition_key(message_dict)
+            except Exception:  # pylint: disable = broad-except
+                # such message is broken anyway, its callback will fail and nack it
+                key = None
+        if key is None:
+            index = next(self._round_robin) % self.concurrency
+        else:
+            index = hash(key) % self.concurrency
+        return self._partitions[index]
+
     async def _on_consume_message(self, incoming_message: IncomingMessage) -> None:
         try:
-            if self.callback is not None:
-                message_body = incoming_message.body.decode()
+            body = codecs.decode(incoming_message.body, incoming_message.content_type)
+        except Exception as e:  # pylint: disable = broad-except
+            # message can't be decoded by any consumer, so there is no sense to requeue it
+            print('Message can not be decoded: ', e)
+            await incoming_message.reject()
+            CONSUMED_MESSAGES.inc(
+                consumer=self.name,
+                exchange=incoming_message.exchange,
+                routing_key=incoming_message.routing_key,
+                result='reject'
+            )
+            return
+        message_dict = {
+            **incoming_message.info(),
+            'body': body
+        }
+        self._get_partition(message_dict).put_nowait((incoming_message, message_dict))
+
+    async def _handle_partition(self, partition: asyncio.Queue) -> None:
+        while True:
+            incoming_message, message_dict = await partition.get()
+            try:
+                await self._process_message(incoming_message, message_dict)
+            except Exception as e:  # pylint: disable = broad-except
+                # e.g. channel was closed before message was acknowledged
+                print(e)
+            finally:
+                partition.task_done()
 
-                message_dict = {
-                    **incoming_message.info(),
-                    'body': message_body
-                }
+    async def _process_message(self, incoming_message: IncomingMessage, message_dict: dict) -> None:
+        labels = {
+            'consumer': self.name,
+            'exchange': incoming_message.exchange,
+            'routing_key': incoming_message.routing_key,
+            'event': get_event_name(message_dict['body'])
+        }
+        started = time.monotonic()
+        try:
+            if self.callback is not None:
                 if self.callback_data:
                     await self.callback(message_dict, self.callback_data)
                 else:
                     await self.callback(message_dict)
+            HANDLER_SECONDS.observe(time.monotonic() - started, **labels)
 
             await incoming_message.ack()
+            result = 'ack'
         except Exception as e:  # pylint: disable = broad-except
             print(e)
-            await incoming_message.nack()
+            if self.retry_policy is None:
+                await incoming_message.nack()
+                result = 'nack'
+            else:
+                result = await self._retry(incoming_message, e)
+        CONSUMED_MESSAGES.inc(result=result, **labels)
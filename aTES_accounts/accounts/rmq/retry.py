@@ -0,0 +1,58 @@
+"""
+Provides retry policy of failed messages
+"""
+from typing import List
+
+
+HEADER__ATTEMPT = 'x-attempt'
+HEADER__EXCEPTION = 'x-exception'
+HEADER__QUEUE = 'x-queue'
+
+
+class RetryPolicy:
+    """
+    Failed message is delayed for initial_delay * multiplier ** (attempt - 1) seconds
+    (but not more than max_delay) and consumed again.
+    After max_attempts attempts message is parked in the dead-letter queue.
+    """
+    def __init__(
+            self,
+            max_attempts: int = 5,
+            initial_delay: float = 1,
+            multiplier: float = 2,
+            max_delay: float = 300
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.initial_delay = initial_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+
+    def get_delay(self, attempt: int) -> int:
+        """
+        Returns:
+            delay after failed attempt in milliseconds
+        """
+        return int(min(self.initial_delay * self.multiplier ** (attempt - 1), self.max_delay) * 1000)
+
+    @property
+    def delays(self) -> List[int]:
+        """
+        Returns:
+            all delays of the policy in milliseconds, one delay queue is needed for each of them
+        """
+        return sorted({self.get_delay(attempt) for attempt in range(1, self.max_attempts)})
+
+
+def get_retry_policy(retry_policies: dict, consumer_name: str) -> RetryPolicy:
+    """
+    Makes policy of consumer from config, options of consumer override 'default' ones
+
+    Args:
+        retry_policies: {'default': {...}, <consumer name>: {...}}
+        consumer_name:
+
+    """
+    return RetryPolicy(**{
+        **retry_policies.get('default', {}),
+        **retry_policies.get(consumer_name, {})
+    })
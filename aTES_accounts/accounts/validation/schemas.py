@@ -73,21 +73,27 @@ STRING_FILTER = {
         'type': 'string',
         'coerce': 'strip',
         'minlength': 1,
-        'excludes': ['ilike', 'value']
+        'excludes': ['ilike', 'value', 'search']
     },
     'ilike': {
         'type': 'string',
         'coerce': 'strip',
         'minlength': 1,
-        'excludes': ['like', 'value']
+        'excludes': ['like', 'value', 'search']
     },
     'values': {
         'type': 'list',
         'minlength': 1,
-        'excludes': ['like', 'ilike'],
+        'excludes': ['like', 'ilike', 'search'],
         'schema': {
             'type': 'string'
         }
+    },
+    'search': {
+        'type': 'string',
+        'coerce': 'strip',
+        'minlength': 1,
+        'excludes': ['like', 'ilike', 'value']
     }
 }
 
@@ -146,9 +152,15 @@ GET_LIST_BY_FILTER = {
     'offset': {
         'type': 'integer',
         'min': 0
+    },
+    'cursor': {
+        'type': 'string',
+        'nullable': True
     }
 }
 
+GET_PAGE = {key: value for key, value in GET_LIST_BY_FILTER.items() if key != 'cursor'}
+
 
 def validate_user_info(obj: dict, schema: dict) -> Dict[str, list]:
     """
@@ -0,0 +1,35 @@
+"""Trigram index of user login
+
+Revision ID: 4a7c2e9f1b38
+Revises: c81e4a6f3d95
+Create Date: 2026-10-18 15:14:02.771904
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4a7c2e9f1b38'
+down_revision = 'c81e4a6f3d95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # like and ilike with leading wildcard and "search" of login.
+    # CREATE INDEX CONCURRENTLY doesn't lock writes, but can't run inside transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'user__login__trgm_idx',
+            'user',
+            ['login'],
+            postgresql_using='gin',
+            postgresql_ops={'login': 'gin_trgm_ops'},
+            postgresql_concurrently=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('user__login__trgm_idx', table_name='user', postgresql_concurrently=True)
@@ -0,0 +1,26 @@
+"""Index of user role
+
+Revision ID: c81e4a6f3d95
+Revises: 11c205c32alec
+Create Date: 2026-10-18 12:49:03.317425
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c81e4a6f3d95'
+down_revision = '11c205c32alec'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY doesn't lock writes, but can't run inside transaction
+    with op.get_context().autocommit_block():
+        op.create_index('user__role__idx', 'user', ['role'], postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('user__role__idx', table_name='user', postgresql_concurrently=True)
@@ -0,0 +1,37 @@
+"""Indexes of hot query paths
+
+Revision ID: 4b7e2d9a0c13
+Revises: 8c41f5a0d9e2
+Create Date: 2026-10-18 12:44:52.906311
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7e2d9a0c13'
+down_revision = '8c41f5a0d9e2'
+branch_labels = None
+depends_on = None
+
+# name, table, columns
+INDEXES = [
+    # ledger of worker, ordered by time; serves lookups by worker_id alone too
+    ('operation__worker_id__time__idx', 'operation', ['worker_id', 'time']),
+    ('operation__analytics_cycle_id__idx', 'operation', ['analytics_cycle_id']),
+    ('operation__time__idx', 'operation', ['time']),
+    ('user__role__idx', 'user', ['role']),
+]
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY doesn't lock writes, but can't run inside transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,30 @@
+"""Drop processed events
+
+Revision ID: a3d6e1f8b250
+Revises: f5a9c3e1b742
+Create Date: 2026-10-18 23:41:17.308514
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d6e1f8b250'
+down_revision = 'f5a9c3e1b742'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # analytics doesn't consume workflow events, so no event is ever recorded here
+    op.drop_table('processed_event')
+
+
+def downgrade():
+    op.create_table(
+        'processed_event',
+        sa.Column('event_id', sa.String),
+        sa.Column('processed_at', sa.DateTime, server_default=sa.func.now()),
+        sa.PrimaryKeyConstraint('event_id', name='processed_event__event_id__pkey')
+    )
@@ -0,0 +1,45 @@
+"""Projections of streamed tasks and users, which are written by upsert
+
+Revision ID: d16f3b8a2e74
+Revises: 4b7e2d9a0c13
+Create Date: 2026-10-18 16:03:37.902415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd16f3b8a2e74'
+down_revision = '4b7e2d9a0c13'
+branch_labels = None
+depends_on = None
+
+TASK_COLUMNS = [
+    sa.Column('name', sa.String),
+    sa.Column('description', sa.String),
+    sa.Column('assigned_worker_id', sa.String),
+    sa.Column('assign_price', sa.Integer),
+    sa.Column('finish_price', sa.Integer),
+    # time of the last written event, older events don't change a row
+    sa.Column('event_time', sa.DateTime(timezone=True)),
+]
+
+
+def upgrade():
+    # task had columns, which streaming events don't have
+    op.drop_column('task', 'assigned_worker')
+    op.drop_column('task', 'price')
+    for column in TASK_COLUMNS:
+        op.add_column('task', column)
+
+    op.add_column('user', sa.Column('event_time', sa.DateTime(timezone=True)))
+
+
+def downgrade():
+    op.drop_column('user', 'event_time')
+
+    for column in reversed(TASK_COLUMNS):
+        op.drop_column('task', column.name)
+    op.add_column('task', sa.Column('assigned_worker', sa.String))
+    op.add_column('task', sa.Column('price', sa.Integer))
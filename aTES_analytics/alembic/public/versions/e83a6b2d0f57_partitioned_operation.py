@@ -0,0 +1,101 @@
+"""Operation ledger partitioned by range of time
+
+Revision ID: e83a6b2d0f57
+Revises: d16f3b8a2e74
+Create Date: 2026-10-18 18:31:02.447918
+
+"""
+from datetime import date, datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e83a6b2d0f57'
+down_revision = 'd16f3b8a2e74'
+branch_labels = None
+depends_on = None
+
+HISTORY = 'operation_history'
+TIME_CHECK = 'operation__time__check'
+# name, columns; indexes of hot path migration are attached to these indexes of partitioned table
+INDEXES = [
+    ('operation__worker_id__time__idx', ['worker_id', 'time']),
+    ('operation__analytics_cycle_id__idx', ['analytics_cycle_id']),
+    ('operation__time__idx', ['time']),
+]
+
+
+def get_history_name(name: str) -> str:
+    return name.replace('operation__', HISTORY + '__', 1)
+
+
+def upgrade():
+    # existing rows aren't copied: old table becomes partition of all time before the next month
+    # (UTC), the next partitions are created ahead by PartitionMaintainer of the service.
+    # Operations of the current month are written during the migration, so they stay in old table
+    month = datetime.now(timezone.utc).date().replace(day=1)
+    next_month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+    # statements of the block are committed one by one, so none of them keeps lock of writes long:
+    # primary key of partitioned table includes time, its index is built without lock of writes.
+    # Constraint is added without check of rows and is validated by scan, which doesn't lock writes.
+    # Valid constraint makes time not null and attach of old table without scan of rows
+    with op.get_context().autocommit_block():
+        op.create_index(
+            get_history_name('operation__id__time__pkey'),
+            'operation',
+            ['id', 'time'],
+            unique=True,
+            postgresql_concurrently=True
+        )
+        op.execute("ALTER TABLE operation ADD CONSTRAINT {} CHECK (time IS NOT NULL AND time < '{}') NOT VALID".format(
+            TIME_CHECK, next_month.isoformat()
+        ))
+        op.execute('ALTER TABLE operation VALIDATE CONSTRAINT {}'.format(TIME_CHECK))
+
+    op.rename_table('operation', HISTORY)
+    for name, _ in INDEXES:
+        op.execute('ALTER INDEX {} RENAME TO {}'.format(name, get_history_name(name)))
+    op.execute(
+        'ALTER TABLE {history} DROP CONSTRAINT operation__id__pkey, '
+        'ADD CONSTRAINT {pkey} PRIMARY KEY USING INDEX {pkey}'.format(
+            history=HISTORY, pkey=get_history_name('operation__id__time__pkey')
+        )
+    )
+
+    op.create_table(
+        'operation',
+        sa.Column('id', sa.String, nullable=False),
+        sa.Column('analytics_cycle_id', sa.String),
+        sa.Column('worker_id', sa.String),  # link to table 'user'
+        sa.Column('description', sa.String),
+        sa.Column('debit', sa.Integer),
+        sa.Column('credit', sa.Integer),
+        sa.Column('time', sa.DateTime, nullable=False),
+        sa.PrimaryKeyConstraint('id', 'time', name='operation__id__time__pkey'),
+        postgresql_partition_by='RANGE (time)'
+    )
+    # indexes of partitioned table are made on its partitions, index of partition is attached if it exists
+    for name, columns in INDEXES:
+        op.create_index(name, 'operation', columns)
+
+    op.execute("ALTER TABLE operation ATTACH PARTITION {} FOR VALUES FROM (MINVALUE) TO ('{}')".format(
+        HISTORY, next_month.isoformat()
+    ))
+    op.execute('ALTER TABLE {} DROP CONSTRAINT {}'.format(HISTORY, TIME_CHECK))
+
+
+def downgrade():
+    # detached and archived partitions aren't returned to the table
+    op.execute('ALTER TABLE operation DETACH PARTITION {}'.format(HISTORY))
+    op.execute('INSERT INTO {} SELECT * FROM operation'.format(HISTORY))
+    op.drop_table('operation')
+
+    op.execute('ALTER TABLE {} DROP CONSTRAINT {}'.format(HISTORY, get_history_name('operation__id__time__pkey')))
+    op.rename_table(HISTORY, 'operation')
+    op.create_primary_key('operation__id__pkey', 'operation', ['id'])
+    op.alter_column('operation', 'time', nullable=True)
+    for name, _ in INDEXES:
+        op.execute('ALTER INDEX {} RENAME TO {}'.format(get_history_name(name), name))
@@ -0,0 +1,30 @@
+"""Personal balance
+
+Revision ID: f5a9c3e1b742
+Revises: e83a6b2d0f57
+Create Date: 2026-10-18 22:19:04.135872
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5a9c3e1b742'
+down_revision = 'e83a6b2d0f57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # initial revision drops the table on downgrade, but never created it
+    op.create_table(
+        'personal_balance',
+        sa.Column('user_id', sa.String),
+        sa.Column('value', sa.Integer),
+        sa.PrimaryKeyConstraint('user_id', name='personal_account__user_id__pkey')
+    )
+
+
+def downgrade():
+    op.drop_table('personal_balance')
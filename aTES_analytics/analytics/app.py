@@ -9,14 +9,20 @@ import aiohttp_cors
 
 from analytics.dao.dao_billing import DAOBilling
 from analytics.dao.dao_users import DAOUsers
+from analytics.dao.partitions import get_partition_maintainer
+from analytics.admin.parked import handle_replay_parked
+from analytics.dao.scoped_engine import connection_scope_middleware, with_connection_scope
 from analytics.db import init_engine
+from analytics.metrics import handle_metrics
 from analytics.dao.dao_tasks import DAOTasks
 
 from analytics.api.operations import AnalyticsService
-from analytics.rmq.callbacks import user_callback
+from analytics.rmq.callbacks import entity_partition_key, task_callback, user_callback
+from analytics.rmq.codecs import get_codec
 from analytics.rmq.consumer import RabbitMQConsumer
 from analytics.rmq.publisher import RabbitMQPublisher
-from analytics.schema_registry.validator import SchemaRegistryValidator
+from analytics.rmq.retry import get_retry_policy
+from analytics.schema_registry.validator import DEFAULT_RELOAD_INTERVAL, SchemaRegistryValidator
 
 
 async def on_app_start(app):
@@ -38,10 +44,19 @@ async def on_app_start(app):
     )
 
     app['rabbit_connection'] = rabbit_connection
+    codec = get_codec(rabbitmq_config.get('content_type'))
+    exchange_options = {
+        'exchange_durable': rabbitmq_config.get('exchange_durable', False),
+        'exchange_auto_delete': rabbitmq_config.get('exchange_auto_delete', True)
+    }
     operation_publisher = RabbitMQPublisher(
         rabbit_connection,
         exchange_name=config['exchanges']['operation_streaming']['name'],
-        exchange_type=config['exchanges']['operation_streaming']['type']
+        exchange_type=config['exchanges']['operation_streaming']['type'],
+        batch_size=rabbitmq_config.get('publish_batch_size', 1),
+        linger=rabbitmq_config.get('publish_linger', 0.005),
+        codec=codec,
+        **exchange_options
     )
     await operation_publisher.connect()
     app['operation_publisher'] = operation_publisher
@@ -49,18 +64,51 @@ async def on_app_start(app):
     analytics_event_publisher = RabbitMQPublisher(
         rabbit_connection,
         exchange_name=config['exchanges']['analytics']['name'],
-        exchange_type=config['exchanges']['analytics']['type']
+        exchange_type=config['exchanges']['analytics']['type'],
+        batch_size=rabbitmq_config.get('publish_batch_size', 1),
+        linger=rabbitmq_config.get('publish_linger', 0.005),
+        codec=codec,
+        **exchange_options
     )
     await analytics_event_publisher.connect()
     app['analytics_event_publisher'] = analytics_event_publisher
 
+    app['dao_tasks'] = DAOTasks(engine)
+    app['dao_users'] = DAOUsers(engine)
+    app['dao_analytics'] = DAOBilling(engine)
+
+    # partitions of ledger exist before consumers write operations
+    partition_maintainer = get_partition_maintainer(engine, config.get('operation_partitions', {}))
+    await partition_maintainer.maintain()
+    partition_maintainer.start()
+    app['partition_maintainer'] = partition_maintainer
+
+    schema_validator = SchemaRegistryValidator(
+        config['schemas_dir_path'],
+        reload_interval=config.get('schemas_reload_interval', DEFAULT_RELOAD_INTERVAL)
+    )
+    schema_validator.start()
+    app['schema_validator'] = schema_validator
+
+    retry_policies = rabbitmq_config.get('retry_policies', {})
+    consumer_options = {
+        'prefetch_count': rabbitmq_config.get('prefetch_count', 1),
+        'concurrency': rabbitmq_config.get('consumer_concurrency', 1),
+        'queue_durable': rabbitmq_config.get('queue_durable', False),
+        **exchange_options
+    }
+
     user_consumer = RabbitMQConsumer(
         rabbit_connection,
         exchange_name=config['exchange_subscriptions']['user_streaming'],
         exchange_type='topic',
         routing_key='*.user',
-        callback=user_callback,
-        callback_data=app
+        callback=with_connection_scope(user_callback, engine),
+        callback_data=app,
+        partition_key=entity_partition_key,
+        queue_name='analytics.user',
+        retry_policy=get_retry_policy(retry_policies, 'analytics.user'),
+        **consumer_options
     )
     await user_consumer.connect()
     app['user_consumer'] = user_consumer
@@ -70,28 +118,33 @@ async def on_app_start(app):
         exchange_name=config['exchange_subscriptions']['task_streaming'],
         exchange_type='topic',
         routing_key='*.task',
-        callback=user_callback,
-        callback_data=app
+        callback=with_connection_scope(task_callback, engine),
+        callback_data=app,
+        partition_key=entity_partition_key,
+        queue_name='analytics.task',
+        retry_policy=get_retry_policy(retry_policies, 'analytics.task'),
+        **consumer_options
     )
     await task_consumer.connect()
     app['task_consumer'] = task_consumer
 
-    app['dao_tasks'] = DAOTasks(engine)
-    app['dao_users'] = DAOUsers(engine)
-    app['dao_analytics'] = DAOBilling(engine)
-
-    app['schema_validator'] = SchemaRegistryValidator(config['schemas_dir_path'])
+    app['consumers'] = {
+        user_consumer.name: user_consumer,
+        task_consumer.name: task_consumer
+    }
 
 
 async def on_app_stop(app):
     """
     Stop tasks on application destroy
     """
-    await app['rabbit_connection'].close()
-    await app['operation_publisher'].disconnect()
-    await app['analytics_event_publisher'].disconnect()
     await app['user_consumer'].disconnect()
     await app['task_consumer'].disconnect()
+    await app['operation_publisher'].disconnect()
+    await app['analytics_event_publisher'].disconnect()
+    await app['rabbit_connection'].close()
+    await app['schema_validator'].stop()
+    await app['partition_maintainer'].stop()
 
     app['engine'].close()
     await app['engine'].wait_closed()
@@ -114,7 +167,7 @@ def create_app(loop: AbstractEventLoop = None, config: dict = None) -> web.Appli
         application
 
     """
-    app = web.Application()
+    app = web.Application(middlewares=[connection_scope_middleware()])
     cors = aiohttp_cors.setup(app, defaults={
         "*": aiohttp_cors.ResourceOptions(
             allow_credentials=True,
@@ -123,6 +176,8 @@ def create_app(loop: AbstractEventLoop = None, config: dict = None) -> web.Appli
         )
     })
 
+    app.router.add_route('GET', '/metrics', handle_metrics)
+    app.router.add_route('POST', '/admin/replay-parked', handle_replay_parked)
     cors.add(app.router.add_route('*', '/jsonrpc/analytics', AnalyticsService))
 
     app['config'] = config
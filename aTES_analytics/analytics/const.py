@@ -40,6 +40,7 @@ MONEY_AMOUNT = 'money_amount'
 FINISH_PRICE = 'finish_price'
 ASSIGN_PRICE = 'assign_price'
 TASK_ID = 'task_id'
+EVENT_TIME = 'event_time'
 
 OPENED = 'opened'
 CLOSED = 'closed'
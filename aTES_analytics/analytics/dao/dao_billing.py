@@ -1,16 +1,29 @@
 """
 Manipulate in database with tables
 """
-from typing import List
+from datetime import timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import uuid
 
 import sqlalchemy
-from sqlalchemy import func, select
+from sqlalchemy import any_, bindparam, func, literal_column, select
+from sqlalchemy.dialects import postgresql
 
 from analytics import const
 from analytics.exceptions import NotFound
+from analytics.dao.bulk import chunked
+from analytics.dao.cursor import decode_cursor, get_next_cursor, get_order_keys, ordered_by_keys, seek_condition
 from analytics.db import Operation, PersonalBalance, BillingCycle
-from analytics.dao.filters import make_string_filter
+from analytics.dao.filters import get_filter_shape, get_order_shape, get_parameter_name, make_string_filter
+from analytics.dao.server_cursor import DEFAULT_FETCH_SIZE, iter_rows
+from analytics.dao.statement_cache import StatementCache
+
+
+# time of operation is written in UTC and start of cycle in local time,
+# so partitions are pruned by start of cycle with a margin of any time zone
+CYCLE_TIME_MARGIN = timedelta(days=1)
+# the margin as a literal of cached queries, which are executed with values of filter parameters only
+_CYCLE_TIME_MARGIN_SQL = literal_column("interval '{:d} seconds'".format(int(CYCLE_TIME_MARGIN.total_seconds())))
 
 
 class DAOBilling:
@@ -19,6 +32,7 @@ class DAOBilling:
     """
     def __init__(self, engine):
         self.engine = engine
+        self._statements = StatementCache()
 
     async def create_new_analytics_cycle(self, start_date, end_date):
         async with self.engine.acquire() as conn:
@@ -80,82 +94,148 @@ class DAOBilling:
             where(BillingCycle.c.id == analytics_cycle_id)
         )
 
-    @staticmethod
-    async def _set_personal_balance(conn, user_id: str, value: int):
-        await conn.execute(
-            PersonalBalance.update().values(**{
-                const.USER_ID: user_id,
-                const.VALUE: value
-            }).where(
-                PersonalBalance.c.user_id == user_id
-            )
-        )
-
     async def get_personal_balance(self, user_id: str) -> int:
         async with self.engine.acquire() as conn:
             return await self._get_personal_balance(conn, user_id)
 
-    @staticmethod
-    async def _get_personal_balance(conn, user_id: str) -> int:
+    async def _get_personal_balance(self, conn, user_id: str) -> int:
         personal_balance = await (
-            await conn.execute(PersonalBalance.select().where(PersonalBalance.c.user_id == user_id))
+            await self._statements.execute(
+                conn,
+                'get_personal_balance',
+                lambda: PersonalBalance.select().where(PersonalBalance.c.user_id == bindparam(const.USER_ID)),
+                {const.USER_ID: user_id}
+            )
         ).first()
 
         if personal_balance is None:
             raise NotFound()
         return personal_balance.value
 
+    async def get_personal_balances(self, user_ids: List[str]) -> Dict[str, int]:
+        """
+        Returns:
+            balances by user id, users without balance are skipped
+        """
+        async with self.engine.acquire() as conn:
+            return await self._get_personal_balances(conn, user_ids)
+
+    async def _get_personal_balances(self, conn, user_ids: List[str]) -> Dict[str, int]:
+        result = {}
+        for chunk in chunked(list(user_ids)):
+            rows = await self._statements.execute(
+                conn,
+                'get_personal_balances',
+                lambda: PersonalBalance.select().where(PersonalBalance.c.user_id == any_(bindparam('user_ids'))),
+                {'user_ids': chunk}
+            )
+            async for row in rows:
+                result[row[const.USER_ID]] = row[const.VALUE]
+        return result
+
     @staticmethod
-    def _update_balance_value(operation: dict, balance: int):
-        debit = operation[const.DEBIT]
-        if debit:
-            balance -= debit
-        credit = operation[const.CREDIT]
-        if credit:
-            balance += credit
-        return balance
+    def _applied_operation_insert(operation: dict):
+        """
+        Makes single statement, which inserts operation and adds it to balance of its worker,
+        and returns new value of the balance.
+
+        Balance is created on the first operation of worker, otherwise it is changed
+        by `value = value + delta` under row lock of the upsert, so concurrent operations
+        of one worker don't lose updates.
+        """
+        new_operation = Operation.insert().values(**operation).returning(
+            Operation.c.worker_id, Operation.c.debit, Operation.c.credit
+        ).cte('new_operation')
+        delta = func.coalesce(new_operation.c.credit, 0) - func.coalesce(new_operation.c.debit, 0)
+        query = postgresql.insert(PersonalBalance).from_select(
+            [PersonalBalance.c.user_id, PersonalBalance.c.value],
+            select([new_operation.c.worker_id, delta])
+        )
+        return query.on_conflict_do_update(
+            index_elements=[PersonalBalance.c.user_id],
+            set_={const.VALUE: PersonalBalance.c.value + query.excluded.value}
+        ).returning(PersonalBalance.c.value)
 
     async def _add(self, conn, operation: dict) -> str:
-        balance = await self._get_personal_balance(conn, operation[const.WORKER_ID])
-
         if const.ID not in operation:
             operation[const.ID] = uuid.uuid4().hex
-        await conn.execute(
-            Operation.insert().values(**operation)
-        )
 
-        balance = self._update_balance_value(operation, balance)
-        await self._set_personal_balance(conn, operation[const.WORKER_ID], balance)
+        await conn.execute(self._applied_operation_insert(operation))
         return operation[const.ID]
 
     async def _delete(self, conn, object_id: str):
         await conn.execute(Operation.delete().where(Operation.c.id == object_id))
 
     async def _get(self, conn, object_id: str):
-        row = await (
-            await conn.execute(Operation.select().where(Operation.c.id == object_id))
-        ).first()
-
-        if row is None:
+        operations = await self._get_many(conn, [object_id])
+        if object_id not in operations:
             raise NotFound()
-        return dict(row)
+        return operations[object_id]
+
+    async def _get_many(self, conn, object_ids: List[str]) -> Dict[str, dict]:
+        result = {}
+        for chunk in chunked(list(object_ids)):
+            rows = await self._statements.execute(
+                conn,
+                'get_many',
+                lambda: Operation.select().where(Operation.c.id == any_(bindparam('ids'))),
+                {'ids': chunk}
+            )
+            async for row in rows:
+                result[row[const.ID]] = dict(row)
+        return result
+
+    # fields of filter, which are used by _filtered_query as string filters
+    _filter_fields = (const.ID, const.WORKER_ID)
+
+    def _get_filter_shape(self, filter_: dict) -> Tuple[tuple, dict]:
+        """
+        Returns:
+            shape of filter, which defines SQL of _filtered_query, and values of its parameters
+        """
+        shape, parameters = get_filter_shape(filter_, self._filter_fields)
+        if const.BILLING_CYCLE_ID in filter_:
+            shape += ((const.BILLING_CYCLE_ID, 'values'),)
+            parameters[get_parameter_name(const.BILLING_CYCLE_ID, 'values')] = list(
+                filter_[const.BILLING_CYCLE_ID]['values']
+            )
+        for bound in ('from', 'to'):
+            if bound in filter_.get(const.TIME, {}):
+                shape += ((const.TIME, bound),)
+                parameters[get_parameter_name(const.TIME, bound)] = filter_[const.TIME][bound]
+        return shape, parameters
 
     def _filtered_query(self, query, filter_: dict):
-        if const.TASK_NAME in filter_:
-            query = query.where(make_string_filter(Operation.c.name, filter_[const.TASK_NAME]))
-        for filtering_filed in filter_:
-            if filtering_filed in (const.ID, const.WORKER_ID):
-                values = filter_[filtering_filed]['values']
-                query = query.where(Operation.c[filtering_filed].in_(values))
-        if const.ID in filter_:
-            values = filter_[const.ID]['values']
-            query = query.where(Operation.c.id.in_(values))
+        """
+        Values of filter are named bound parameters, so SQL of the query depends on shape of filter only
+        """
+        for field_name in self._filter_fields:
+            if field_name in filter_:
+                query = query.where(make_string_filter(Operation.c[field_name], filter_[field_name]))
+        if const.BILLING_CYCLE_ID in filter_:
+            cycle_ids = bindparam(
+                get_parameter_name(const.BILLING_CYCLE_ID, 'values'),
+                list(filter_[const.BILLING_CYCLE_ID]['values'])
+            )
+            query = query.where(Operation.c.analytics_cycle_id == any_(cycle_ids))
+            # operations of cycle aren't older than its start, so partitions of older time are skipped
+            cycles_start = select([func.min(BillingCycle.c.start_date)]).where(BillingCycle.c.id == any_(cycle_ids))
+            query = query.where(Operation.c.time >= cycles_start.as_scalar() - _CYCLE_TIME_MARGIN_SQL)
+        time_filter = filter_.get(const.TIME, {})
+        if 'from' in time_filter:
+            query = query.where(Operation.c.time >= bindparam(
+                get_parameter_name(const.TIME, 'from'), time_filter['from'], type_=Operation.c.time.type
+            ))
+        if 'to' in time_filter:
+            query = query.where(Operation.c.time < bindparam(
+                get_parameter_name(const.TIME, 'to'), time_filter['to'], type_=Operation.c.time.type
+            ))
         return query
 
     @staticmethod
     def _ordered_query(query, filter_: List[dict]):
         if not filter_:
-            return query.order_by(Operation.c.name)
+            return query.order_by(Operation.c.time)
         for item in filter_:
             field_name = item['field']
             direction = item.get('direction', 'asc')
@@ -166,23 +246,77 @@ class DAOBilling:
         return query
 
     async def _get_count_by_filter(self, conn, filter_: dict) -> int:
-        query = sqlalchemy.select([func.count(Operation.c.id)])
-        query = self._filtered_query(query, filter_)
-        return await conn.scalar(query)
+        filter_shape, parameters = self._get_filter_shape(filter_)
 
-    async def _get_list_by_filter(self, conn, filter_: dict, order: List[dict], limit: int, offset: int) -> List[dict]:
-        query = Operation.select()
-        query = self._filtered_query(query, filter_)
-        query = self._ordered_query(query, order)
-        query = query.limit(limit)
-        query = query.offset(offset)
+        def build():
+            query = sqlalchemy.select([func.count(Operation.c.id)])
+            return self._filtered_query(query, filter_)
+
+        result = await self._statements.execute(conn, ('count', filter_shape), build, parameters)
+        return await result.scalar()
 
+    async def _get_list_by_filter(self, conn, filter_: dict, order: List[dict], limit: int, offset: int) -> List[dict]:
+        filter_shape, parameters = self._get_filter_shape(filter_)
+
+        def build():
+            query = Operation.select()
+            query = self._filtered_query(query, filter_)
+            query = self._ordered_query(query, order)
+            return query.limit(bindparam('limit')).offset(bindparam('offset'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('list', filter_shape, get_order_shape(order)),
+            build,
+            {**parameters, 'limit': limit, 'offset': offset}
+        )
         result = []
-        async for row in conn.execute(query):
+        async for row in rows:
             result.append(dict(row))
         return result
 
+    async def _get_list_by_cursor(
+            self,
+            conn,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            cursor: str = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        keys = get_order_keys(Operation, order)
+        filter_shape, parameters = self._get_filter_shape(filter_)
+        if cursor:
+            parameters.update(decode_cursor(cursor, Operation, keys))
+
+        def build():
+            query = self._filtered_query(Operation.select(), filter_)
+            if cursor:
+                query = query.where(seek_condition(Operation, keys, parameters))
+            return ordered_by_keys(query, Operation, keys).limit(bindparam('limit'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('cursor', filter_shape, keys, bool(cursor)),
+            build,
+            # one more row shows if there is the next page
+            {**parameters, 'limit': limit + 1}
+        )
+        result = []
+        async for row in rows:
+            result.append(dict(row))
+        return result[:limit], get_next_cursor(result, limit, keys)
+
     async def add_operation(self, obj: dict) -> str:
+        """
+        Adds operation and changes worker's balance
+
+        Args:
+            obj: operation
+
+        Returns:
+            id of added operation
+
+        """
         async with self.engine.acquire() as conn:
             async with conn.begin():
                 return await self._add(conn, obj)
@@ -196,6 +330,14 @@ class DAOBilling:
         async with self.engine.acquire() as conn:
             return await self._get(conn, object_id)
 
+    async def get_many(self, object_ids: List[str]) -> Dict[str, dict]:
+        """
+        Returns:
+            operations by id, missing ids are skipped
+        """
+        async with self.engine.acquire() as conn:
+            return await self._get_many(conn, object_ids)
+
     async def get_count_by_filter(self, filter_: dict) -> int:
         async with self.engine.acquire() as conn:
             return await self._get_count_by_filter(conn, filter_)
@@ -204,6 +346,36 @@ class DAOBilling:
         async with self.engine.acquire() as conn:
             return await self._get_list_by_filter(conn, filter_, order, limit, offset)
 
+    async def get_list_by_cursor(
+            self,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            cursor: str = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        Returns:
+            page of operations after the cursor (the first page without it) and cursor of the next page,
+            which is None for the last page
+        """
+        async with self.engine.acquire() as conn:
+            return await self._get_list_by_cursor(conn, filter_, order, limit, cursor)
+
+    async def iter_by_filter(
+            self,
+            filter_: dict,
+            order: List[dict] = None,
+            fetch_size: int = DEFAULT_FETCH_SIZE
+    ) -> AsyncIterator[dict]:
+        """
+        Iterates all filtered operations without limit, only `fetch_size` of them are kept in memory at once
+        """
+        query = self._filtered_query(Operation.select(), filter_)
+        if order:
+            query = self._ordered_query(query, order)
+        async for row in iter_rows(self.engine, query, fetch_size=fetch_size):
+            yield row
+
     def _filtered_analytics_cycle_query(self, query, filter_: dict):
         for filtering_filed in filter_:
             if filtering_filed in (const.STATUS, const.START_DATE, const.END_DATE):
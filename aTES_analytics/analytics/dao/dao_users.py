@@ -1,17 +1,22 @@
 """
 Manipulate in database with tables
 """
-import random
-from typing import List
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
 import uuid
 
 import sqlalchemy
-from sqlalchemy import func
+from sqlalchemy import any_, bindparam, func
 
 from analytics import const
 from analytics.exceptions import NotFound
 from analytics.db import User
-from analytics.dao.filters import make_string_filter
+from analytics.dao.bulk import chunked, grouped_by_fields, make_update_from_values, make_upsert, make_upsert_if_newer
+from analytics.dao.cursor import decode_cursor, get_next_cursor, get_order_keys, ordered_by_keys, seek_condition
+from analytics.dao.filters import get_filter_shape, get_order_shape, make_string_filter
+from analytics.dao.page import split_total_count, with_total_count
+from analytics.dao.server_cursor import DEFAULT_FETCH_SIZE, iter_rows
+from analytics.dao.statement_cache import StatementCache
 
 
 class DAOUsers:
@@ -20,39 +25,78 @@ class DAOUsers:
     """
     def __init__(self, engine):
         self.engine = engine
+        self._statements = StatementCache()
 
     async def _add(self, conn, obj: dict) -> str:
-        if const.ID not in obj:
-            obj[const.ID] = uuid.uuid4().hex
-        await conn.execute(
-            User.insert().values(**obj)
-        )
-        return obj[const.ID]
+        return (await self._add_many(conn, [obj]))[0]
 
     async def _set(self, conn, obj: dict) -> None:
-        await conn.execute(
-            User.update().values(**obj).
-            where(User.c.id == obj[const.ID])
-        )
+        await self._set_many(conn, [obj])
+
+    async def _add_many(self, conn, objects: List[dict]) -> List[str]:
+        for obj in objects:
+            if const.ID not in obj:
+                obj[const.ID] = uuid.uuid4().hex
+        for chunk in grouped_by_fields(objects):
+            await conn.execute(User.insert().values(chunk))
+        return [obj[const.ID] for obj in objects]
+
+    async def _set_many(self, conn, objects: List[dict]) -> None:
+        for chunk in grouped_by_fields(objects):
+            if len(chunk[0]) > 1:
+                await conn.execute(*make_update_from_values(User, chunk))
+
+    async def _upsert_many(self, conn, objects: List[dict]) -> List[str]:
+        for obj in objects:
+            if const.ID not in obj:
+                obj[const.ID] = uuid.uuid4().hex
+        for chunk in grouped_by_fields(objects):
+            await conn.execute(make_upsert(User, chunk))
+        return [obj[const.ID] for obj in objects]
+
+    async def _upsert_if_newer(self, conn, obj: dict, insert_only: Iterable[str] = ()) -> bool:
+        query = make_upsert_if_newer(User, [obj], const.EVENT_TIME, insert_only=insert_only)
+        return await (await conn.execute(query)).first() is not None
+
+    async def _delete_if_newer(self, conn, object_id: str, event_time: datetime) -> bool:
+        query = User.delete().where(
+            (User.c.id == object_id)
+            & ((User.c.event_time.is_(None)) | (User.c.event_time <= event_time))
+        ).returning(User.c.id)
+        return await (await conn.execute(query)).first() is not None
 
     async def _delete(self, conn, object_id: str):
         await conn.execute(User.delete().where(User.c.id == object_id))
 
     async def _get(self, conn, object_id: str):
-        row = await (
-            await conn.execute(User.select().where(User.c.id == object_id))
-        ).first()
-
-        if row is None:
+        objects = await self._get_many(conn, [object_id])
+        if object_id not in objects:
             raise NotFound()
-        return dict(row)
+        return objects[object_id]
+
+    async def _get_many(self, conn, object_ids: List[str]) -> Dict[str, dict]:
+        result = {}
+        for chunk in chunked(list(object_ids)):
+            rows = await self._statements.execute(
+                conn,
+                'get_many',
+                lambda: User.select().where(User.c.id == any_(bindparam('ids'))),
+                {'ids': chunk}
+            )
+            async for row in rows:
+                result[row[const.ID]] = dict(row)
+        return result
+
+    # fields of filter, which are used by _filtered_query
+    _filter_fields = (const.TASK_NAME, const.ID, const.ROLE)
 
     def _filtered_query(self, query, filter_: dict):
         if const.TASK_NAME in filter_:
             query = query.where(make_string_filter(User.c.name, filter_[const.TASK_NAME]))
         if const.ID in filter_:
-            values = filter_[const.ID]['values']
-            query = query.where(User.c.id.in_(values))
+            query = query.where(make_string_filter(User.c.id, filter_[const.ID]))
+        if const.ROLE in filter_:
+            query = query.where(make_string_filter(User.c.role, filter_[const.ROLE]))
         return query
 
     @staticmethod
@@ -69,22 +113,94 @@ class DAOUsers:
         return query
 
     async def _get_count_by_filter(self, conn, filter_: dict) -> int:
-        query = sqlalchemy.select([func.count(User.c.id)])
-        query = self._filtered_query(query, filter_)
-        return await conn.scalar(query)
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+
+        def build():
+            query = sqlalchemy.select([func.count(User.c.id)])
+            return self._filtered_query(query, filter_)
+
+        result = await self._statements.execute(conn, ('count', filter_shape), build, parameters)
+        return await result.scalar()
 
     async def _get_list_by_filter(self, conn, filter_: dict, order: List[dict], limit: int, offset: int) -> List[dict]:
-        query = User.select()
-        query = self._filtered_query(query, filter_)
-        query = self._ordered_query(query, order)
-        query = query.limit(limit)
-        query = query.offset(offset)
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
 
+        def build():
+            query = User.select()
+            query = self._filtered_query(query, filter_)
+            query = self._ordered_query(query, order)
+            return query.limit(bindparam('limit')).offset(bindparam('offset'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('list', filter_shape, get_order_shape(order)),
+            build,
+            {**parameters, 'limit': limit, 'offset': offset}
+        )
         result = []
-        async for row in conn.execute(query):
+        async for row in rows:
             result.append(dict(row))
         return result
 
+    async def _get_list_by_cursor(
+            self,
+            conn,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            cursor: str = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        keys = get_order_keys(User, order)
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+        if cursor:
+            parameters.update(decode_cursor(cursor, User, keys))
+
+        def build():
+            query = self._filtered_query(User.select(), filter_)
+            if cursor:
+                query = query.where(seek_condition(User, keys, parameters))
+            return ordered_by_keys(query, User, keys).limit(bindparam('limit'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('cursor', filter_shape, keys, bool(cursor)),
+            build,
+            # one more row shows if there is the next page
+            {**parameters, 'limit': limit + 1}
+        )
+        result = []
+        async for row in rows:
+            result.append(dict(row))
+        return result[:limit], get_next_cursor(result, limit, keys)
+
+    async def _get_page(
+            self,
+            conn,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            offset: int
+    ) -> Tuple[List[dict], int, bool]:
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+
+        def build():
+            query = self._filtered_query(User.select(), filter_)
+            query = with_total_count(query, User, bool(filter_shape))
+            query = self._ordered_query(query, order)
+            return query.limit(bindparam('limit')).offset(bindparam('offset'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('page', filter_shape, get_order_shape(order)),
+            build,
+            {**parameters, 'limit': limit, 'offset': offset}
+        )
+        items, total, exact = split_total_count([dict(row) async for row in rows], limit, offset)
+        if total is None:
+            # page is after the last row
+            total, exact = await self._get_count_by_filter(conn, filter_), True
+        return items, total, exact
+
     async def add(self, obj: dict) -> str:
         async with self.engine.acquire() as conn:
             async with conn.begin():
@@ -104,6 +220,62 @@ class DAOUsers:
         async with self.engine.acquire() as conn:
             return await self._get(conn, object_id)
 
+    async def get_many(self, object_ids: List[str]) -> Dict[str, dict]:
+        """
+        Returns:
+            objects by id, missing ids are skipped
+        """
+        async with self.engine.acquire() as conn:
+            return await self._get_many(conn, object_ids)
+
+    async def add_many(self, objects: List[dict]) -> List[str]:
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                return await self._add_many(conn, objects)
+
+    async def set_many(self, objects: List[dict]):
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                await self._set_many(conn, objects)
+
+    async def upsert_many(self, objects: List[dict]) -> List[str]:
+        """
+        Adds new objects and sets existent ones
+        """
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                return await self._upsert_many(conn, objects)
+
+    async def upsert_if_newer(self, obj: dict, insert_only: Iterable[str] = ()) -> bool:
+        """
+        Writes object of streaming event by one statement: adds new object or sets existent one,
+        if the event is newer than the written one. Object has to have event time
+
+        Args:
+            obj: object with event time
+            insert_only: fields, which are written to new object only
+
+        Returns:
+            False if the event is not newer than the written one, e.g. it's a replayed event
+
+        """
+        # the only statement doesn't need explicit transaction
+        async with self.engine.acquire() as conn:
+            written = await self._upsert_if_newer(conn, obj, insert_only)
+        return written
+
+    async def delete_if_newer(self, object_id: str, event_time: datetime) -> bool:
+        """
+        Deletes object by event, if the event is not older than the written one
+
+        Returns:
+            False if object wasn't deleted: it doesn't exist or it was written by a newer event
+
+        """
+        async with self.engine.acquire() as conn:
+            deleted = await self._delete_if_newer(conn, object_id, event_time)
+        return deleted
+
     async def get_count_by_filter(self, filter_: dict) -> int:
         async with self.engine.acquire() as conn:
             return await self._get_count_by_filter(conn, filter_)
@@ -112,30 +284,74 @@ class DAOUsers:
         async with self.engine.acquire() as conn:
             return await self._get_list_by_filter(conn, filter_, order, limit, offset)
 
-    async def get_all_workers(self):
+    async def get_list_by_cursor(
+            self,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            cursor: str = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        Returns:
+            page after the cursor (the first page without it) and cursor of the next page,
+            which is None for the last page
+        """
+        async with self.engine.acquire() as conn:
+            return await self._get_list_by_cursor(conn, filter_, order, limit, cursor)
+
+    async def get_page(
+            self,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            offset: int
+    ) -> Tuple[List[dict], int, bool]:
+        """
+        Returns:
+            page of filtered objects, total count of filtered objects and flag of exact count.
+            Total count of page and its rows are read by one query
+        """
         async with self.engine.acquire() as conn:
-            # we need to set real limits in future
-            filter_ = {
-                const.ROLE: {
-                    'values': [const.USER_ROLE__WORKER, ]
-                }
+            return await self._get_page(conn, filter_, order, limit, offset)
+
+    async def iter_by_filter(
+            self,
+            filter_: dict,
+            order: List[dict] = None,
+            fetch_size: int = DEFAULT_FETCH_SIZE
+    ) -> AsyncIterator[dict]:
+        """
+        Iterates all filtered objects without limit, only `fetch_size` of them are kept in memory at once
+        """
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+
+        def build():
+            query = self._filtered_query(User.select(), filter_)
+            return self._ordered_query(query, order) if order else query
+
+        sql = self._statements.get_sql(('iter', filter_shape, get_order_shape(order or [])), build)
+        async for row in iter_rows(self.engine, sql, parameters, fetch_size):
+            yield row
+
+    async def get_all_workers(self) -> List[dict]:
+        filter_ = {
+            const.ROLE: {
+                'values': [const.USER_ROLE__WORKER, ]
             }
-            order = []
-            limit = 1000
-            offset = 0
-            return await self._get_list_by_filter(conn, filter_, order, limit, offset)
+        }
+        return [user async for user in self.iter_by_filter(filter_)]
 
-    async def get_random_user_id(self) -> dict:
+    async def get_random_user_id(self) -> str:
         async with self.engine.acquire() as conn:
-            # now its request that gets all users from table
-            # in future we need to set limits
-            filter_ = {}  # means that there are no filtration (return all users)
-            order = []
-            limit = 1000
-            offset = 0
-            all_users = await self._get_list_by_filter(conn, filter_, order, limit, offset)
-            if not all_users:
-                raise NotFound
-            users_count = len(all_users)
-            user_index = random.randint(0, users_count - 1)
-            return all_users[user_index]
+            # user is picked by the server, users aren't fetched
+            row = await (
+                await self._statements.execute(
+                    conn,
+                    'random',
+                    lambda: User.select().order_by(func.random()).limit(bindparam('limit')),
+                    {'limit': 1}
+                )
+            ).first()
+        if row is None:
+            raise NotFound
+        return row[const.ID]
@@ -0,0 +1,287 @@
+"""
+Provides maintenance of time partitions of 'operation' ledger: partitions are created ahead
+and partitions older than retention are detached (archived) or dropped
+"""
+import asyncio
+from datetime import date, datetime, timezone
+import re
+from typing import Dict, List, Optional, Tuple
+
+from aiopg.sa.engine import get_dialect
+
+from analytics.metrics import REGISTRY
+
+
+INTERVAL__DAY = 'day'
+INTERVAL__MONTH = 'month'
+
+RETENTION_ACTION__DETACH = 'detach'
+RETENTION_ACTION__DROP = 'drop'
+
+DEFAULT_INTERVAL = INTERVAL__MONTH
+DEFAULT_AHEAD = 2  # periods after the current one
+DEFAULT_CHECK_INTERVAL = 3600  # seconds
+
+PARTITIONED_TABLE = 'operation'
+
+_NAME_FORMATS = {
+    INTERVAL__DAY: ('{}_p%Y_%m_%d', r'_p\d{4}_\d{2}_\d{2}'),
+    INTERVAL__MONTH: ('{}_p%Y_%m', r'_p\d{4}_\d{2}'),
+}
+
+# only one process of service changes partitions at a time
+_LOCK_KEY = "hashtext('ledger partitions')"
+
+_dialect = get_dialect()
+
+PARTITION_CHANGES = REGISTRY.counter(
+    'ledger_partition_changes_total',
+    'Partitions of ledger created, detached and dropped by maintenance',
+    ('table', 'action')
+)
+# table has no default partition, so rows of time after the last partition can't be written:
+# alert should fire long before it falls to 0
+PARTITIONS_AHEAD = REGISTRY.gauge(
+    'ledger_partitions_ahead',
+    'Periods after the current one, which have partitions of ledger',
+    ('table',)
+)
+
+# bound of partition, which has all time before some day, e.g. history partition of partitioning migration
+_HISTORY_BOUND = re.compile(r"FOR VALUES FROM \(MINVALUE\) TO \('(\d{4}-\d{2}-\d{2})")
+
+
+def get_period_start(moment: date, interval: str) -> date:
+    if interval == INTERVAL__MONTH:
+        return date(moment.year, moment.month, 1)
+    return date(moment.year, moment.month, moment.day)
+
+
+def shift_period(start: date, interval: str, periods: int) -> date:
+    """
+    Returns:
+        start of period, which is the given number of periods after (or before) the period of start
+    """
+    if interval == INTERVAL__MONTH:
+        month = start.year * 12 + start.month - 1 + periods
+        return date(month // 12, month % 12 + 1, 1)
+    return date.fromordinal(start.toordinal() + periods)
+
+
+def get_partition_name(table: str, start: date, interval: str) -> str:
+    return start.strftime(_NAME_FORMATS[interval][0].format(table))
+
+
+def parse_partition_name(table: str, name: str, interval: str) -> Optional[date]:
+    """
+    Returns:
+        start of period of partition or None if name isn't name of partition of the interval
+    """
+    name_format, pattern = _NAME_FORMATS[interval]
+    if not re.fullmatch(re.escape(table) + pattern, name):
+        return None
+    return datetime.strptime(name, name_format.format(table)).date()
+
+
+class PartitionMaintainer:
+    """
+    Keeps partitions of table partitioned by range of time.
+
+    Partitions of the current period and of `ahead` next periods are created in advance,
+    so rows are never written into a missing partition (table has no default partition,
+    row of time without partition isn't written, see PARTITIONS_AHEAD). Partitions, which ended more than `retention`
+    periods before the current one, are detached: they aren't read by queries of table anymore,
+    but stay as standalone tables (moved to archive_schema if it's given) or are dropped.
+    Retention of None keeps all partitions.
+
+    Only partitions named by the configured interval are detached, so history partition made
+    by partitioning migration is left to operator.
+    """
+    def __init__(
+            self,
+            engine,
+            table: str = PARTITIONED_TABLE,
+            interval: str = DEFAULT_INTERVAL,
+            ahead: int = DEFAULT_AHEAD,
+            retention: Optional[int] = None,
+            retention_action: str = RETENTION_ACTION__DETACH,
+            archive_schema: Optional[str] = None,
+            check_interval: float = DEFAULT_CHECK_INTERVAL
+    ):
+        if interval not in _NAME_FORMATS:
+            raise ValueError('Unknown interval of partitions: {}'.format(interval))
+        if retention_action not in (RETENTION_ACTION__DETACH, RETENTION_ACTION__DROP):
+            raise ValueError('Unknown retention action of partitions: {}'.format(retention_action))
+        self.engine = engine
+        self.table = table
+        self.interval = interval
+        self.ahead = ahead
+        self.retention = retention
+        self.retention_action = retention_action
+        self.archive_schema = archive_schema
+        self.check_interval = check_interval
+        self._watcher = None  # type: Optional[asyncio.Task]
+
+    @staticmethod
+    def _quote(name: str) -> str:
+        return _dialect.identifier_preparer.quote(name)
+
+    async def _get_partitions(self, conn) -> Dict[str, str]:
+        """
+        Returns:
+            bounds of partitions by their names
+        """
+        rows = await conn.execute(
+            'SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = %(table)s::regclass',
+            {'table': self._quote(self.table)}
+        )
+        return {row[0]: row[1] async for row in rows}
+
+    @staticmethod
+    def _get_history_end(partitions: Dict[str, str]) -> Optional[date]:
+        """
+        Returns:
+            end of partitions, which have all time before it, None if there are no such partitions
+        """
+        ends = [
+            date.fromisoformat(match.group(1))
+            for match in (_HISTORY_BOUND.match(bound or '') for bound in partitions.values()) if match
+        ]
+        return max(ends, default=None)
+
+    def _has_partition(self, partitions: Dict[str, str], start: date) -> bool:
+        history_end = self._get_history_end(partitions)
+        if history_end is not None and start < history_end:
+            return True
+        if get_partition_name(self.table, start, self.interval) in partitions:
+            return True
+        # partition of the month has days of it, e.g. if interval was changed to day
+        return get_partition_name(self.table, get_period_start(start, INTERVAL__MONTH), INTERVAL__MONTH) in partitions
+
+    def _count_ahead(self, partitions: Dict[str, str], current: date) -> int:
+        """
+        Returns:
+            count of periods after the current one, which have partitions, without gaps
+        """
+        count = 0
+        while self._has_partition(partitions, shift_period(current, self.interval, count + 1)):
+            count += 1
+        return count
+
+    async def _create(self, conn, start: date) -> str:
+        name = get_partition_name(self.table, start, self.interval)
+        end = shift_period(start, self.interval, 1)
+        await conn.execute(
+            'CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%(start)s) TO (%(end)s)'.format(
+                self._quote(name), self._quote(self.table)
+            ),
+            {'start': start.isoformat(), 'end': end.isoformat()}
+        )
+        PARTITION_CHANGES.inc(table=self.table, action='created')
+        return name
+
+    async def _retire(self, conn, name: str):
+        await conn.execute('ALTER TABLE {} DETACH PARTITION {}'.format(self._quote(self.table), self._quote(name)))
+        if self.retention_action == RETENTION_ACTION__DROP:
+            await conn.execute('DROP TABLE {}'.format(self._quote(name)))
+        elif self.archive_schema:
+            await conn.execute('CREATE SCHEMA IF NOT EXISTS {}'.format(self._quote(self.archive_schema)))
+            await conn.execute('ALTER TABLE {} SET SCHEMA {}'.format(
+                self._quote(name), self._quote(self.archive_schema)
+            ))
+        PARTITION_CHANGES.inc(table=self.table, action=self.retention_action)
+
+    async def maintain(self, today: date = None) -> Tuple[List[str], List[str]]:
+        """
+        Creates missing partitions and retires old ones in one transaction.
+        Nothing is done if other process maintains partitions at the same time
+
+        Args:
+            today: day of the current period, today of UTC by default
+
+        Returns:
+            names of created partitions and names of detached or dropped partitions
+
+        """
+        if today is None:
+            today = datetime.now(timezone.utc).date()
+        current = get_period_start(today, self.interval)
+
+        created = []
+        retired = []
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                locked = await conn.scalar('SELECT pg_try_advisory_xact_lock({})'.format(_LOCK_KEY))
+                partitions = await self._get_partitions(conn)
+                if not locked:
+                    PARTITIONS_AHEAD.set(self._count_ahead(partitions, current), table=self.table)
+                    return created, retired
+
+                for periods in range(self.ahead + 1):
+                    start = shift_period(current, self.interval, periods)
+                    # history partition of partitioning migration has the first periods already
+                    if self._has_partition(partitions, start):
+                        continue
+                    name = await self._create(conn, start)
+                    partitions[name] = None
+                    created.append(name)
+
+                if self.retention is not None:
+                    oldest = shift_period(current, self.interval, -self.retention)
+                    for name in sorted(partitions):
+                        start = parse_partition_name(self.table, name, self.interval)
+                        if start is not None and start < oldest:
+                            await self._retire(conn, name)
+                            retired.append(name)
+
+                PARTITIONS_AHEAD.set(self._count_ahead(partitions, current), table=self.table)
+
+        if created or retired:
+            print('Partitions of {}: created {}, {} {}'.format(
+                self.table, created, self.retention_action, retired
+            ))
+        return created, retired
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.maintain()
+            except Exception as e:  # pylint: disable = broad-except
+                print('Partitions maintenance failed: ', e)
+
+    def start(self):
+        """
+        Starts background maintenance of partitions
+        """
+        if self._watcher is None:
+            self._watcher = asyncio.ensure_future(self._watch())
+
+    async def stop(self):
+        """
+        Stops background maintenance of partitions
+        """
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+
+def get_partition_maintainer(engine, config: dict) -> PartitionMaintainer:
+    """
+    Makes maintainer of ledger partitions by 'operation_partitions' section of service config
+    """
+    return PartitionMaintainer(
+        engine,
+        interval=config.get('interval', DEFAULT_INTERVAL),
+        ahead=config.get('ahead', DEFAULT_AHEAD),
+        retention=config.get('retention'),
+        retention_action=config.get('retention_action', RETENTION_ACTION__DETACH),
+        archive_schema=config.get('archive_schema'),
+        check_interval=config.get('check_interval', DEFAULT_CHECK_INTERVAL)
+    )
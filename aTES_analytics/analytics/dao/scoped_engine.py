@@ -0,0 +1,150 @@
+"""
+Provides sharing of one pooled connection between DAO calls of one RPC or one message
+"""
+import asyncio
+from contextlib import asynccontextmanager
+import contextvars
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from aiohttp import web
+from aiopg.sa import Engine, SAConnection
+
+from analytics.metrics import REGISTRY
+
+
+POOL_CONNECTIONS = REGISTRY.gauge(
+    'db_pool_connections',
+    'Connections of the pool by state: used or free',
+    ('state',)
+)
+POOL_MAX_SIZE = REGISTRY.gauge('db_pool_max_size', 'Max size of the pool')
+ACQUIRE_SECONDS = REGISTRY.histogram('db_pool_acquire_seconds', 'Time of waiting for a connection of the pool')
+ACQUIRE_TIMEOUTS = REGISTRY.counter('db_pool_acquire_timeouts_total', 'Connections not acquired in acquire timeout')
+
+_current_scope = contextvars.ContextVar('connection_scope', default=None)
+
+
+class _Scope:
+    def __init__(self):
+        self.connection = None  # type: Optional[SAConnection]
+        # connection can't run queries of several tasks at once,
+        # so tasks started inside the scope use it one by one
+        self.lock = asyncio.Lock()
+        self.owner = None  # type: Optional[asyncio.Task]
+
+
+class ScopedEngine:
+    """
+    Wraps aiopg engine and is passed to DAOs instead of it.
+
+    Outside of scope() acquire() takes a connection from the pool for one DAO call.
+    Inside scope() a connection is taken on the first acquire() and is given to every
+    DAO call of the scope, so one RPC or one message needs one connection at most.
+    The connection goes back to the pool when the scope ends.
+    """
+    def __init__(self, engine: Engine, acquire_timeout: float = None):
+        self.engine = engine
+        self.acquire_timeout = acquire_timeout
+        POOL_MAX_SIZE.set(engine.maxsize)
+
+    def _update_metrics(self) -> None:
+        POOL_CONNECTIONS.set(self.engine.size - self.engine.freesize, state='used')
+        POOL_CONNECTIONS.set(self.engine.freesize, state='free')
+
+    async def _acquire(self) -> SAConnection:
+        started = time.monotonic()
+        try:
+            connection = await asyncio.wait_for(self.engine.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            ACQUIRE_TIMEOUTS.inc()
+            raise
+        ACQUIRE_SECONDS.observe(time.monotonic() - started)
+        self._update_metrics()
+        return connection
+
+    async def _release(self, connection: SAConnection) -> None:
+        # closing of SAConnection returns it to the pool
+        await connection.close()
+        self._update_metrics()
+
+    @asynccontextmanager
+    async def acquire(self):
+        scope = _current_scope.get()
+        if scope is None:
+            connection = await self._acquire()
+            try:
+                yield connection
+            finally:
+                await self._release(connection)
+            return
+
+        task = asyncio.current_task()
+        if scope.owner is task:
+            # nested acquire of the same task
+            yield scope.connection
+            return
+        async with scope.lock:
+            if scope.connection is None:
+                scope.connection = await self._acquire()
+            scope.owner = task
+            try:
+                yield scope.connection
+            finally:
+                scope.owner = None
+
+    @asynccontextmanager
+    async def acquire_unscoped(self):
+        """
+        Takes a connection of the pool for the context, which isn't shared with the scope.
+        Its transaction is independent of transactions of the scope
+        """
+        connection = await self._acquire()
+        try:
+            yield connection
+        finally:
+            await self._release(connection)
+
+    @asynccontextmanager
+    async def scope(self):
+        """
+        DAO calls inside the context share one connection
+        """
+        if _current_scope.get() is not None:
+            yield
+            return
+        scope = _Scope()
+        token = _current_scope.set(scope)
+        try:
+            yield
+        finally:
+            _current_scope.reset(token)
+            if scope.connection is not None:
+                await self._release(scope.connection)
+
+    def close(self) -> None:
+        self.engine.close()
+
+    async def wait_closed(self) -> None:
+        await self.engine.wait_closed()
+
+
+def connection_scope_middleware(engine_key: str = 'engine'):
+    """
+    Makes every request of aiohttp application a connection scope
+    """
+    @web.middleware
+    async def middleware(request, handler):
+        async with request.app[engine_key].scope():
+            return await handler(request)
+    return middleware
+
+
+def with_connection_scope(callback: Callable[..., Awaitable], engine: ScopedEngine) -> Callable[..., Awaitable]:
+    """
+    Makes every call of rabbitmq consumer's callback a connection scope
+    """
+    async def scoped_callback(*args: Any) -> Any:
+        async with engine.scope():
+            return await callback(*args)
+    return scoped_callback
@@ -4,16 +4,22 @@ Database objects definitions
 from aiopg.sa import create_engine
 from sqlalchemy import DateTime, Integer, MetaData, Table, Column, String, PrimaryKeyConstraint
 
+from analytics.dao.scoped_engine import ScopedEngine
 
-async def init_engine(db_config) -> 'Engine':
+
+async def init_engine(db_config) -> ScopedEngine:
     """
     Engine initialization
     """
-    return await create_engine(
+    engine = await create_engine(
         database=db_config['name'],
         host=db_config['host'],
         user=db_config['user'],
-        password=db_config['password'])
+        password=db_config['password'],
+        minsize=db_config.get('pool_min_size', 1),
+        maxsize=db_config.get('pool_max_size', 10),
+        pool_recycle=db_config.get('pool_recycle', -1))
+    return ScopedEngine(engine, acquire_timeout=db_config.get('acquire_timeout'))
 
 
 metadata = MetaData()
@@ -29,7 +35,8 @@ Operation = Table(
     Column('debit', Integer),  # списание
     Column('credit', Integer),  # пополнение
     Column('time', DateTime),
-    PrimaryKeyConstraint('id', name='operation__id__pkey')
+    # table is partitioned by range of time, so time is a part of primary key
+    PrimaryKeyConstraint('id', 'time', name='operation__id__time__pkey')
 )
 
 # договоримся, что в системе может быть лишь один открытый analytics_cycle
@@ -44,19 +51,35 @@ BillingCycle = Table(
 )
 
 
+# projections of tasks and users of streaming events.
+# event_time is time of the last written event, older events don't change a row
 Task = Table(
     'task',
     metadata,
     Column('id', String),
-    Column('assigned_worker', String),
-    Column('price', Integer),
+    Column('name', String),
+    Column('description', String),
+    Column('assigned_worker_id', String),  # link to table 'user'
+    Column('assign_price', Integer),
+    Column('finish_price', Integer),
+    Column('event_time', DateTime(timezone=True)),
     PrimaryKeyConstraint('id', name='task__id__pkey')
 )
 
+User = Table(
+    'user',
+    metadata,
+    Column('id', String),
+    Column('login', String),
+    Column('role', String),
+    Column('event_time', DateTime(timezone=True)),
+    PrimaryKeyConstraint('id', name='user__id__pkey')
+)
+
 PersonalBalance = Table(
     'personal_balance',
     metadata,
     Column('user_id', String),
     Column('value', Integer),
-    PrimaryKeyConstraint('id', name='personal_account__user_id__pkey')
+    PrimaryKeyConstraint('user_id', name='personal_account__user_id__pkey')
 )
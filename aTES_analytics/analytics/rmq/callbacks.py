@@ -2,7 +2,6 @@
 Provides callbacks for rabbitmq
 """
 from datetime import datetime, timezone
-import json
 
 from analytics import const
 from analytics.dao.dao_tasks import handle_task_data
@@ -11,33 +10,45 @@ from analytics.rmq.publisher import RabbitMQPublisher
 from analytics.schema_registry.validator import SchemaRegistryValidator
 
 
+def entity_partition_key(message: dict) -> str:
+    """
+    Partition key of streaming events: events of one entity are handled in order
+    """
+    return message['body']['data']['id']
+
+
+def worker_partition_key(message: dict) -> str:
+    """
+    Partition key of workflow events: every event changes balance of the assigned worker,
+    so events of one worker are handled in order
+    """
+    data = message['body']['data']
+    return data.get(const.ASSIGNED_WORKER_ID) or data['assigned_task_id']
+
+
 async def user_callback(message, data):
-    message_body = json.loads(message['body'])
+    message_body = message['body']
     app = data
     data = message_body['data']
     event = message_body['event_name']
 
-    if event == const.EVENT__USER_CREATED:
-        await app['dao_users'].add({
-            'id': data['id'],
-            'login': data['name'],
-            'role': data['description']
-        })
-        return
-    if event == const.EVENT__USER_UPDATED:
-        await app['dao_users'].set({
+    # created and updated events are written the same way, so replays and events of
+    # parallel consumers can't fail on existent or absent user
+    if event in (const.EVENT__USER_CREATED, const.EVENT__USER_UPDATED):
+        await app['dao_users'].upsert_if_newer({
             'id': data['id'],
             'login': data['name'],
-            'role': data['description']
+            'role': data['description'],
+            const.EVENT_TIME: message_body[const.EVENT_TIME]
         })
         return
     if event == const.EVENT__USER_DELETED:
-        await app['dao_users'].delete(data['id'])
+        await app['dao_users'].delete_if_newer(data['id'], message_body[const.EVENT_TIME])
         return
 
 
 async def task_callback(message, data):
-    message_body = json.loads(message['body'])
+    message_body = message['body']
     app = data
     data = message_body['data']
     event = message_body['event_name']
@@ -47,7 +58,8 @@ async def task_callback(message, data):
             'id': data['id'],
             'name': data['name'],
             'description': data['description'],
-            'assigned_worker': data['description']
+            const.ASSIGNED_WORKER_ID: data.get(const.ASSIGNED_WORKER_ID),
+            const.EVENT_TIME: message_body[const.EVENT_TIME]
         }
         await handle_task_data(task, app['dao_tasks'])
         return
@@ -72,18 +84,22 @@ async def _handle_assigned_task(task_id, dao_analytics, dao_tasks) -> dict:
     return operation
 
 
+def get_operation_message(operation: dict, validator: SchemaRegistryValidator) -> dict:
+    data = {
+        **operation,
+        const.OPERATION_ID: operation[const.ID]
+    }
+    data.pop(const.ID)
+    return get_message(data, const.EVENT__OPERATION_CREATED, validator)
+
+
 async def stream_new_operation(
         operation: dict,
         routing_key: str,
         publisher: RabbitMQPublisher,
         validator: SchemaRegistryValidator
 ):
-    data = {
-        **operation,
-        const.OPERATION_ID: operation[const.ID]
-    }
-    data.pop(const.ID)
-    message = get_message(data, const.EVENT__OPERATION_CREATED, validator)
+    message = get_operation_message(operation, validator)
     await publish_message(
         publisher,
         routing_key,
@@ -111,7 +127,7 @@ async def _handle_finished_task(task_id, dao_analytics, dao_tasks) -> dict:
 
 
 async def task_workflow_callback(message, data):
-    message_body = json.loads(message['body'])
+    message_body = message['body']
     app = data
     data = message_body['data']
     event = message_body['event_name']
@@ -0,0 +1,112 @@
+"""
+Provides encoding of event messages for rabbitmq
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime
+import json
+from typing import Dict, Optional
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+CONTENT_TYPE__JSON = 'application/json'
+CONTENT_TYPE__MSGPACK = 'application/msgpack'
+
+# messages published before codecs were introduced have no content type
+DEFAULT_CONTENT_TYPE = CONTENT_TYPE__JSON
+
+DATETIME_FIELDS = ('event_time',)
+
+
+class UnsupportedContentType(Exception):
+    """
+    Raises if there is no codec for content type of a message
+    """
+
+
+class Codec(ABC):
+    """
+    Encodes message dict to message body and back
+    """
+    content_type = None  # type: str
+
+    @abstractmethod
+    def encode(self, message: dict) -> bytes:
+        pass
+
+    @abstractmethod
+    def decode(self, body: bytes) -> dict:
+        pass
+
+
+class JSONCodec(Codec):
+    """
+    Datetimes are written as ISO 8601 strings and envelope's datetime fields
+    are parsed back, so decoded message is the same as with binary codec
+    """
+    content_type = CONTENT_TYPE__JSON
+
+    @staticmethod
+    def _default(obj):
+        if isinstance(obj, datetime):
+            return obj.isoformat()
+        raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+    def encode(self, message: dict) -> bytes:
+        return json.dumps(message, default=self._default, separators=(',', ':')).encode()
+
+    def decode(self, body: bytes) -> dict:
+        message = json.loads(body)
+        for field in DATETIME_FIELDS:
+            if isinstance(message.get(field), str):
+                message[field] = datetime.fromisoformat(message[field])
+        return message
+
+
+class MsgPackCodec(Codec):
+    """
+    Compact binary encoding. Datetimes are written with msgpack timestamp extension,
+    so they have to be timezone aware.
+    """
+    content_type = CONTENT_TYPE__MSGPACK
+
+    def encode(self, message: dict) -> bytes:
+        return msgpack.packb(message, datetime=True)
+
+    def decode(self, body: bytes) -> dict:
+        # timestamp=3 - timestamps are decoded to timezone aware datetimes
+        return msgpack.unpackb(body, timestamp=3)
+
+
+CODECS = {JSONCodec.content_type: JSONCodec()}  # type: Dict[str, Codec]
+if msgpack is not None:
+    CODECS[MsgPackCodec.content_type] = MsgPackCodec()
+
+
+def get_codec(content_type: Optional[str] = None) -> Codec:
+    """
+    Returns codec for publishing messages.
+    Falls back to JSON if library of configured codec isn't installed.
+    """
+    content_type = content_type or DEFAULT_CONTENT_TYPE
+    if content_type not in CODECS:
+        print('Codec for {} is not available, {} is used'.format(content_type, DEFAULT_CONTENT_TYPE))
+        content_type = DEFAULT_CONTENT_TYPE
+    return CODECS[content_type]
+
+
+def decode(body: bytes, content_type: Optional[str] = None) -> dict:
+    """
+    Decodes message of any supported content type, so consumers accept messages
+    of producers using different codecs (e.g. during switching to binary encoding)
+
+    Raises:
+        UnsupportedContentType
+    """
+    codec = CODECS.get(content_type or DEFAULT_CONTENT_TYPE)
+    if codec is None:
+        raise UnsupportedContentType(content_type)
+    return codec.decode(body)
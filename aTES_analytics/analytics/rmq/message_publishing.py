@@ -1,8 +1,8 @@
 """
 Provides tools for publishing messages
 """
-from datetime import datetime
-import json
+import asyncio
+from datetime import datetime, timezone
 import uuid
 
 from analytics.exceptions import InvalidParams
@@ -12,7 +12,7 @@ from analytics.schema_registry.validator import SchemaRegistryValidator
 
 def get_default_message_data(version: int = 1) -> dict:
     return {
-        'event_time': datetime.now(),
+        'event_time': datetime.now(timezone.utc),
         'event_version': version,
         'event_id': uuid.uuid4().hex
     }
@@ -35,4 +35,17 @@ async def publish_message(
         publisher: RabbitMQPublisher,
         routing_key: str,
         message: dict):
-    await publisher.publish(routing_key, json.dumps(message))
+    await publisher.publish(routing_key, message)
+
+
+def enqueue_message(
+        publisher: RabbitMQPublisher,
+        routing_key: str,
+        message: dict) -> asyncio.Future:
+    """
+    Puts message to publisher's buffer without waiting for its confirmation
+
+    Returns:
+        future, which is resolved when message is confirmed by RabbitMQ
+    """
+    return publisher.enqueue(routing_key, message)
@@ -2,32 +2,71 @@
 Provides tool publishing messages to rabbitmq
 """
 import asyncio
+import functools
+import time
+from typing import List, Optional, Set, Tuple
 
-import aio_pika
 from aio_pika import Message
 from aio_pika.abc import AbstractRobustConnection, DeliveryMode
 
+from analytics.metrics import REGISTRY, get_event_name
+from analytics.rmq.codecs import Codec, get_codec
+
+
+PUBLISHED_MESSAGES = REGISTRY.counter(
+    'rmq_publisher_messages_total',
+    'Published messages by result: confirmed or failed',
+    ('exchange', 'routing_key', 'event', 'result')
+)
+CONFIRM_SECONDS = REGISTRY.histogram(
+    'rmq_publisher_confirm_seconds',
+    'Time from enqueueing of message to its confirmation by RabbitMQ',
+    ('exchange', 'routing_key', 'event')
+)
+
 
 class RabbitMQPublisher:
+    """
+    Publishes messages to exchange on a channel with publisher confirms.
+
+    Messages are buffered and flushed when `batch_size` messages are collected
+    or `linger` seconds passed since the first buffered message. On flush every message
+    is published by its own exchange.publish() task in order of enqueueing, and it is confirmed
+    separately, so `batch_size` only sets how long messages linger in the buffer.
+    batch_size=1 means that every message is flushed immediately.
+
+    Messages are encoded by `codec` (JSON by default), its content type is set
+    to message properties, so consumers know how to decode the message.
+    """
     def __init__(
             self,
             rabbit_connection: AbstractRobustConnection,
             exchange_name: str,
             exchange_type: str,
             exchange_durable: bool = False,
-            exchange_auto_delete: bool = True
+            exchange_auto_delete: bool = True,
+            batch_size: int = 1,
+            linger: float = 0.005,
+            codec: Codec = None
     ):
         self.connection = rabbit_connection
         self.exchange_name = exchange_name
         self.exchange_type = exchange_type
         self.exchange_durable = exchange_durable
         self.exchange_auto_delete = exchange_auto_delete
+        self.batch_size = max(1, batch_size)
+        self.linger = linger
+        self.codec = codec or get_codec()
 
         self.channel = None
         self.exchange = None
 
+        self._buffer = []  # type: List[Tuple[str, Message, asyncio.Future]]
+        self._linger_timer = None  # type: Optional[asyncio.TimerHandle]
+        self._publishings = set()  # type: Set[asyncio.Future]
+
     async def connect(self):
-        self.channel = await self.connection.channel()
+        self.channel = await self.connection.channel(publisher_confirms=True)
         self.exchange = await self.channel.declare_exchange(
             self.exchange_name,
             self.exchange_type,
@@ -39,35 +78,111 @@ class RabbitMQPublisher:
         """
         Disconnects from RabbitMQ
         """
+        await self.flush()
         if self.channel and not self.channel.is_closed:
             await self.channel.close()
 
-    async def publish(
+    def enqueue(
             self,
             routing_key: str,
-            message_body: str,
+            message_body: dict,
             correlation_id: str = None,
-            persistent: bool = False
-    ) -> None:
+            persistent: bool = True
+    ) -> asyncio.Future:
         """
-        Publish message to RabbitMQ
+        Put message to publishing buffer
 
         Args:
             routing_key: routing key
             message_body: message
             correlation_id:
-            persistent: flag message to keep it on hard disk by RabbitMQ
+            persistent: flag message to keep it on hard disk by RabbitMQ, so it survives restart of broker
+
+        Returns:
+            future, which is resolved when RabbitMQ confirms the message
+            or fails with the publishing error. It may be left unawaited: failure is counted by metrics
 
         """
-        print('Publisher %s: enqueue %s', self.exchange_name, message_body)
         message = Message(
-            message_body.encode(),
+            self.codec.encode(message_body),
+            content_type=self.codec.content_type,
             correlation_id=correlation_id,
             delivery_mode=DeliveryMode.PERSISTENT if persistent else DeliveryMode.NOT_PERSISTENT
         )
-        print('routing_key = ', routing_key)
-        await self.exchange.publish(
-            message,
-            routing_key=routing_key,
-        )
-        print('Message %s sent', message)
+        confirmation = asyncio.get_event_loop().create_future()
+        confirmation.add_done_callback(functools.partial(
+            self._observe,
+            {'exchange': self.exchange_name, 'routing_key': routing_key, 'event': get_event_name(message_body)},
+            time.monotonic()
+        ))
+        self._buffer.append((routing_key, message, confirmation))
+
+        if len(self._buffer) >= self.batch_size:
+            self._flush_buffer()
+        elif self._linger_timer is None:
+            self._linger_timer = asyncio.get_event_loop().call_later(self.linger, self._flush_buffer)
+        return confirmation
+
+    async def publish(
+            self,
+            routing_key: str,
+            message_body: dict,
+            correlation_id: str = None,
+            persistent: bool = True
+    ) -> None:
+        """
+        Publish message to RabbitMQ and wait for its confirmation
+
+        Args:
+            routing_key: routing key
+            message_body: message
+            correlation_id:
+            persistent: flag message to keep it on hard disk by RabbitMQ, so it survives restart of broker
+
+        """
+        await self.enqueue(routing_key, message_body, correlation_id, persistent)
+
+    async def flush(self) -> None:
+        """
+        Publishes buffered messages and waits for confirmation of all sent messages
+        """
+        self._flush_buffer()
+        if self._publishings:
+            await asyncio.gather(*self._publishings, return_exceptions=True)
+
+    def _flush_buffer(self) -> None:
+        if self._linger_timer is not None:
+            self._linger_timer.cancel()
+            self._linger_timer = None
+
+        batch, self._buffer = self._buffer, []
+        for routing_key, message, confirmation in batch:
+            # tasks start in order of creation, so messages are written to the channel in the same order
+            publishing = asyncio.ensure_future(self.exchange.publish(message, routing_key=routing_key))
+            self._publishings.add(publishing)
+            publishing.add_done_callback(self._publishings.discard)
+            publishing.add_done_callback(functools.partial(self._confirm, confirmation))
+
+    @staticmethod
+    def _confirm(confirmation: asyncio.Future, publishing: asyncio.Future) -> None:
+        # error of publishing is retrieved even if confirmation is cancelled already
+        error = None if publishing.cancelled() else publishing.exception()
+        if confirmation.done():
+            return
+        if publishing.cancelled():
+            confirmation.cancel()
+        elif error is not None:
+            confirmation.set_exception(error)
+        else:
+            confirmation.set_result(None)
+
+    @staticmethod
+    def _observe(labels: dict, started: float, confirmation: asyncio.Future) -> None:
+        # confirmation of enqueue() may be never awaited, its error is retrieved here,
+        # so it isn't reported as "Future exception was never retrieved"
+        error = None if confirmation.cancelled() else confirmation.exception()
+        if confirmation.cancelled() or error is not None:
+            PUBLISHED_MESSAGES.inc(result='failed', **labels)
+            return
+        PUBLISHED_MESSAGES.inc(result='confirmed', **labels)
+        CONFIRM_SECONDS.observe(time.monotonic() - started, **labels)
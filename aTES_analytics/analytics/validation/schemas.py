@@ -62,21 +62,27 @@ STRING_FILTER = {
         'type': 'string',
         'coerce': 'strip',
         'minlength': 1,
-        'excludes': ['ilike', 'value']
+        'excludes': ['ilike', 'value', 'search']
     },
     'ilike': {
         'type': 'string',
         'coerce': 'strip',
         'minlength': 1,
-        'excludes': ['like', 'value']
+        'excludes': ['like', 'value', 'search']
     },
     'values': {
         'type': 'list',
         'minlength': 1,
-        'excludes': ['like', 'ilike'],
+        'excludes': ['like', 'ilike', 'search'],
         'schema': {
             'type': 'string'
         }
+    },
+    'search': {
+        'type': 'string',
+        'coerce': 'strip',
+        'minlength': 1,
+        'excludes': ['like', 'ilike', 'value']
     }
 }
 
@@ -87,6 +93,20 @@ SIMPLE_FILTER = {
     }
 }
 
+# half-open range of time: from <= time < to, ISO 8601 strings
+TIME_FILTER = {
+    'from': {
+        'type': 'string',
+        'coerce': 'strip',
+        'minlength': 1
+    },
+    'to': {
+        'type': 'string',
+        'coerce': 'strip',
+        'minlength': 1
+    }
+}
+
 FILTER = {
     const.ID: {
         'type': 'dict',
@@ -107,6 +127,21 @@ FILTER = {
         'type': 'dict',
         'schema': SIMPLE_FILTER
     },
+    const.BILLING_CYCLE_ID: {
+        'type': 'dict',
+        'schema': {
+            'values': {
+                'type': 'list',
+                'schema': {
+                    'type': 'string'
+                }
+            }
+        }
+    },
+    const.TIME: {
+        'type': 'dict',
+        'schema': TIME_FILTER
+    },
 
 
 
@@ -149,9 +184,15 @@ GET_LIST_BY_FILTER = {
     'offset': {
         'type': 'integer',
         'min': 0
+    },
+    'cursor': {
+        'type': 'string',
+        'nullable': True
     }
 }
 
+GET_PAGE = {key: value for key, value in GET_LIST_BY_FILTER.items() if key != 'cursor'}
+
 
 def validate_task(obj: dict, schema: dict) -> Dict[str, list]:
     """
@@ -43,7 +43,7 @@ def upgrade():
         'personal_balance',
         sa.Column('user_id', sa.String),
         sa.Column('value', sa.Integer),
-        sa.PrimaryKeyConstraint('id', name='personal_account__user_id__pkey')
+        sa.PrimaryKeyConstraint('user_id', name='personal_account__user_id__pkey')
         )
 
     op.create_table(
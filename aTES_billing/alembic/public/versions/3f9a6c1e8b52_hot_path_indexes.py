@@ -0,0 +1,51 @@
+"""Indexes of hot query paths
+
+Revision ID: 3f9a6c1e8b52
+Revises: 7e3b0d2c61f4
+Create Date: 2026-10-18 12:41:07.183954
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a6c1e8b52'
+down_revision = '7e3b0d2c61f4'
+branch_labels = None
+depends_on = None
+
+# name, table, columns
+INDEXES = [
+    # ledger of worker, ordered by time; serves lookups by worker_id alone too
+    ('operation__worker_id__time__idx', 'operation', ['worker_id', 'time']),
+    ('operation__billing_cycle_id__idx', 'operation', ['billing_cycle_id']),
+    ('operation__time__idx', 'operation', ['time']),
+]
+
+
+def upgrade():
+    # DAOBilling writes status as 'opened' / 'closed'
+    op.alter_column('billing_cycle', 'status', type_=sa.String, postgresql_using='status::varchar')
+
+    # CREATE INDEX CONCURRENTLY doesn't lock writes, but can't run inside transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+        # only one billing cycle can be opened, and it is found by the index on every billing event
+        op.create_index(
+            'billing_cycle__status__opened__uniq',
+            'billing_cycle',
+            ['status'],
+            unique=True,
+            postgresql_where=sa.text("status = 'opened'"),
+            postgresql_concurrently=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('billing_cycle__status__opened__uniq', table_name='billing_cycle', postgresql_concurrently=True)
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+    # status stays varchar: integer column can't keep values written by DAOBilling
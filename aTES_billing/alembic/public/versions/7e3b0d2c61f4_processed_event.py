@@ -0,0 +1,29 @@
+"""Processed events for idempotent ledger writes
+
+Revision ID: 7e3b0d2c61f4
+Revises: 11c205c4104c
+Create Date: 2026-10-18 11:03:52.615740
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e3b0d2c61f4'
+down_revision = '11c205c4104c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'processed_event',
+        sa.Column('event_id', sa.String),
+        sa.Column('processed_at', sa.DateTime, server_default=sa.func.now()),
+        sa.PrimaryKeyConstraint('event_id', name='processed_event__event_id__pkey')
+    )
+
+
+def downgrade():
+    op.drop_table('processed_event')
@@ -0,0 +1,47 @@
+"""Balance snapshots of closed billing cycles
+
+Revision ID: 8f2d4b6a1c93
+Revises: 5c9e1f7a3d26
+Create Date: 2026-10-18 19:12:35.902617
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f2d4b6a1c93'
+down_revision = '5c9e1f7a3d26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # cycles without snapshot are summed on rebuild of balances, so existing ones are left without it:
+    # the first snapshot includes the whole ledger
+    op.add_column('billing_cycle', sa.Column('snapshot_id', sa.String))
+
+    op.create_table(
+        'balance_snapshot',
+        sa.Column('id', sa.String),
+        sa.Column('billing_cycle_id', sa.String),
+        sa.Column('taken_at', sa.DateTime, server_default=sa.func.now()),
+        sa.PrimaryKeyConstraint('id', name='balance_snapshot__id__pkey')
+    )
+    # the latest snapshot is the base of balances
+    op.create_index('balance_snapshot__taken_at__idx', 'balance_snapshot', ['taken_at'])
+
+    op.create_table(
+        'balance_snapshot_value',
+        sa.Column('snapshot_id', sa.String),
+        sa.Column('user_id', sa.String),
+        sa.Column('value', sa.Integer),
+        sa.PrimaryKeyConstraint('snapshot_id', 'user_id', name='balance_snapshot_value__snapshot_id__user_id__pkey')
+    )
+
+
+def downgrade():
+    op.drop_table('balance_snapshot_value')
+    op.drop_index('balance_snapshot__taken_at__idx', table_name='balance_snapshot')
+    op.drop_table('balance_snapshot')
+    op.drop_column('billing_cycle', 'snapshot_id')
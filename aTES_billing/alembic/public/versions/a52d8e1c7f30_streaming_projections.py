@@ -0,0 +1,52 @@
+"""Projections of streamed tasks and users, which are written by upsert
+
+Revision ID: a52d8e1c7f30
+Revises: 3f9a6c1e8b52
+Create Date: 2026-10-18 16:02:11.480126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a52d8e1c7f30'
+down_revision = '3f9a6c1e8b52'
+branch_labels = None
+depends_on = None
+
+TASK_COLUMNS = [
+    sa.Column('name', sa.String),
+    sa.Column('description', sa.String),
+    sa.Column('assigned_worker_id', sa.String),
+    sa.Column('assign_price', sa.Integer),
+    sa.Column('finish_price', sa.Integer),
+    # time of the last written event, older events don't change a row
+    sa.Column('event_time', sa.DateTime(timezone=True)),
+]
+
+
+def upgrade():
+    # task had columns, which streaming events don't have
+    op.drop_column('task', 'assigned_worker')
+    op.drop_column('task', 'price')
+    for column in TASK_COLUMNS:
+        op.add_column('task', column)
+
+    op.create_table(
+        'user',
+        sa.Column('id', sa.String),
+        sa.Column('login', sa.String),
+        sa.Column('role', sa.String),
+        sa.Column('event_time', sa.DateTime(timezone=True)),
+        sa.PrimaryKeyConstraint('id', name='user__id__pkey')
+    )
+
+
+def downgrade():
+    op.drop_table('user')
+
+    for column in reversed(TASK_COLUMNS):
+        op.drop_column('task', column.name)
+    op.add_column('task', sa.Column('assigned_worker', sa.String))
+    op.add_column('task', sa.Column('price', sa.Integer))
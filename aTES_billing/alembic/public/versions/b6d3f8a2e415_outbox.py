@@ -0,0 +1,32 @@
+"""Outbox for billing events
+
+Revision ID: b6d3f8a2e415
+Revises: 8f2d4b6a1c93
+Create Date: 2026-10-18 21:04:52.318604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d3f8a2e415'
+down_revision = '8f2d4b6a1c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'outbox',
+        sa.Column('id', sa.BigInteger),  # bigserial, defines publishing order
+        sa.Column('exchange', sa.String),
+        sa.Column('routing_key', sa.String),
+        sa.Column('body', sa.Text),
+        sa.Column('created_at', sa.DateTime, server_default=sa.func.now()),
+        sa.PrimaryKeyConstraint('id', name='outbox__id__pkey')
+    )
+
+
+def downgrade():
+    op.drop_table('outbox')
@@ -0,0 +1,42 @@
+"""Primary key of personal balance on user_id
+
+Revision ID: c7e2a9f4d318
+Revises: b6d3f8a2e415
+Create Date: 2026-10-18 22:14:36.702519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e2a9f4d318'
+down_revision = 'b6d3f8a2e415'
+branch_labels = None
+depends_on = None
+
+PKEY = 'personal_account__user_id__pkey'
+PKEY_INDEX = 'personal_balance__user_id__idx'
+
+
+def upgrade():
+    # initial revision had primary key on missing column, so table of database, which was migrated
+    # before it was fixed, has another or no primary key. Balances are upserted by user_id
+    pkey = op.get_bind().execute(sa.text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = 'personal_balance'::regclass AND contype = 'p'"
+    )).first()
+    if pkey is not None and pkey[1] == 'PRIMARY KEY (user_id)':
+        return
+
+    # index is built without lock of writes and becomes primary key
+    with op.get_context().autocommit_block():
+        op.create_index(PKEY_INDEX, 'personal_balance', ['user_id'], unique=True, postgresql_concurrently=True)
+    if pkey is not None:
+        op.drop_constraint(pkey[0], 'personal_balance', type_='primary')
+    op.execute('ALTER TABLE personal_balance ADD CONSTRAINT {} PRIMARY KEY USING INDEX {}'.format(PKEY, PKEY_INDEX))
+
+
+def downgrade():
+    # primary key on user_id is the only one, which is valid for the table, so it's kept
+    pass
@@ -0,0 +1,31 @@
+"""Index of processed events by time
+
+Revision ID: d8f1b3e6a592
+Revises: c7e2a9f4d318
+Create Date: 2026-10-18 23:58:40.726193
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8f1b3e6a592'
+down_revision = 'c7e2a9f4d318'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # retention deletes expired events by processed_at
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'processed_event__processed_at__idx',
+            'processed_event',
+            ['processed_at'],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('processed_event__processed_at__idx', table_name='processed_event', postgresql_concurrently=True)
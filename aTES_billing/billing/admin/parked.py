@@ -0,0 +1,36 @@
+"""
+Admin handlers for messages parked by consumers
+"""
+from typing import Dict
+
+from aiohttp import web
+from aiohttp.web_request import Request
+
+from billing.rmq.consumer import RabbitMQConsumer
+
+
+async def handle_replay_parked(request: Request) -> web.Response:
+    """
+    Moves parked messages back to queues of their consumers
+
+    Query parameters:
+        consumer: name of consumer, all consumers by default
+        limit: max count of messages to replay for each consumer, all of them by default
+
+    Returns:
+        {consumer name: count of replayed messages}
+    """
+    consumers = request.app['consumers']  # type: Dict[str, RabbitMQConsumer]
+    consumer_name = request.query.get('consumer')
+    if consumer_name is not None and consumer_name not in consumers:
+        raise web.HTTPNotFound(text='Unknown consumer {}'.format(consumer_name))
+    try:
+        limit = int(request.query['limit']) if 'limit' in request.query else None
+    except ValueError:
+        raise web.HTTPBadRequest(text='limit must be an integer')
+
+    result = {}
+    for name, consumer in consumers.items():
+        if consumer_name in (None, name):
+            result[name] = await consumer.replay_parked(limit)
+    return web.json_response(result)
@@ -1,11 +1,12 @@
 """
 Implementation of a service
 """
-from typing import List
+from typing import List, Union
 
 from aiohttp_jsonrpc.handler import JSONRPCView
 from aiohttp_cors import CorsViewMixin
 
+from billing.dao.dao_billing import DAOBilling
 from billing.dao.dao_users import DAOUsers
 from billing.exceptions import Forbidden, InvalidParams, NotFound, Unauthorized
 from billing.schema_registry.validator import SchemaRegistryValidator
@@ -32,6 +33,10 @@ class OperationsService(CorsViewMixin, JSONRPCView):
     def _dao_users(self) -> DAOUsers:
         return self.request.app['dao_users']
 
+    @property
+    def _dao_billing(self) -> DAOBilling:
+        return self.request.app['dao_billing']
+
     @property
     def _config(self) -> dict:
         return self.request.app['config']
@@ -113,7 +118,8 @@ class OperationsService(CorsViewMixin, JSONRPCView):
                                      filter: dict,  # pylint: disable = redefined-builtin
                                      order: List[dict],
                                      limit: int,
-                                     offset: int) -> List[dict]:
+                                     offset: int = 0,
+                                     cursor: str = None) -> Union[List[dict], dict]:
         """
         Get items by filter
 
@@ -135,11 +141,48 @@ class OperationsService(CorsViewMixin, JSONRPCView):
                     ...
                 ]
             limit: maximum count of items
-            offset: offset from the beginning of the query
+            offset: offset from the beginning of the query, isn't used with cursor
+            cursor: turns on cursor mode over operations ledger: "" for the first page,
+                then "next_cursor" of the previous page. Page is found by seek on sort keys
+                instead of skipping `offset` items, so it takes the same time at any depth
 
         Returns:
-            List of dicts with entities
+            List of dicts with entities, in cursor mode
+                {
+                    "items": [...],
+                    "next_cursor": "..." or null on the last page
+                }
 
         """
         self._authenticated()
+        if cursor is not None:
+            items, next_cursor = await self._dao_billing.get_list_by_cursor(filter, order, limit, cursor)
+            return {'items': items, 'next_cursor': next_cursor}
         return await self._dao_tasks.get_list_by_filter(filter, order, limit, offset)
+
+    async def rpc_get_page(self,
+                           filter: dict,  # pylint: disable = redefined-builtin
+                           order: List[dict],
+                           limit: int,
+                           offset: int = 0) -> dict:
+        """
+        Get page of items by filter with total count of filtered items.
+        Replaces get_count_by_filter + get_list_by_filter: both are read by one query
+
+        Args:
+            filter: same as in get_list_by_filter
+            order: same as in get_list_by_filter
+            limit: maximum count of items
+            offset: offset from the beginning of the query
+
+        Returns:
+            {
+                "items": [...],
+                "total": count of filtered items,
+                "total_exact": false if total of not filtered large table is estimated by database statistics
+            }
+
+        """
+        self._authenticated()
+        items, total, total_exact = await self._dao_tasks.get_page(filter, order, limit, offset)
+        return {'items': items, 'total': total, 'total_exact': total_exact}
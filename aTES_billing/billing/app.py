@@ -7,17 +7,44 @@ import aio_pika
 from aiohttp import web
 import aiohttp_cors
 
+from billing import const
 from billing.cron.daily import handle_daily_withdraw
 from billing.dao.dao_billing import DAOBilling
+from billing.dao.dao_outbox import DAOOutbox
 from billing.dao.dao_users import DAOUsers
+from billing.dao.partitions import get_partition_maintainer
+from billing.dao.lookup_cache import DEFAULT_LOOKUP_CACHE_SIZE, DEFAULT_LOOKUP_CACHE_TTL
+from billing.admin.parked import handle_replay_parked
+from billing.dao.scoped_engine import connection_scope_middleware, with_connection_scope
 from billing.db import init_engine
+from billing.metrics import handle_metrics
 from billing.dao.dao_tasks import DAOTasks
 
 from billing.api.operations import OperationsService
-from billing.rmq.callbacks import user_callback
+from billing.rmq.callbacks import (
+    cache_invalidation_callback,
+    entity_partition_key,
+    get_operation_outbox_message,
+    task_callback,
+    task_workflow_callback,
+    user_callback,
+    worker_partition_key
+)
+from billing.rmq.codecs import get_codec
 from billing.rmq.consumer import RabbitMQConsumer
+from billing.rmq.deduplication import (
+    DEFAULT_PROCESSED_EVENTS_CACHE_SIZE,
+    DEFAULT_PROCESSED_EVENTS_CHECK_INTERVAL,
+    DEFAULT_PROCESSED_EVENTS_DELETE_BATCH_SIZE,
+    DEFAULT_PROCESSED_EVENTS_MAX_AGE,
+    ProcessedEvents,
+    ProcessedEventsRetention
+)
+from billing.rmq.ledger_batcher import LedgerBatcher
+from billing.rmq.outbox_relay import OutboxRelay
 from billing.rmq.publisher import RabbitMQPublisher
-from billing.schema_registry.validator import SchemaRegistryValidator
+from billing.rmq.retry import get_retry_policy
+from billing.schema_registry.validator import DEFAULT_RELOAD_INTERVAL, SchemaRegistryValidator
 
 
 async def on_app_start(app):
@@ -39,10 +66,19 @@ async def on_app_start(app):
     )
 
     app['rabbit_connection'] = rabbit_connection
+    codec = get_codec(rabbitmq_config.get('content_type'))
+    exchange_options = {
+        'exchange_durable': rabbitmq_config.get('exchange_durable', False),
+        'exchange_auto_delete': rabbitmq_config.get('exchange_auto_delete', True)
+    }
     operation_publisher = RabbitMQPublisher(
         rabbit_connection,
         exchange_name=config['exchanges']['operation_streaming']['name'],
-        exchange_type=config['exchanges']['operation_streaming']['type']
+        exchange_type=config['exchanges']['operation_streaming']['type'],
+        batch_size=rabbitmq_config.get('publish_batch_size', 1),
+        linger=rabbitmq_config.get('publish_linger', 0.005),
+        codec=codec,
+        **exchange_options
     )
     await operation_publisher.connect()
     app['operation_publisher'] = operation_publisher
@@ -50,18 +86,115 @@ async def on_app_start(app):
     billing_event_publisher = RabbitMQPublisher(
         rabbit_connection,
         exchange_name=config['exchanges']['billing']['name'],
-        exchange_type=config['exchanges']['billing']['type']
+        exchange_type=config['exchanges']['billing']['type'],
+        batch_size=rabbitmq_config.get('publish_batch_size', 1),
+        linger=rabbitmq_config.get('publish_linger', 0.005),
+        codec=codec,
+        **exchange_options
     )
     await billing_event_publisher.connect()
     app['billing_event_publisher'] = billing_event_publisher
 
+    lookup_cache_size = config.get('lookup_cache_size', DEFAULT_LOOKUP_CACHE_SIZE)
+    lookup_cache_ttl = config.get('lookup_cache_ttl', DEFAULT_LOOKUP_CACHE_TTL)
+    app['dao_tasks'] = DAOTasks(engine, lookup_cache_size, lookup_cache_ttl)
+    app['dao_users'] = DAOUsers(engine, lookup_cache_size, lookup_cache_ttl)
+    app['dao_billing'] = DAOBilling(engine)
+
+    outbox_config = config.get('outbox', {})
+    outbox_relay = OutboxRelay(
+        DAOOutbox(engine),
+        publishers={
+            const.EXCHANGE__OPERATION_STREAMING: operation_publisher,
+            const.EXCHANGE__BILLING: billing_event_publisher
+        },
+        batch_size=outbox_config.get('batch_size', 100),
+        interval=outbox_config.get('interval', 1)
+    )
+    outbox_relay.start()
+    app['outbox_relay'] = outbox_relay
+
+    app['processed_events'] = ProcessedEvents(
+        config.get('processed_events_cache_size', DEFAULT_PROCESSED_EVENTS_CACHE_SIZE)
+    )
+    retention_config = config.get('processed_events_retention', {})
+    processed_events_retention = ProcessedEventsRetention(
+        app['dao_billing'],
+        max_age=retention_config.get('max_age', DEFAULT_PROCESSED_EVENTS_MAX_AGE),
+        check_interval=retention_config.get('check_interval', DEFAULT_PROCESSED_EVENTS_CHECK_INTERVAL),
+        batch_size=retention_config.get('batch_size', DEFAULT_PROCESSED_EVENTS_DELETE_BATCH_SIZE)
+    )
+    processed_events_retention.start()
+    app['processed_events_retention'] = processed_events_retention
+
+    # partitions of ledger exist before consumers write operations
+    partition_maintainer = get_partition_maintainer(engine, config.get('operation_partitions', {}))
+    await partition_maintainer.maintain()
+    partition_maintainer.start()
+    app['partition_maintainer'] = partition_maintainer
+
+    schema_validator = SchemaRegistryValidator(
+        config['schemas_dir_path'],
+        reload_interval=config.get('schemas_reload_interval', DEFAULT_RELOAD_INTERVAL)
+    )
+    schema_validator.start()
+    app['schema_validator'] = schema_validator
+
+    # operation created events are written to outbox in transaction of their operations
+    ledger_batch_config = config.get('ledger_batch', {})
+    # every prefetched workflow message waits in a batch, so batch is bounded by prefetch
+    workflow_prefetch_count = rabbitmq_config.get('prefetch_count', 1)
+    app['ledger_batcher'] = LedgerBatcher(
+        app['dao_billing'],
+        app['dao_tasks'],
+        max_size=min(ledger_batch_config.get('max_size', 100), workflow_prefetch_count),
+        linger=ledger_batch_config.get('linger', 0.005),
+        make_outbox_messages=lambda operations: [
+            get_operation_outbox_message(operation, config['exchanges'], schema_validator) for operation in operations
+        ],
+        outbox_relay=outbox_relay
+    )
+
+    retry_policies = rabbitmq_config.get('retry_policies', {})
+    consumer_options = {
+        'prefetch_count': rabbitmq_config.get('prefetch_count', 1),
+        'concurrency': rabbitmq_config.get('consumer_concurrency', 1),
+        'queue_durable': rabbitmq_config.get('queue_durable', False),
+        **exchange_options
+    }
+
+    # caches of tasks and users are invalidated by own server-named queues, so every process gets
+    # all events of the streams, while the shared queues below give every event to one process
+    cache_consumers = []
+    for stream, routing_key in (('user_streaming', '*.user'), ('task_streaming', '*.task')):
+        cache_consumer = RabbitMQConsumer(
+            rabbit_connection,
+            exchange_name=config['exchange_subscriptions'][stream],
+            exchange_type='topic',
+            routing_key=routing_key,
+            callback=cache_invalidation_callback,
+            callback_data=app,
+            prefetch_count=rabbitmq_config.get('prefetch_count', 1),
+            concurrency=rabbitmq_config.get('consumer_concurrency', 1),
+            partition_key=entity_partition_key,
+            name='billing.{}_cache'.format(routing_key[2:]),
+            **exchange_options
+        )
+        await cache_consumer.connect()
+        cache_consumers.append(cache_consumer)
+    app['cache_consumers'] = cache_consumers
+
     user_consumer = RabbitMQConsumer(
         rabbit_connection,
         exchange_name=config['exchange_subscriptions']['user_streaming'],
         exchange_type='topic',
         routing_key='*.user',
-        callback=user_callback,
-        callback_data=app
+        callback=with_connection_scope(user_callback, engine),
+        callback_data=app,
+        partition_key=entity_partition_key,
+        queue_name='billing.user',
+        retry_policy=get_retry_policy(retry_policies, 'billing.user'),
+        **consumer_options
     )
     await user_consumer.connect()
     app['user_consumer'] = user_consumer
@@ -71,28 +204,59 @@ async def on_app_start(app):
         exchange_name=config['exchange_subscriptions']['task_streaming'],
         exchange_type='topic',
         routing_key='*.task',
-        callback=user_callback,
-        callback_data=app
+        callback=with_connection_scope(task_callback, engine),
+        callback_data=app,
+        partition_key=entity_partition_key,
+        queue_name='billing.task',
+        retry_policy=get_retry_policy(retry_policies, 'billing.task'),
+        **consumer_options
     )
     await task_consumer.connect()
     app['task_consumer'] = task_consumer
 
-    app['dao_tasks'] = DAOTasks(engine)
-    app['dao_users'] = DAOUsers(engine)
-    app['dao_billing'] = DAOBilling(engine)
+    workflow_consumer = RabbitMQConsumer(
+        rabbit_connection,
+        exchange_name=config['exchange_subscriptions']['workflow'],
+        exchange_type='topic',
+        routing_key='#',
+        callback=with_connection_scope(task_workflow_callback, engine),
+        callback_data=app,
+        partition_key=worker_partition_key,
+        queue_name='billing.workflow',
+        retry_policy=get_retry_policy(retry_policies, 'billing.workflow'),
+        **{
+            **consumer_options,
+            # handler per prefetched message: handlers wait for their batch, not for each other
+            'concurrency': workflow_prefetch_count
+        }
+    )
+    await workflow_consumer.connect()
+    app['workflow_consumer'] = workflow_consumer
 
-    app['schema_validator'] = SchemaRegistryValidator(config['schemas_dir_path'])
+    app['consumers'] = {
+        user_consumer.name: user_consumer,
+        task_consumer.name: task_consumer,
+        workflow_consumer.name: workflow_consumer,
+        **{cache_consumer.name: cache_consumer for cache_consumer in cache_consumers}
+    }
 
 
 async def on_app_stop(app):
     """
     Stop tasks on application destroy
     """
-    await app['rabbit_connection'].close()
-    await app['operation_publisher'].disconnect()
-    await app['billing_event_publisher'].disconnect()
     await app['user_consumer'].disconnect()
     await app['task_consumer'].disconnect()
+    await app['workflow_consumer'].disconnect()
+    for cache_consumer in app['cache_consumers']:
+        await cache_consumer.disconnect()
+    await app['outbox_relay'].stop()
+    await app['operation_publisher'].disconnect()
+    await app['billing_event_publisher'].disconnect()
+    await app['rabbit_connection'].close()
+    await app['schema_validator'].stop()
+    await app['partition_maintainer'].stop()
+    await app['processed_events_retention'].stop()
 
     app['engine'].close()
     await app['engine'].wait_closed()
@@ -115,7 +279,7 @@ def create_app(loop: AbstractEventLoop = None, config: dict = None) -> web.Appli
         application
 
     """
-    app = web.Application()
+    app = web.Application(middlewares=[connection_scope_middleware()])
     cors = aiohttp_cors.setup(app, defaults={
         "*": aiohttp_cors.ResourceOptions(
             allow_credentials=True,
@@ -124,6 +288,8 @@ def create_app(loop: AbstractEventLoop = None, config: dict = None) -> web.Appli
         )
     })
 
+    app.router.add_route('GET', '/metrics', handle_metrics)
+    app.router.add_route('POST', '/admin/replay-parked', handle_replay_parked)
     app.router.add_route('GET', '/cron/daily-withdraw', handle_daily_withdraw)
     cors.add(app.router.add_route('*', '/jsonrpc/operations', OperationsService))
 
@@ -28,6 +28,10 @@ EVENT__USER_DELETED = 'user.deleted.1'
 EVENT__OPERATION_CREATED = 'operation.created.1'
 EVENT__WITHDRAW_1 = 'billing.withdraw.1'
 
+# keys of config['exchanges'], which are used in outbox
+EXCHANGE__OPERATION_STREAMING = 'operation_streaming'
+EXCHANGE__BILLING = 'billing'
+
 
 NAME = 'name'
 DESCRIPTION = 'description'
@@ -40,6 +44,7 @@ MONEY_AMOUNT = 'money_amount'
 FINISH_PRICE = 'finish_price'
 ASSIGN_PRICE = 'assign_price'
 TASK_ID = 'task_id'
+EVENT_TIME = 'event_time'
 
 OPENED = 'opened'
 CLOSED = 'closed'
@@ -65,3 +70,4 @@ BILLING_CYCLE_ID = 'billing_cycle_id'
 USER_ID = 'user_id'
 VALUE = 'value'
 OPERATION_ID = 'operation_id'
+SNAPSHOT_ID = 'snapshot_id'
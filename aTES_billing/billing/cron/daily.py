@@ -1,16 +1,19 @@
 """
 Daily handlers
 """
-from datetime import datetime
+import asyncio
+from datetime import datetime, timezone
+import functools
+from typing import List
 
+from aiohttp import web
 from aiohttp.web_request import Request
 
 from billing import const
 from billing.dao.dao_billing import DAOBilling
-from billing.dao.dao_users import DAOUsers
-from billing.rmq.callbacks import stream_new_operation
-from billing.rmq.message_publishing import get_message, publish_message
-from billing.rmq.publisher import RabbitMQPublisher
+from billing.rmq.callbacks import get_operation_outbox_message
+from billing.rmq.message_publishing import get_message, get_outbox_body
+from billing.rmq.outbox_relay import OutboxRelay
 from billing.schema_registry.validator import SchemaRegistryValidator
 
 
@@ -33,18 +36,36 @@ async def withdraw_money(user_id: str, money_amount: int):
     return True
 
 
-async def publish_withdraw_money_event(
-        withdraw_data: dict,
-        routing_key: str,
-        publisher: RabbitMQPublisher,
+def get_withdraw_outbox_messages(
+        operations: List[dict],
+        billing_cycle: dict,
+        operation_time: str,
+        exchanges: dict,
         validator: SchemaRegistryValidator
-):
-    message = get_message(withdraw_data, const.EVENT__WITHDRAW_1, validator)
-    await publish_message(
-        publisher,
-        routing_key,
-        message
+) -> List[dict]:
+    """
+    Makes withdraw and operation events of salary operations.
+    Messages are validated here, so invalid event rolls back the withdraw transaction
+    """
+    description = 'Income for period since {start_date} to {end_date}'.format(
+        start_date=billing_cycle[const.START_DATE], end_date=billing_cycle[const.END_DATE]
     )
+    messages = []
+    for operation in operations:
+        operation[const.TIME] = operation_time
+        withdraw_data = {
+            'receiver_id': operation[const.WORKER_ID],
+            'amount_of_money': operation[const.DEBIT],
+            'withdraw_time': operation_time,
+            'description': description
+        }
+        messages.append({
+            'exchange': const.EXCHANGE__BILLING,
+            'routing_key': exchanges[const.EXCHANGE__BILLING]['name'],
+            'body': get_outbox_body(get_message(withdraw_data, const.EVENT__WITHDRAW_1, validator))
+        })
+        messages.append(get_operation_outbox_message(operation, exchanges, validator))
+    return messages
 
 
 async def handle_daily_withdraw(request: Request):
@@ -65,50 +86,33 @@ async def handle_daily_withdraw(request: Request):
     # кинуть сообщение о новой транзакции
     # обнулить баланс
     dao_billing = app['dao_billing']  # type: DAOBilling
-    dao_users = app['dao_users']  # type: DAOUsers
-    operation_publisher = app['operation_publisher']
-    billing_event_publisher = app['billing_event_publisher']
+    outbox_relay = app['outbox_relay']  # type: OutboxRelay
     schema_validator = app['schema_validator']
 
     billing_cycle = await dao_billing.get_current_billing_cycle()
     billing_cycle_id = billing_cycle[const.ID]
-    await dao_billing.close_billing_cycle(billing_cycle_id)
-
-    await dao_billing.create_new_billing_cycle(get_start_date(), get_end_date())
-    workers = await dao_users.get_all_workers()
-
-    for worker in workers:
-        worker_id = worker[const.ID]
-        balance = await dao_billing.get_personal_balance(worker_id)
-        if balance <= 0:
-            return
-        await withdraw_money(worker_id, balance)
-        withdraw_data = {
-            'receiver_id': worker_id,
-            'amount_of_money': balance,
-            'withdraw_time': datetime.now().isoformat(),
-            'description': 'Income for period since {start_date} to {end_date}'.format(
-                start_date=billing_cycle[const.START_DATE], end_date=billing_cycle[const.END_DATE]
-            )
-        }
-        await publish_withdraw_money_event(
-            withdraw_data,
-            app['config']['exchanges']['billing']['name'],
-            billing_event_publisher,
-            schema_validator
-        )
-        operation = {
-            const.BILLING_CYCLE_ID: billing_cycle_id,
-            const.TIME: datetime.now().isoformat(),
-            const.DESCRIPTION: 'salary',
-            const.WORKER_ID: worker_id,
-            const.CREDIT: 0,
-            const.DEBIT: balance
-        }
-        operation[const.ID] = await dao_billing.add_operation(operation)
-        await stream_new_operation(
-            operation,
-            app['config']['exchanges']['operation_streaming']['name'],
-            operation_publisher,
-            schema_validator
+    operation_time = datetime.now(timezone.utc).isoformat()
+
+    # closing of the cycle, salary operations of all positive balances, zeroing of the balances
+    # and events of the operations are one transaction, balances are selected and paid by one statement
+    operations = await dao_billing.close_billing_cycle_with_withdraw(
+        billing_cycle_id,
+        get_start_date(),
+        get_end_date(),
+        'salary',
+        operation_time,
+        functools.partial(
+            get_withdraw_outbox_messages,
+            billing_cycle=billing_cycle,
+            operation_time=operation_time,
+            exchanges=app['config']['exchanges'],
+            validator=schema_validator
         )
+    )
+    # events are published by outbox relay with persistent delivery
+    outbox_relay.wake()
+
+    await asyncio.gather(*[
+        withdraw_money(operation[const.WORKER_ID], operation[const.DEBIT]) for operation in operations
+    ])
+    return web.json_response({'billing_cycle_id': billing_cycle_id, 'withdrawals': len(operations)})
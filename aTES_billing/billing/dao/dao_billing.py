@@ -1,16 +1,41 @@
 """
 Manipulate in database with tables
 """
-from typing import List
+import asyncio
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
 import uuid
 
 import sqlalchemy
-from sqlalchemy import func, select
+from sqlalchemy import BigInteger, DateTime, Interval, String, any_, bindparam, func, literal_column, select, union_all
+from sqlalchemy.dialects import postgresql
 
 from billing import const
 from billing.exceptions import NotFound
-from billing.db import Operation, PersonalBalance, BillingCycle
-from billing.dao.filters import make_string_filter
+from billing.dao.bulk import chunked, grouped_by_fields
+from billing.dao.dao_outbox import add_outbox_messages
+from billing.dao.cursor import decode_cursor, get_next_cursor, get_order_keys, ordered_by_keys, seek_condition
+from billing.db import (
+    BalanceSnapshot,
+    BalanceSnapshotValue,
+    BillingCycle,
+    Operation,
+    PersonalBalance,
+    ProcessedEvent,
+    User
+)
+from billing.dao.filters import get_filter_shape, get_order_shape, get_parameter_name, make_string_filter
+from billing.dao.server_cursor import DEFAULT_FETCH_SIZE, iter_rows
+from billing.dao.statement_cache import StatementCache
+
+
+# time of operation is written in UTC and start of cycle in local time,
+# so partitions are pruned by start of cycle with a margin of any time zone
+CYCLE_TIME_MARGIN = timedelta(days=1)
+# the margin as a literal of cached queries, which are executed with values of filter parameters only
+_CYCLE_TIME_MARGIN_SQL = literal_column("interval '{:d} seconds'".format(int(CYCLE_TIME_MARGIN.total_seconds())))
+
+DEFAULT_REBUILD_CHUNKS = 4
 
 
 class DAOBilling:
@@ -19,6 +44,7 @@ class DAOBilling:
     """
     def __init__(self, engine):
         self.engine = engine
+        self._statements = StatementCache()
 
     async def create_new_billing_cycle(self, start_date, end_date):
         async with self.engine.acquire() as conn:
@@ -49,6 +75,24 @@ class DAOBilling:
             raise NotFound()
         return dict(row)
 
+    @classmethod
+    async def _lock_current_billing_cycle(cls, conn) -> dict:
+        """
+        Reads the current billing cycle and locks it against closing until the end of transaction,
+        so operations of the transaction can't be written to a cycle, which is closed meanwhile
+        """
+        query = BillingCycle.select().where(
+            BillingCycle.c.status == const.STATUS__BILLING_CYCLE__OPENED
+        ).with_for_update(read=True)
+        row = await (await conn.execute(query)).first()
+        if row is None:
+            # cycle was closed while the lock was awaited; the next one is opened in the same
+            # transaction, and a new statement sees it
+            row = await (await conn.execute(query)).first()
+        if row is None:
+            raise NotFound()
+        return dict(row)
+
     async def get_current_billing_cycle(self) -> dict:
         async with self.engine.acquire() as conn:
             return await self._get_current_billing_cycle(conn)
@@ -79,32 +123,273 @@ class DAOBilling:
             BillingCycle.update().values(**billing_cycle).
             where(BillingCycle.c.id == billing_cycle_id)
         )
+        await self._take_balance_snapshot(conn, billing_cycle_id)
+
+    @staticmethod
+    async def _withdraw_balances(conn, billing_cycle_id: str, description: str, time: str) -> List[dict]:
+        """
+        Pays positive balances of workers by one statement: balances are set to zero under row lock,
+        and salary operation of the paid value is inserted for every of them
+
+        Returns:
+            inserted operations
+        """
+        paid = select([PersonalBalance.c.user_id, PersonalBalance.c.value]).select_from(
+            PersonalBalance.join(User, User.c.id == PersonalBalance.c.user_id)
+        ).where(
+            User.c.role == const.USER_ROLE__WORKER
+        ).where(
+            PersonalBalance.c.value > 0
+        ).order_by(
+            # rows are locked in the same order as by other writers of balances, so they don't deadlock
+            PersonalBalance.c.user_id.collate('C')
+        ).with_for_update(of=PersonalBalance).alias('paid')
+        # value of returned row is the paid value, the one before update
+        zeroed = PersonalBalance.update().values(value=0).where(
+            PersonalBalance.c.user_id == paid.c.user_id
+        ).returning(paid.c.user_id, paid.c.value).cte('zeroed')
+        query = Operation.insert().from_select(
+            [
+                Operation.c.id,
+                Operation.c.billing_cycle_id,
+                Operation.c.worker_id,
+                Operation.c.description,
+                Operation.c.debit,
+                Operation.c.credit,
+                Operation.c.time
+            ],
+            select([
+                func.replace(sqlalchemy.cast(func.gen_random_uuid(), String), '-', ''),
+                sqlalchemy.literal(billing_cycle_id),
+                zeroed.c.user_id,
+                sqlalchemy.literal(description),
+                zeroed.c.value,
+                sqlalchemy.literal(0),
+                sqlalchemy.cast(sqlalchemy.literal(time), DateTime)
+            ])
+        ).returning(*Operation.c)
+        return [dict(row) async for row in conn.execute(query)]
+
+    async def close_billing_cycle_with_withdraw(
+            self,
+            billing_cycle_id: str,
+            start_date: datetime,
+            end_date: datetime,
+            description: str,
+            time: str,
+            make_outbox_messages: Callable[[List[dict]], List[dict]] = None
+    ) -> List[dict]:
+        """
+        Closes billing cycle, opens the next one and pays positive balances of workers in one transaction.
+        Salary operations belong to the closed cycle, time is ISO 8601 time of them
+
+        Args:
+            make_outbox_messages: makes outbox messages of salary operations, messages are written
+                in the same transaction, so events are published if and only if salary is committed
+
+        Returns:
+            salary operations
+        """
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                await self._close_billing_cycle(conn, billing_cycle_id)
+                await self._create_new_billing_cycle(conn, start_date, end_date)
+                operations = await self._withdraw_balances(conn, billing_cycle_id, description, time)
+                if make_outbox_messages is not None:
+                    await add_outbox_messages(conn, make_outbox_messages(operations))
+                return operations
+
+    @staticmethod
+    async def _get_latest_snapshot_id(conn) -> Optional[str]:
+        return await conn.scalar(
+            select([BalanceSnapshot.c.id]).order_by(BalanceSnapshot.c.taken_at.desc()).limit(1)
+        )
 
     @staticmethod
-    async def _set_personal_balance(conn, user_id: str, value: int):
+    async def _get_cycles_without_snapshot(conn, closed_only: bool = False) -> List[dict]:
+        query = BillingCycle.select().where(BillingCycle.c.snapshot_id.is_(None))
+        if closed_only:
+            query = query.where(BillingCycle.c.status == const.STATUS__BILLING_CYCLE__CLOSED)
+        return [dict(row) async for row in conn.execute(query.order_by(BillingCycle.c.start_date))]
+
+    @staticmethod
+    def _balances_query(snapshot_id: Optional[str], cycles: List[dict], worker_condition=None):
+        """
+        Makes select of (user_id, value): balances of snapshot plus operations of cycles.
+        Operations are read by time of cycles, so partitions of older time aren't read
+        """
+        parts = []
+        if snapshot_id is not None:
+            query = select([BalanceSnapshotValue.c.user_id, BalanceSnapshotValue.c.value])
+            query = query.where(BalanceSnapshotValue.c.snapshot_id == snapshot_id)
+            if worker_condition is not None:
+                query = query.where(worker_condition(BalanceSnapshotValue.c.user_id))
+            parts.append(query)
+        if cycles:
+            cycles_start = min(cycle[const.START_DATE] for cycle in cycles)
+            query = select([
+                Operation.c.worker_id.label(const.USER_ID),
+                (func.coalesce(Operation.c.credit, 0) - func.coalesce(Operation.c.debit, 0)).label(const.VALUE)
+            ])
+            query = query.where(Operation.c.billing_cycle_id.in_([cycle[const.ID] for cycle in cycles]))
+            query = query.where(Operation.c.time >= cycles_start - CYCLE_TIME_MARGIN)
+            query = query.where(Operation.c.worker_id.isnot(None))
+            if worker_condition is not None:
+                query = query.where(worker_condition(Operation.c.worker_id))
+            parts.append(query)
+        if not parts:
+            return None
+        deltas = union_all(*parts).alias('deltas')
+        return select([
+            deltas.c.user_id,
+            func.sum(deltas.c.value).label(const.VALUE)
+        ]).group_by(deltas.c.user_id)
+
+    async def _take_balance_snapshot(self, conn, closing_cycle_id: str) -> Optional[str]:
+        """
+        Writes snapshot of closed cycles, which aren't in the latest snapshot yet: its balances are
+        balances of the latest snapshot plus operations of these cycles. The cycle, which is closed now,
+        isn't included: salary operations and operations of events, which got it as the current cycle,
+        are written after its close. It is included by snapshot of the next close.
+
+        Returns:
+            id of new snapshot or None if there are no cycles for it
+        """
+        cycles = [
+            cycle for cycle in await self._get_cycles_without_snapshot(conn, closed_only=True)
+            if cycle[const.ID] != closing_cycle_id
+        ]
+        if not cycles:
+            return None
+
+        balances = self._balances_query(await self._get_latest_snapshot_id(conn), cycles).alias('balances')
+        snapshot_id = uuid.uuid4().hex
+        await conn.execute(BalanceSnapshot.insert().values(
+            id=snapshot_id,
+            billing_cycle_id=cycles[-1][const.ID]
+        ))
+        await conn.execute(BalanceSnapshotValue.insert().from_select(
+            [BalanceSnapshotValue.c.snapshot_id, BalanceSnapshotValue.c.user_id, BalanceSnapshotValue.c.value],
+            select([sqlalchemy.literal(snapshot_id), balances.c.user_id, balances.c.value])
+        ))
         await conn.execute(
-            PersonalBalance.update().values(**{
-                const.USER_ID: user_id,
-                const.VALUE: value
-            }).where(
-                PersonalBalance.c.user_id == user_id
-            )
+            BillingCycle.update().values(snapshot_id=snapshot_id).
+            where(BillingCycle.c.id.in_([cycle[const.ID] for cycle in cycles]))
         )
+        return snapshot_id
+
+    @staticmethod
+    def _get_chunk_condition(chunks: int, index: int):
+        def condition(user_id_column):
+            # hashtext is int4, it's shifted to non-negative values before modulo
+            return func.mod(sqlalchemy.cast(func.hashtext(user_id_column), BigInteger) + 2 ** 31, chunks) == index
+        return condition
+
+    async def _rebuild_balances_chunk(self, conn, condition, repair: bool) -> Dict[str, Tuple[Optional[int], int]]:
+        # balances of chunk are locked first: operation, which is applied meanwhile, waits for the end
+        # of rebuild and is added to the rebuilt value, and it's not read by the sum below
+        actual = {}
+        query = select([PersonalBalance.c.user_id, PersonalBalance.c.value])
+        query = query.where(condition(PersonalBalance.c.user_id))
+        # rows are locked in order of user_id as by other writers of balances, so they don't deadlock
+        query = query.order_by(PersonalBalance.c.user_id.collate('C')).with_for_update()
+        async for row in conn.execute(query):
+            actual[row.user_id] = row.value
+
+        snapshot_id = await self._get_latest_snapshot_id(conn)
+        cycles = await self._get_cycles_without_snapshot(conn)
+        expected = {}
+        query = self._balances_query(snapshot_id, cycles, condition)
+        if query is not None:
+            async for row in conn.execute(query):
+                expected[row.user_id] = int(row.value)
+
+        differences = {}
+        for user_id in set(actual).union(expected):
+            if actual.get(user_id, 0) != expected.get(user_id, 0):
+                differences[user_id] = (actual.get(user_id), expected.get(user_id, 0))
+
+        if repair:
+            for chunk in chunked(sorted(differences)):
+                query = postgresql.insert(PersonalBalance).values([
+                    {const.USER_ID: user_id, const.VALUE: expected.get(user_id, 0)} for user_id in chunk
+                ])
+                query = query.on_conflict_do_update(
+                    index_elements=[PersonalBalance.c.user_id],
+                    set_={const.VALUE: query.excluded.value}
+                )
+                await conn.execute(query)
+        return differences
+
+    async def rebuild_balances(
+            self,
+            chunks: int = DEFAULT_REBUILD_CHUNKS,
+            repair: bool = False
+    ) -> Dict[str, Tuple[Optional[int], int]]:
+        """
+        Computes balances of workers as the latest balance snapshot plus operations of cycles,
+        which aren't in it, and compares them with 'personal_balance'. Workers are split to chunks
+        by hash of id, chunks are computed in parallel, each one by its connection and transaction.
+        Outside of connection scope only: chunks of one scope share one connection
+
+        Args:
+            chunks: count of chunks of workers
+            repair: write computed balances, which differ from 'personal_balance'
+
+        Returns:
+            {user id: (balance or None if there is no balance, computed balance)}
+            of workers, which balance differs from computed one
+
+        """
+        async def rebuild_chunk(index: int):
+            async with self.engine.acquire() as conn:
+                async with conn.begin():
+                    return await self._rebuild_balances_chunk(conn, self._get_chunk_condition(chunks, index), repair)
+
+        result = {}
+        for differences in await asyncio.gather(*[rebuild_chunk(index) for index in range(chunks)]):
+            result.update(differences)
+        return result
 
     async def get_personal_balance(self, user_id: str) -> int:
         async with self.engine.acquire() as conn:
             return await self._get_personal_balance(conn, user_id)
 
-    @staticmethod
-    async def _get_personal_balance(conn, user_id: str) -> int:
+    async def _get_personal_balance(self, conn, user_id: str) -> int:
         personal_balance = await (
-            await conn.execute(PersonalBalance.select().where(PersonalBalance.c.user_id == user_id))
+            await self._statements.execute(
+                conn,
+                'get_personal_balance',
+                lambda: PersonalBalance.select().where(PersonalBalance.c.user_id == bindparam(const.USER_ID)),
+                {const.USER_ID: user_id}
+            )
         ).first()
 
         if personal_balance is None:
             raise NotFound()
         return personal_balance.value
 
+    async def get_personal_balances(self, user_ids: List[str]) -> Dict[str, int]:
+        """
+        Returns:
+            balances by user id, users without balance are skipped
+        """
+        async with self.engine.acquire() as conn:
+            return await self._get_personal_balances(conn, user_ids)
+
+    async def _get_personal_balances(self, conn, user_ids: List[str]) -> Dict[str, int]:
+        result = {}
+        for chunk in chunked(list(user_ids)):
+            rows = await self._statements.execute(
+                conn,
+                'get_personal_balances',
+                lambda: PersonalBalance.select().where(PersonalBalance.c.user_id == any_(bindparam('user_ids'))),
+                {'user_ids': chunk}
+            )
+            async for row in rows:
+                result[row[const.USER_ID]] = row[const.VALUE]
+        return result
+
     @staticmethod
     def _update_balance_value(operation: dict, balance: int):
         debit = operation[const.DEBIT]
@@ -115,47 +400,196 @@ class DAOBilling:
             balance += credit
         return balance
 
-    async def _add(self, conn, operation: dict) -> str:
-        balance = await self._get_personal_balance(conn, operation[const.WORKER_ID])
+    @staticmethod
+    def _operation_insert(operation: dict, event_id: str = None):
+        """
+        Makes insert of operation. With event_id it is a single statement, which marks event
+        as processed and inserts operation. If event was processed already, nothing is inserted.
+        """
+        if event_id is None:
+            return Operation.insert().values(**operation)
+
+        new_event = postgresql.insert(ProcessedEvent).values(
+            event_id=event_id
+        ).on_conflict_do_nothing().returning(ProcessedEvent.c.event_id).cte('new_event')
+        columns = list(operation)
+        values = [sqlalchemy.cast(sqlalchemy.literal(operation[column]), Operation.c[column].type) for column in columns]
+        return Operation.insert().from_select(columns, select(values).select_from(new_event))
+
+    @classmethod
+    def _applied_operation_insert(cls, operation: dict, event_id: str = None):
+        """
+        Makes single statement, which inserts operation and adds it to balance of its worker
+        (see _operation_insert), and returns new value of the balance.
+
+        Balance is created on the first operation of worker, otherwise it is changed
+        by `value = value + delta` under row lock of the upsert, so concurrent operations
+        of one worker don't lose updates. Nothing is returned if event was processed already.
+        """
+        new_operation = cls._operation_insert(operation, event_id).returning(
+            Operation.c.worker_id, Operation.c.debit, Operation.c.credit
+        ).cte('new_operation')
+        delta = func.coalesce(new_operation.c.credit, 0) - func.coalesce(new_operation.c.debit, 0)
+        query = postgresql.insert(PersonalBalance).from_select(
+            [PersonalBalance.c.user_id, PersonalBalance.c.value],
+            select([new_operation.c.worker_id, delta])
+        )
+        return query.on_conflict_do_update(
+            index_elements=[PersonalBalance.c.user_id],
+            set_={const.VALUE: PersonalBalance.c.value + query.excluded.value}
+        ).returning(PersonalBalance.c.value)
 
+    async def _add(self, conn, operation: dict, event_id: str = None) -> Optional[str]:
         if const.ID not in operation:
             operation[const.ID] = uuid.uuid4().hex
-        await conn.execute(
-            Operation.insert().values(**operation)
-        )
 
-        balance = self._update_balance_value(operation, balance)
-        await self._set_personal_balance(conn, operation[const.WORKER_ID], balance)
+        balance = await (
+            await conn.execute(self._applied_operation_insert(operation, event_id))
+        ).scalar()
+        if balance is None:
+            # event was processed already, balance stays untouched
+            return None
         return operation[const.ID]
 
+    @staticmethod
+    async def _mark_events_processed(conn, event_ids: List[str]) -> Set[str]:
+        """
+        Returns:
+            ids of events, which were not processed before
+        """
+        result = set()
+        # events of overlapping batches are locked in the same order
+        for chunk in chunked(sorted(set(event_ids))):
+            query = postgresql.insert(ProcessedEvent).values([
+                {'event_id': event_id} for event_id in chunk
+            ]).on_conflict_do_nothing().returning(ProcessedEvent.c.event_id)
+            async for row in conn.execute(query):
+                result.add(row.event_id)
+        return result
+
+    @classmethod
+    async def _add_to_balances(cls, conn, operations: List[dict]):
+        """
+        Applies operations to balances of their workers by one statement per chunk of workers.
+        Balance is created on the first operation of worker.
+
+        Upsert locks rows in order of its values, so balances are written in order of user_id
+        as by withdraw and rebuild: transactions of overlapping batches can't deadlock.
+        Order of python strings is the order of "C" collation
+        """
+        deltas = {}
+        for operation in operations:
+            worker_id = operation[const.WORKER_ID]
+            deltas[worker_id] = cls._update_balance_value(operation, deltas.get(worker_id, 0))
+
+        for chunk in chunked(sorted(deltas.items())):
+            query = postgresql.insert(PersonalBalance).values([
+                {const.USER_ID: worker_id, const.VALUE: delta} for worker_id, delta in chunk
+            ])
+            query = query.on_conflict_do_update(
+                index_elements=[PersonalBalance.c.user_id],
+                set_={const.VALUE: PersonalBalance.c.value + query.excluded.value}
+            )
+            await conn.execute(query)
+
+    async def _add_many(self, conn, operations: List[dict], event_ids: List[str] = None) -> List[Optional[str]]:
+        if event_ids is not None:
+            new_event_ids = await self._mark_events_processed(conn, event_ids)
+
+        applied = []
+        result = []
+        for index, operation in enumerate(operations):
+            if event_ids is not None:
+                event_id = event_ids[index]
+                if event_id not in new_event_ids:
+                    result.append(None)
+                    continue
+                # the same event can't be applied twice even inside one batch
+                new_event_ids.discard(event_id)
+            if const.ID not in operation:
+                operation[const.ID] = uuid.uuid4().hex
+            applied.append(operation)
+            result.append(operation[const.ID])
+
+        for chunk in grouped_by_fields(applied):
+            await conn.execute(Operation.insert().values(chunk))
+        if applied:
+            await self._add_to_balances(conn, applied)
+        return result
+
     async def _delete(self, conn, object_id: str):
         await conn.execute(Operation.delete().where(Operation.c.id == object_id))
 
     async def _get(self, conn, object_id: str):
-        row = await (
-            await conn.execute(Operation.select().where(Operation.c.id == object_id))
-        ).first()
-
-        if row is None:
+        operations = await self._get_many(conn, [object_id])
+        if object_id not in operations:
             raise NotFound()
-        return dict(row)
+        return operations[object_id]
+
+    async def _get_many(self, conn, object_ids: List[str]) -> Dict[str, dict]:
+        result = {}
+        for chunk in chunked(list(object_ids)):
+            rows = await self._statements.execute(
+                conn,
+                'get_many',
+                lambda: Operation.select().where(Operation.c.id == any_(bindparam('ids'))),
+                {'ids': chunk}
+            )
+            async for row in rows:
+                result[row[const.ID]] = dict(row)
+        return result
+
+    # fields of filter, which are used by _filtered_query as string filters
+    _filter_fields = (const.ID, const.WORKER_ID)
+
+    def _get_filter_shape(self, filter_: dict) -> Tuple[tuple, dict]:
+        """
+        Returns:
+            shape of filter, which defines SQL of _filtered_query, and values of its parameters
+        """
+        shape, parameters = get_filter_shape(filter_, self._filter_fields)
+        if const.BILLING_CYCLE_ID in filter_:
+            shape += ((const.BILLING_CYCLE_ID, 'values'),)
+            parameters[get_parameter_name(const.BILLING_CYCLE_ID, 'values')] = list(
+                filter_[const.BILLING_CYCLE_ID]['values']
+            )
+        for bound in ('from', 'to'):
+            if bound in filter_.get(const.TIME, {}):
+                shape += ((const.TIME, bound),)
+                parameters[get_parameter_name(const.TIME, bound)] = filter_[const.TIME][bound]
+        return shape, parameters
 
     def _filtered_query(self, query, filter_: dict):
-        if const.TASK_NAME in filter_:
-            query = query.where(make_string_filter(Operation.c.name, filter_[const.TASK_NAME]))
-        for filtering_filed in filter_:
-            if filtering_filed in (const.ID, const.WORKER_ID):
-                values = filter_[filtering_filed]['values']
-                query = query.where(Operation.c[filtering_filed].in_(values))
-        if const.ID in filter_:
-            values = filter_[const.ID]['values']
-            query = query.where(Operation.c.id.in_(values))
+        """
+        Values of filter are named bound parameters, so SQL of the query depends on shape of filter only
+        """
+        for field_name in self._filter_fields:
+            if field_name in filter_:
+                query = query.where(make_string_filter(Operation.c[field_name], filter_[field_name]))
+        if const.BILLING_CYCLE_ID in filter_:
+            cycle_ids = bindparam(
+                get_parameter_name(const.BILLING_CYCLE_ID, 'values'),
+                list(filter_[const.BILLING_CYCLE_ID]['values'])
+            )
+            query = query.where(Operation.c.billing_cycle_id == any_(cycle_ids))
+            # operations of cycle aren't older than its start, so partitions of older time are skipped
+            cycles_start = select([func.min(BillingCycle.c.start_date)]).where(BillingCycle.c.id == any_(cycle_ids))
+            query = query.where(Operation.c.time >= cycles_start.as_scalar() - _CYCLE_TIME_MARGIN_SQL)
+        time_filter = filter_.get(const.TIME, {})
+        if 'from' in time_filter:
+            query = query.where(Operation.c.time >= bindparam(
+                get_parameter_name(const.TIME, 'from'), time_filter['from'], type_=Operation.c.time.type
+            ))
+        if 'to' in time_filter:
+            query = query.where(Operation.c.time < bindparam(
+                get_parameter_name(const.TIME, 'to'), time_filter['to'], type_=Operation.c.time.type
+            ))
         return query
 
     @staticmethod
     def _ordered_query(query, filter_: List[dict]):
         if not filter_:
-            return query.order_by(Operation.c.name)
+            return query.order_by(Operation.c.time)
         for item in filter_:
             field_name = item['field']
             direction = item.get('direction', 'asc')
@@ -166,26 +600,154 @@ class DAOBilling:
         return query
 
     async def _get_count_by_filter(self, conn, filter_: dict) -> int:
-        query = sqlalchemy.select([func.count(Operation.c.id)])
-        query = self._filtered_query(query, filter_)
-        return await conn.scalar(query)
+        filter_shape, parameters = self._get_filter_shape(filter_)
 
-    async def _get_list_by_filter(self, conn, filter_: dict, order: List[dict], limit: int, offset: int) -> List[dict]:
-        query = Operation.select()
-        query = self._filtered_query(query, filter_)
-        query = self._ordered_query(query, order)
-        query = query.limit(limit)
-        query = query.offset(offset)
+        def build():
+            query = sqlalchemy.select([func.count(Operation.c.id)])
+            return self._filtered_query(query, filter_)
+
+        result = await self._statements.execute(conn, ('count', filter_shape), build, parameters)
+        return await result.scalar()
 
+    async def _get_list_by_filter(self, conn, filter_: dict, order: List[dict], limit: int, offset: int) -> List[dict]:
+        filter_shape, parameters = self._get_filter_shape(filter_)
+
+        def build():
+            query = Operation.select()
+            query = self._filtered_query(query, filter_)
+            query = self._ordered_query(query, order)
+            return query.limit(bindparam('limit')).offset(bindparam('offset'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('list', filter_shape, get_order_shape(order)),
+            build,
+            {**parameters, 'limit': limit, 'offset': offset}
+        )
         result = []
-        async for row in conn.execute(query):
+        async for row in rows:
             result.append(dict(row))
         return result
 
-    async def add_operation(self, obj: dict) -> str:
+    async def _get_list_by_cursor(
+            self,
+            conn,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            cursor: str = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        keys = get_order_keys(Operation, order)
+        filter_shape, parameters = self._get_filter_shape(filter_)
+        if cursor:
+            parameters.update(decode_cursor(cursor, Operation, keys))
+
+        def build():
+            query = self._filtered_query(Operation.select(), filter_)
+            if cursor:
+                query = query.where(seek_condition(Operation, keys, parameters))
+            return ordered_by_keys(query, Operation, keys).limit(bindparam('limit'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('cursor', filter_shape, keys, bool(cursor)),
+            build,
+            # one more row shows if there is the next page
+            {**parameters, 'limit': limit + 1}
+        )
+        result = []
+        async for row in rows:
+            result.append(dict(row))
+        return result[:limit], get_next_cursor(result, limit, keys)
+
+    async def add_operation(self, obj: dict, event_id: str = None) -> Optional[str]:
+        """
+        Adds operation and changes worker's balance
+
+        Args:
+            obj: operation
+            event_id: id of event, which caused the operation. Operation of the same event is added only once
+
+        Returns:
+            id of added operation or None if operation of the event was added already
+
+        """
         async with self.engine.acquire() as conn:
             async with conn.begin():
-                return await self._add(conn, obj)
+                return await self._add(conn, obj, event_id)
+
+    async def add_operations(self, operations: List[dict], event_ids: List[str] = None) -> List[Optional[str]]:
+        """
+        Adds operations and changes balances of workers in one transaction
+
+        Args:
+            operations: list of operations
+            event_ids: ids of events, which caused the operations (one per operation),
+                without them every operation is added
+
+        Returns:
+            ids of added operations, None for operations of events, which were processed already
+
+        """
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                return await self._add_many(conn, operations, event_ids)
+
+    async def add_operations_to_current_cycle(
+            self,
+            operations: List[dict],
+            event_ids: List[str] = None,
+            make_outbox_messages: Callable[[List[dict]], List[dict]] = None
+    ) -> List[Optional[str]]:
+        """
+        Adds operations to the current billing cycle like add_operations. The cycle is read
+        in the same transaction and can't be closed before the operations are committed
+
+        Args:
+            operations: list of operations
+            event_ids: ids of events, which caused the operations
+            make_outbox_messages: makes outbox messages of added operations (operations of processed
+                events are skipped), messages are written in the same transaction
+
+        Raises:
+            NotFound: if there is no opened billing cycle
+
+        """
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                billing_cycle = await self._lock_current_billing_cycle(conn)
+                for operation in operations:
+                    operation[const.BILLING_CYCLE_ID] = billing_cycle[const.ID]
+                operation_ids = await self._add_many(conn, operations, event_ids)
+                if make_outbox_messages is not None:
+                    added = [
+                        operation for operation, operation_id in zip(operations, operation_ids)
+                        if operation_id is not None
+                    ]
+                    if added:
+                        await add_outbox_messages(conn, make_outbox_messages(added))
+                return operation_ids
+
+    async def delete_processed_events(self, max_age: timedelta, limit: int) -> int:
+        """
+        Forgets events processed more than max_age ago
+
+        Args:
+            max_age: age of the oldest event, which redelivery is still skipped
+            limit: maximum count of deleted events
+
+        Returns:
+            count of deleted events
+        """
+        expired = select([ProcessedEvent.c.event_id]).where(
+            ProcessedEvent.c.processed_at < func.now() - bindparam('max_age', type_=Interval)
+        ).limit(bindparam('limit'))
+        async with self.engine.acquire() as conn:
+            result = await conn.execute(
+                ProcessedEvent.delete().where(ProcessedEvent.c.event_id.in_(expired)),
+                {'max_age': max_age, 'limit': limit}
+            )
+            return result.rowcount
 
     async def delete(self, object_id: str):
         async with self.engine.acquire() as conn:
@@ -196,6 +758,14 @@ class DAOBilling:
         async with self.engine.acquire() as conn:
             return await self._get(conn, object_id)
 
+    async def get_many(self, object_ids: List[str]) -> Dict[str, dict]:
+        """
+        Returns:
+            operations by id, missing ids are skipped
+        """
+        async with self.engine.acquire() as conn:
+            return await self._get_many(conn, object_ids)
+
     async def get_count_by_filter(self, filter_: dict) -> int:
         async with self.engine.acquire() as conn:
             return await self._get_count_by_filter(conn, filter_)
@@ -204,6 +774,36 @@ class DAOBilling:
         async with self.engine.acquire() as conn:
             return await self._get_list_by_filter(conn, filter_, order, limit, offset)
 
+    async def get_list_by_cursor(
+            self,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            cursor: str = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        Returns:
+            page of operations after the cursor (the first page without it) and cursor of the next page,
+            which is None for the last page
+        """
+        async with self.engine.acquire() as conn:
+            return await self._get_list_by_cursor(conn, filter_, order, limit, cursor)
+
+    async def iter_by_filter(
+            self,
+            filter_: dict,
+            order: List[dict] = None,
+            fetch_size: int = DEFAULT_FETCH_SIZE
+    ) -> AsyncIterator[dict]:
+        """
+        Iterates all filtered operations without limit, only `fetch_size` of them are kept in memory at once
+        """
+        query = self._filtered_query(Operation.select(), filter_)
+        if order:
+            query = self._ordered_query(query, order)
+        async for row in iter_rows(self.engine, query, fetch_size=fetch_size):
+            yield row
+
     def _filtered_billing_cycle_query(self, query, filter_: dict):
         for filtering_filed in filter_:
             if filtering_filed in (const.STATUS, const.START_DATE, const.END_DATE):
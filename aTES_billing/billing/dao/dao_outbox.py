@@ -0,0 +1,101 @@
+"""
+Manipulate in database with 'outbox' table
+"""
+from typing import Awaitable, Callable, List
+
+import sqlalchemy
+
+from billing.dao.bulk import chunked
+from billing.db import Outbox
+
+
+# any constant numbers, which are unique among advisory locks of the database
+OUTBOX_RELAY_LOCK_KEY = 5417
+# shared by transactions, which add messages, exclusive for reading of messages by relay
+OUTBOX_WRITE_LOCK_KEY = 5418
+
+
+async def add_outbox_messages(conn, messages: List[dict]) -> None:
+    """
+    Adds messages to outbox. Should be called inside transaction, which changes the data
+    messages are about, so messages are stored if and only if data changes are committed.
+
+    Ids of messages are taken from sequence on insert, not on commit, so a transaction can commit
+    a lower id after a higher one. Transaction holds shared lock of writing till its end, and relay
+    reads the highest id under exclusive one, so ids up to it are never committed later.
+
+    Args:
+        conn: connection with opened transaction
+        messages: list of dicts with 'exchange', 'routing_key' and 'body'
+
+    """
+    if not messages:
+        return
+    await conn.execute(
+        sqlalchemy.select([sqlalchemy.func.pg_advisory_xact_lock_shared(OUTBOX_WRITE_LOCK_KEY)])
+    )
+    for chunk in chunked(messages):
+        await conn.execute(Outbox.insert().values(chunk))
+
+
+class DAOOutbox:
+    """
+    DAO for 'outbox' table
+    """
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def _get_committed_id(self) -> int:
+        """
+        Returns:
+            id, which all messages with lower or equal ids are committed (or rolled back) by.
+            It's read under exclusive lock of writing by its own short transaction,
+            so writers wait for the read only
+        """
+        async with self.engine.acquire_unscoped() as conn:
+            async with conn.begin():
+                await conn.execute(sqlalchemy.select([sqlalchemy.func.pg_advisory_xact_lock(OUTBOX_WRITE_LOCK_KEY)]))
+                return await conn.scalar(sqlalchemy.select([sqlalchemy.func.max(Outbox.c.id)]))
+
+    @staticmethod
+    async def _get_batch(conn, limit: int, committed_id: int) -> List[dict]:
+        query = Outbox.select().where(Outbox.c.id <= committed_id).order_by(Outbox.c.id).limit(limit)
+        result = []
+        async for row in conn.execute(query):
+            result.append(dict(row))
+        return result
+
+    @staticmethod
+    async def _delete(conn, ids: List[int]):
+        await conn.execute(Outbox.delete().where(Outbox.c.id.in_(ids)))
+
+    async def process_batch(self, limit: int, handler: Callable[[List[dict]], Awaitable]) -> int:
+        """
+        Passes the oldest messages to handler and removes them from outbox if handler succeeds.
+        Only one process handles outbox at a time, and messages are read after all messages with
+        lower ids are committed (see add_outbox_messages), so messages are handled in order of ids.
+
+        Args:
+            limit: maximum count of messages in batch
+            handler: coroutine function, which gets list of messages
+
+        Returns:
+            count of handled messages
+
+        """
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                locked = await conn.scalar(
+                    sqlalchemy.select([sqlalchemy.func.pg_try_advisory_xact_lock(OUTBOX_RELAY_LOCK_KEY)])
+                )
+                if not locked:
+                    return 0
+                committed_id = await self._get_committed_id()
+                if committed_id is None:
+                    return 0
+                messages = await self._get_batch(conn, limit, committed_id)
+                if not messages:
+                    return 0
+                await handler(messages)
+                await self._delete(conn, [message['id'] for message in messages])
+                return len(messages)
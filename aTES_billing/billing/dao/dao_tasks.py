@@ -2,73 +2,111 @@
 Manipulate in database with tables
 """
 import random
-from typing import List
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
 import uuid
 
 import sqlalchemy
-from sqlalchemy import func
+from sqlalchemy import any_, bindparam, func
 
 from billing import const
 from billing.exceptions import NotFound
 from billing.db import Task
-from billing.dao.filters import make_string_filter
+from billing.dao.bulk import chunked, grouped_by_fields, make_update_from_values, make_upsert, make_upsert_if_newer
+from billing.dao.cursor import decode_cursor, get_next_cursor, get_order_keys, ordered_by_keys, seek_condition
+from billing.dao.filters import get_filter_shape, get_order_shape, make_string_filter
+from billing.dao.lookup_cache import DEFAULT_LOOKUP_CACHE_SIZE, DEFAULT_LOOKUP_CACHE_TTL, LookupCache
+from billing.dao.page import split_total_count, with_total_count
+from billing.dao.server_cursor import DEFAULT_FETCH_SIZE, iter_rows
+from billing.dao.statement_cache import StatementCache
 
 
 async def handle_task_data(task, dao_tasks):
     """
-    Creates new task if task not exist or updates existent task
+    Creates new task if task not exist or updates existent task by one statement.
+    Prices are set to new task only, replayed and outdated events change nothing
     """
-    task_id = task[const.ID]
-    try:
-        await dao_tasks.get(task_id)
-        await dao_tasks.set(task)
-    except NotFound:
-        assign_price = random.randint(10, 20)
-        finish_price = random.randint(20, 40)
-        task[const.ASSIGN_PRICE] = assign_price
-        task[const.FINISH_PRICE] = finish_price
-        await dao_tasks.add_operation(task)
+    task[const.ASSIGN_PRICE] = random.randint(10, 20)
+    task[const.FINISH_PRICE] = random.randint(20, 40)
+    await dao_tasks.upsert_if_newer(task, insert_only=(const.ASSIGN_PRICE, const.FINISH_PRICE))
 
 
 class DAOTasks:
     """
     DAO for 'task' table
     """
-    def __init__(self, engine):
+    def __init__(
+            self,
+            engine,
+            cache_size: int = DEFAULT_LOOKUP_CACHE_SIZE,
+            cache_ttl: float = DEFAULT_LOOKUP_CACHE_TTL
+    ):
         self.engine = engine
+        self._statements = StatementCache()
+        # table is changed by streaming events, which are written by one of processes of the service:
+        # writes of this process are invalidated by DAO, writes of others by events of the process queue
+        self.cache = LookupCache('task', cache_size, cache_ttl)
 
     async def _add(self, conn, obj: dict) -> str:
-        if const.ID not in obj:
-            obj[const.ID] = uuid.uuid4().hex
-        await conn.execute(
-            Task.insert().values(**obj)
-        )
-        return obj[const.ID]
+        return (await self._add_many(conn, [obj]))[0]
 
     async def _set(self, conn, obj: dict) -> None:
-        await conn.execute(
-            Task.update().values(**obj).
-            where(Task.c.id == obj[const.ID])
-        )
+        await self._set_many(conn, [obj])
+
+    async def _add_many(self, conn, objects: List[dict]) -> List[str]:
+        for obj in objects:
+            if const.ID not in obj:
+                obj[const.ID] = uuid.uuid4().hex
+        for chunk in grouped_by_fields(objects):
+            await conn.execute(Task.insert().values(chunk))
+        return [obj[const.ID] for obj in objects]
+
+    async def _set_many(self, conn, objects: List[dict]) -> None:
+        for chunk in grouped_by_fields(objects):
+            if len(chunk[0]) > 1:
+                await conn.execute(*make_update_from_values(Task, chunk))
+
+    async def _upsert_many(self, conn, objects: List[dict]) -> List[str]:
+        for obj in objects:
+            if const.ID not in obj:
+                obj[const.ID] = uuid.uuid4().hex
+        for chunk in grouped_by_fields(objects):
+            await conn.execute(make_upsert(Task, chunk))
+        return [obj[const.ID] for obj in objects]
+
+    async def _upsert_if_newer(self, conn, obj: dict, insert_only: Iterable[str] = ()) -> bool:
+        query = make_upsert_if_newer(Task, [obj], const.EVENT_TIME, insert_only=insert_only)
+        return await (await conn.execute(query)).first() is not None
 
     async def _delete(self, conn, object_id: str):
         await conn.execute(Task.delete().where(Task.c.id == object_id))
 
     async def _get(self, conn, object_id: str):
-        row = await (
-            await conn.execute(Task.select().where(Task.c.id == object_id))
-        ).first()
-
-        if row is None:
+        objects = await self._get_many(conn, [object_id])
+        if object_id not in objects:
             raise NotFound()
-        return dict(row)
+        return objects[object_id]
+
+    async def _get_many(self, conn, object_ids: List[str]) -> Dict[str, dict]:
+        result = {}
+        for chunk in chunked(list(object_ids)):
+            rows = await self._statements.execute(
+                conn,
+                'get_many',
+                lambda: Task.select().where(Task.c.id == any_(bindparam('ids'))),
+                {'ids': chunk}
+            )
+            async for row in rows:
+                result[row[const.ID]] = dict(row)
+        return result
+
+    # fields of filter, which are used by _filtered_query
+    _filter_fields = (const.TASK_NAME, const.ID)
 
     def _filtered_query(self, query, filter_: dict):
         if const.TASK_NAME in filter_:
             query = query.where(make_string_filter(Task.c.name, filter_[const.TASK_NAME]))
         if const.ID in filter_:
-            values = filter_[const.ID]['values']
-            query = query.where(Task.c.id.in_(values))
+            query = query.where(make_string_filter(Task.c.id, filter_[const.ID]))
         return query
 
     @staticmethod
@@ -85,40 +123,176 @@ class DAOTasks:
         return query
 
     async def _get_count_by_filter(self, conn, filter_: dict) -> int:
-        query = sqlalchemy.select([func.count(Task.c.id)])
-        query = self._filtered_query(query, filter_)
-        return await conn.scalar(query)
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+
+        def build():
+            query = sqlalchemy.select([func.count(Task.c.id)])
+            return self._filtered_query(query, filter_)
+
+        result = await self._statements.execute(conn, ('count', filter_shape), build, parameters)
+        return await result.scalar()
 
     async def _get_list_by_filter(self, conn, filter_: dict, order: List[dict], limit: int, offset: int) -> List[dict]:
-        query = Task.select()
-        query = self._filtered_query(query, filter_)
-        query = self._ordered_query(query, order)
-        query = query.limit(limit)
-        query = query.offset(offset)
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
 
+        def build():
+            query = Task.select()
+            query = self._filtered_query(query, filter_)
+            query = self._ordered_query(query, order)
+            return query.limit(bindparam('limit')).offset(bindparam('offset'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('list', filter_shape, get_order_shape(order)),
+            build,
+            {**parameters, 'limit': limit, 'offset': offset}
+        )
         result = []
-        async for row in conn.execute(query):
+        async for row in rows:
             result.append(dict(row))
         return result
 
+    async def _get_list_by_cursor(
+            self,
+            conn,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            cursor: str = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        keys = get_order_keys(Task, order)
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+        if cursor:
+            parameters.update(decode_cursor(cursor, Task, keys))
+
+        def build():
+            query = self._filtered_query(Task.select(), filter_)
+            if cursor:
+                query = query.where(seek_condition(Task, keys, parameters))
+            return ordered_by_keys(query, Task, keys).limit(bindparam('limit'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('cursor', filter_shape, keys, bool(cursor)),
+            build,
+            # one more row shows if there is the next page
+            {**parameters, 'limit': limit + 1}
+        )
+        result = []
+        async for row in rows:
+            result.append(dict(row))
+        return result[:limit], get_next_cursor(result, limit, keys)
+
+    async def _get_page(
+            self,
+            conn,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            offset: int
+    ) -> Tuple[List[dict], int, bool]:
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+
+        def build():
+            query = self._filtered_query(Task.select(), filter_)
+            query = with_total_count(query, Task, bool(filter_shape))
+            query = self._ordered_query(query, order)
+            return query.limit(bindparam('limit')).offset(bindparam('offset'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('page', filter_shape, get_order_shape(order)),
+            build,
+            {**parameters, 'limit': limit, 'offset': offset}
+        )
+        items, total, exact = split_total_count([dict(row) async for row in rows], limit, offset)
+        if total is None:
+            # page is after the last row
+            total, exact = await self._get_count_by_filter(conn, filter_), True
+        return items, total, exact
+
     async def add(self, obj: dict) -> str:
         async with self.engine.acquire() as conn:
             async with conn.begin():
-                return await self._add(conn, obj)
+                object_id = await self._add(conn, obj)
+        self.cache.invalidate_many([object_id])
+        return object_id
 
     async def set(self, obj: dict):
         async with self.engine.acquire() as conn:
             async with conn.begin():
                 await self._set(conn, obj)
+        self.cache.invalidate_many([obj[const.ID]])
 
     async def delete(self, object_id: str):
         async with self.engine.acquire() as conn:
             async with conn.begin():
                 await self._delete(conn, object_id)
+        self.cache.invalidate_many([object_id])
 
     async def get(self, object_id: str) -> dict:
+        objects = await self.get_many([object_id])
+        if object_id not in objects:
+            raise NotFound()
+        return objects[object_id]
+
+    async def get_many(self, object_ids: List[str]) -> Dict[str, dict]:
+        """
+        Reads through cache, only not cached objects are read from database
+
+        Returns:
+            objects by id, missing ids are skipped
+        """
+        result, missing = self.cache.get_many(object_ids)
+        if missing:
+            generation = self.cache.generation
+            async with self.engine.acquire() as conn:
+                objects = await self._get_many(conn, missing)
+            self.cache.put_many(objects, generation)
+            result.update(objects)
+        return result
+
+    async def add_many(self, objects: List[dict]) -> List[str]:
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                object_ids = await self._add_many(conn, objects)
+        self.cache.invalidate_many(object_ids)
+        return object_ids
+
+    async def set_many(self, objects: List[dict]):
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                await self._set_many(conn, objects)
+        self.cache.invalidate_many([obj[const.ID] for obj in objects])
+
+    async def upsert_many(self, objects: List[dict]) -> List[str]:
+        """
+        Adds new objects and sets existent ones
+        """
         async with self.engine.acquire() as conn:
-            return await self._get(conn, object_id)
+            async with conn.begin():
+                object_ids = await self._upsert_many(conn, objects)
+        self.cache.invalidate_many(object_ids)
+        return object_ids
+
+    async def upsert_if_newer(self, obj: dict, insert_only: Iterable[str] = ()) -> bool:
+        """
+        Writes object of streaming event by one statement: adds new object or sets existent one,
+        if the event is newer than the written one. Object has to have event time
+
+        Args:
+            obj: object with event time
+            insert_only: fields, which are written to new object only
+
+        Returns:
+            False if the event is not newer than the written one, e.g. it's a replayed event
+
+        """
+        # the only statement doesn't need explicit transaction
+        async with self.engine.acquire() as conn:
+            written = await self._upsert_if_newer(conn, obj, insert_only)
+        self.cache.invalidate_many([obj[const.ID]])
+        return written
 
     async def get_count_by_filter(self, filter_: dict) -> int:
         async with self.engine.acquire() as conn:
@@ -128,15 +302,51 @@ class DAOTasks:
         async with self.engine.acquire() as conn:
             return await self._get_list_by_filter(conn, filter_, order, limit, offset)
 
-    async def get_not_finished_tasks(self):
+    async def get_list_by_cursor(
+            self,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            cursor: str = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        Returns:
+            page after the cursor (the first page without it) and cursor of the next page,
+            which is None for the last page
+        """
         async with self.engine.acquire() as conn:
-            # we need to set real limits in future
-            filter_ = {
-                const.STATUS: {
-                    'values': [const.TASK_STATUS__OPENED, const.TASK_STATUS__IN_PROGRESS]
-                }
-            }
-            order = []
-            limit = 1000
-            offset = 0
-            return await self._get_list_by_filter(conn, filter_, order, limit, offset)
+            return await self._get_list_by_cursor(conn, filter_, order, limit, cursor)
+
+    async def get_page(
+            self,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            offset: int
+    ) -> Tuple[List[dict], int, bool]:
+        """
+        Returns:
+            page of filtered objects, total count of filtered objects and flag of exact count.
+            Total count of page and its rows are read by one query
+        """
+        async with self.engine.acquire() as conn:
+            return await self._get_page(conn, filter_, order, limit, offset)
+
+    async def iter_by_filter(
+            self,
+            filter_: dict,
+            order: List[dict] = None,
+            fetch_size: int = DEFAULT_FETCH_SIZE
+    ) -> AsyncIterator[dict]:
+        """
+        Iterates all filtered objects without limit, only `fetch_size` of them are kept in memory at once
+        """
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+
+        def build():
+            query = self._filtered_query(Task.select(), filter_)
+            return self._ordered_query(query, order) if order else query
+
+        sql = self._statements.get_sql(('iter', filter_shape, get_order_shape(order or [])), build)
+        async for row in iter_rows(self.engine, sql, parameters, fetch_size):
+            yield row
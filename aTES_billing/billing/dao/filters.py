@@ -1,19 +1,75 @@
 """
 Make smart filters
 """
+from typing import Any, Iterable, Tuple
+
+from sqlalchemy import any_, bindparam, func, literal_column
+
 
 class InvalidParams(Exception):
     """
     Raises if invalid params were passed in filter
     """
 
-def make_string_filter(field: 'Column', field_filter: dict) -> 'BinaryExpression':
+
+STRING_FILTER_CONDITIONS = ('like', 'ilike', 'values', 'search')
+
+# configuration of tsvector columns and search queries, 'simple' doesn't depend on language of texts
+TEXT_SEARCH_CONFIG = 'simple'
+
+
+def get_string_filter_condition(field_name: str, field_filter: dict) -> Tuple[str, Any]:
+    """
+    Returns:
+        the only condition of field filter and its value
+
+    Raises:
+        InvalidParams: if filter parameters incorrect
+
+    """
+    conditions = [
+        (condition, field_filter.get(condition))
+        for condition in STRING_FILTER_CONDITIONS if field_filter.get(condition)
+    ]
+
+    if not conditions:
+        raise InvalidParams('No "value", "like", "ilike" or "search" for field {}'.format(field_name))
+
+    if len(conditions) > 1:
+        raise InvalidParams(
+            'Should be just one condition "value", "like", "ilike" or "search" for field {}'.format(field_name)
+        )
+
+    return conditions[0]
+
+
+def get_parameter_name(field_name: str, condition: str) -> str:
+    return '{}__{}'.format(field_name, condition)
+
+
+def _search_query(parameter: 'BindParameter') -> 'FunctionElement':
+    # config is a literal: cached SQL is executed with values of filter parameters only
+    return func.plainto_tsquery(literal_column("'{}'".format(TEXT_SEARCH_CONFIG)), parameter)
+
+
+def make_string_filter(
+        field: 'Column',
+        field_filter: dict,
+        search_vector: 'ColumnElement' = None
+) -> 'BinaryExpression':
     """
     Makes string filter for field, which can be used in query.where(...)
 
+    Value of condition is a named bound parameter, so SQL of the filter is the same
+    for any values (see get_filter_shape)
+
+    "search" condition is a full text search in `search_vector` if it is passed, otherwise it is
+    a fuzzy search of words by trigrams. Both are backed by GIN indexes (pg_trgm for trigrams).
+
     Args:
         field: table field
         field_filter: dict with filter conditions
+        search_vector: tsvector column, which contains text of the field
 
     Returns:
         field filter
@@ -22,24 +78,55 @@ def make_string_filter(field: 'Column', field_filter: dict) -> 'BinaryExpression
         InvalidParams: if filter parameters incorrect
 
     """
-    like = field_filter.get('like')
-    ilike = field_filter.get('ilike')
-    values = field_filter.get('values')
+    condition, value = get_string_filter_condition(field.key, field_filter)
+    parameter = bindparam(get_parameter_name(field.key, condition), value)
+
+    if condition == 'like':
+        return field.like(parameter)
+    if condition == 'ilike':
+        return field.ilike(parameter)
+    if condition == 'search':
+        if search_vector is not None:
+            return search_vector.op('@@')(_search_query(parameter))
+        # "%%" is "%" of SQL after formatting of parameters by driver
+        return field.op('%%>')(parameter)
+
+    # array parameter keeps SQL the same for any count of values
+    return field == any_(parameter)
+
+
+def make_search_rank(field: 'Column', field_filter: dict, search_vector: 'ColumnElement' = None) -> 'FunctionElement':
+    """
+    Makes rank of rows found by "search" condition of field filter (see make_string_filter),
+    the better row matches the higher its rank is
+    """
+    parameter = bindparam(get_parameter_name(field.key, 'search'), field_filter['search'])
+    if search_vector is not None:
+        return func.ts_rank(search_vector, _search_query(parameter))
+    return func.word_similarity(parameter, field)
 
-    count = 0
-    for item in [like, ilike, values]:
-        if item:
-            count += 1
 
-    if count == 0:
-        raise InvalidParams('No "value", "like" or "ilike" for field {}'.format(field))
+def get_filter_shape(filter_: dict, fields: Iterable[str]) -> Tuple[tuple, dict]:
+    """
+    Splits filter to its shape (fields and their conditions), which defines SQL of filtered query,
+    and values of parameters of the query
+
+    Args:
+        filter_: filter of query
+        fields: fields, which are filtered by DAO, other fields of filter are ignored
 
-    if count > 1:
-        raise InvalidParams('Should be just one condition "value", "like" or "ilike" for field {}'.format(field))
+    Raises:
+        InvalidParams: if filter parameters incorrect
+
+    """
+    shape = []
+    parameters = {}
+    for field_name in sorted(set(fields).intersection(filter_)):
+        condition, value = get_string_filter_condition(field_name, filter_[field_name])
+        shape.append((field_name, condition))
+        parameters[get_parameter_name(field_name, condition)] = list(value) if condition == 'values' else value
+    return tuple(shape), parameters
 
-    if like:
-        return field.like(like)
-    if ilike:
-        return field.ilike(ilike)
 
-    return field.in_(values)
+def get_order_shape(order: list) -> tuple:
+    return tuple((item['field'], item.get('direction', 'asc') == 'asc') for item in order)
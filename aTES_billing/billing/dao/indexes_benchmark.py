@@ -0,0 +1,149 @@
+"""
+Seeds realistic volumes of billing data and records plans and timings of hot queries.
+
+Data is seeded inside a transaction, which is rolled back at the end,
+so the script can be run against any database with applied migrations.
+
+Usage:
+    python -m billing.dao.indexes_benchmark config_file_path [result_file_path] [workers] [operations]
+"""
+import asyncio
+import json
+import sys
+
+from billing.db import init_engine
+
+
+DEFAULT_WORKERS = 1000
+DEFAULT_OPERATIONS = 1000000
+CYCLES = 365
+
+SEED = [
+    # closed cycles of past days
+    """
+    INSERT INTO billing_cycle (id, start_date, end_date, status)
+    SELECT day, day, day + interval '1 day', 'closed'
+    FROM generate_series(now()::date - %(cycles)s, now()::date - 1, interval '1 day') AS day
+    """,
+    """
+    INSERT INTO billing_cycle (id, start_date, end_date, status)
+    SELECT now()::date, now()::date, now()::date + interval '1 day', 'opened'
+    WHERE NOT EXISTS (SELECT 1 FROM billing_cycle WHERE status = 'opened')
+    """,
+    # every third operation is a reward for finished task, others are fees for assigned ones
+    """
+    INSERT INTO operation (id, billing_cycle_id, worker_id, description, debit, credit, time)
+    SELECT
+        md5('operation' || n),
+        (now()::date - n %% %(cycles)s)::timestamp::text,
+        'worker' || n %% %(workers)s,
+        'benchmark',
+        CASE WHEN n %% 3 = 0 THEN 0 ELSE 10 + n %% 10 END,
+        CASE WHEN n %% 3 = 0 THEN 20 + n %% 20 ELSE 0 END,
+        now() - (n %% %(cycles)s) * interval '1 day' - (n %% 86400) * interval '1 second'
+    FROM generate_series(1, %(operations)s) AS n
+    """,
+]
+
+QUERIES = [
+    (
+        'current billing cycle',
+        "SELECT * FROM billing_cycle WHERE status = 'opened'"
+    ),
+    (
+        'ledger of worker',
+        'SELECT * FROM operation WHERE worker_id = %(worker_id)s ORDER BY time DESC LIMIT 20'
+    ),
+    (
+        'operations of billing cycle',
+        'SELECT count(*) FROM operation WHERE billing_cycle_id = %(billing_cycle_id)s'
+    ),
+    (
+        'balances of the last day',
+        "SELECT worker_id, sum(credit) - sum(debit) FROM operation "
+        "WHERE time >= now() - interval '1 day' GROUP BY worker_id"
+    ),
+    (
+        'deep page by offset',
+        'SELECT * FROM operation ORDER BY time, id LIMIT 20 OFFSET %(offset)s'
+    ),
+    (
+        'deep page by cursor',
+        'SELECT * FROM operation WHERE (time, id) > (%(after_time)s, %(after_id)s) ORDER BY time, id LIMIT 20'
+    ),
+]
+
+
+async def explain(conn, sql: str, parameters: dict) -> dict:
+    row = await (await conn.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql, parameters)).first()
+    return row[0][0]
+
+
+async def run(conn, workers: int, operations: int) -> list:
+    parameters = {'cycles': CYCLES, 'workers': workers, 'operations': operations}
+    for statement in SEED:
+        await conn.execute(statement, parameters)
+    await conn.execute('ANALYZE billing_cycle')
+    await conn.execute('ANALYZE operation')
+
+    offset = operations // 2
+    cursor_row = await (await conn.execute(
+        'SELECT time, id FROM operation ORDER BY time, id LIMIT 1 OFFSET %(offset)s', {'offset': offset}
+    )).first()
+    parameters = {
+        'worker_id': 'worker{}'.format(workers // 2),
+        'billing_cycle_id': (await (await conn.execute(
+            'SELECT billing_cycle_id FROM operation LIMIT 1'
+        )).first())[0],
+        'offset': offset,
+        'after_time': cursor_row[0],
+        'after_id': cursor_row[1],
+    }
+
+    results = []
+    for name, sql in QUERIES:
+        plan = await explain(conn, sql, parameters)
+        results.append({
+            'query': name,
+            'sql': sql,
+            'node': plan['Plan']['Node Type'],
+            'planning_ms': plan['Planning Time'],
+            'execution_ms': plan['Execution Time'],
+            'plan': plan,
+        })
+    return results
+
+
+async def main(
+        config_file_path: str,
+        result_file_path: str = None,
+        workers: int = DEFAULT_WORKERS,
+        operations: int = DEFAULT_OPERATIONS
+):
+    with open(config_file_path) as f:
+        config = json.load(f)
+    engine = await init_engine(config['database'])
+    try:
+        async with engine.acquire() as conn:
+            transaction = await conn.begin()
+            try:
+                results = await run(conn, workers, operations)
+            finally:
+                # seeded rows must not stay in the database
+                await transaction.rollback()
+    finally:
+        engine.close()
+        await engine.wait_closed()
+
+    print('{:<30} {:<20} {:>14} {:>14}'.format('query', 'top node', 'planning, ms', 'execution, ms'))
+    for result in results:
+        print('{:<30} {:<20} {:>14.3f} {:>14.3f}'.format(
+            result['query'], result['node'], result['planning_ms'], result['execution_ms']
+        ))
+    if result_file_path:
+        with open(result_file_path, 'w') as f:
+            json.dump({'workers': workers, 'operations': operations, 'results': results}, f, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(*sys.argv[1:3], *[int(arg) for arg in sys.argv[3:5]]))
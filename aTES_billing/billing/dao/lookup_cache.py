@@ -0,0 +1,100 @@
+"""
+Provides in-process cache of rows looked up by id
+"""
+from collections import OrderedDict
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from billing.metrics import REGISTRY
+
+
+DEFAULT_LOOKUP_CACHE_SIZE = 10000
+DEFAULT_LOOKUP_CACHE_TTL = 5  # seconds
+
+CACHE_HITS = REGISTRY.counter('dao_lookup_cache_hits_total', 'Lookups by id served from cache', ('cache',))
+CACHE_MISSES = REGISTRY.counter('dao_lookup_cache_misses_total', 'Lookups by id read from database', ('cache',))
+CACHE_HIT_RATIO = REGISTRY.gauge('dao_lookup_cache_hit_ratio', 'Part of lookups by id served from cache', ('cache',))
+CACHE_SIZE = REGISTRY.gauge('dao_lookup_cache_size', 'Rows kept in cache', ('cache',))
+
+
+class LookupCache:
+    """
+    Bounded LRU cache of rows by id, rows expire in ttl seconds.
+
+    DAO invalidates changed ids after commit of a change, changes of other processes are invalidated
+    by events of the changes (see cache_invalidation_callback). An event can come to the process
+    before the other process commits the change, so a row read meanwhile can be stale: ttl bounds
+    how long it's kept. A row read from database is put only if nothing was invalidated since the read
+    had started, so a read, which raced with a change, can't put the old row back to cache.
+    """
+    def __init__(self, name: str, max_size: int = DEFAULT_LOOKUP_CACHE_SIZE, ttl: float = DEFAULT_LOOKUP_CACHE_TTL):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._rows = OrderedDict()  # type: OrderedDict[str, Tuple[float, dict]]
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def generation(self) -> int:
+        """
+        Is taken before reading of rows from database and is passed to put()
+        """
+        return self._generation
+
+    def _count(self, hits: int, misses: int) -> None:
+        self.hits += hits
+        self.misses += misses
+        CACHE_HITS.inc(hits, cache=self.name)
+        CACHE_MISSES.inc(misses, cache=self.name)
+        CACHE_HIT_RATIO.set(self.hit_ratio, cache=self.name)
+
+    def get_many(self, object_ids: Iterable[str]) -> Tuple[Dict[str, dict], List[str]]:
+        """
+        Returns:
+            cached rows by id and ids, which are not cached
+        """
+        found = {}
+        missing = []
+        now = time.monotonic()
+        for object_id in object_ids:
+            expires_at, row = self._rows.get(object_id, (None, None))
+            if row is None or expires_at <= now:
+                self._rows.pop(object_id, None)
+                missing.append(object_id)
+                continue
+            self._rows.move_to_end(object_id)
+            found[object_id] = dict(row)
+        self._count(len(found), len(missing))
+        return found, missing
+
+    def put_many(self, rows: Dict[str, dict], generation: int) -> None:
+        if generation != self._generation:
+            return
+        expires_at = time.monotonic() + self.ttl
+        for object_id, row in rows.items():
+            self._rows[object_id] = (expires_at, dict(row))
+            self._rows.move_to_end(object_id)
+        while len(self._rows) > self.max_size:
+            self._rows.popitem(last=False)
+        CACHE_SIZE.set(len(self._rows), cache=self.name)
+
+    def invalidate_many(self, object_ids: Iterable[str]) -> None:
+        self._generation += 1
+        for object_id in object_ids:
+            self._rows.pop(object_id, None)
+        CACHE_SIZE.set(len(self._rows), cache=self.name)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._rows.clear()
+        CACHE_SIZE.set(0, cache=self.name)
@@ -0,0 +1,37 @@
+"""
+Checks balances of workers against the latest balance snapshot and operations after it,
+and rewrites balances, which differ, with --repair.
+
+Work is proportional to operations of cycles after the latest snapshot, not to the whole ledger.
+Workers are split to chunks, which are computed in parallel.
+
+Usage:
+    python -m billing.dao.rebuild_balances config_file_path [--repair] [chunks]
+"""
+import asyncio
+import json
+import sys
+
+from billing.dao.dao_billing import DEFAULT_REBUILD_CHUNKS, DAOBilling
+from billing.db import init_engine
+
+
+async def main(config_file_path: str, repair: bool = False, chunks: int = DEFAULT_REBUILD_CHUNKS):
+    with open(config_file_path) as f:
+        config = json.load(f)
+    engine = await init_engine(config['database'])
+    try:
+        differences = await DAOBilling(engine).rebuild_balances(chunks, repair)
+    finally:
+        engine.close()
+        await engine.wait_closed()
+
+    print('{:<34} {:>12} {:>12}'.format('worker', 'balance', 'computed'))
+    for user_id, (balance, computed) in sorted(differences.items()):
+        print('{:<34} {:>12} {:>12}'.format(user_id, 'missing' if balance is None else balance, computed))
+    print('{} balances differ{}'.format(len(differences), ', repaired' if repair and differences else ''))
+
+
+if __name__ == '__main__':
+    arguments = [argument for argument in sys.argv[1:] if argument != '--repair']
+    asyncio.run(main(arguments[0], '--repair' in sys.argv, *[int(argument) for argument in arguments[1:2]]))
@@ -0,0 +1,101 @@
+"""
+Compares DAO calls with statements built and compiled on every call and with cached statements.
+Database is not needed: connection only does the work aiopg does before sending query to the server.
+
+Usage:
+    python -m billing.dao.statement_cache_benchmark [number]
+"""
+import asyncio
+import sys
+import time
+import uuid
+
+from aiopg.sa.engine import get_dialect
+from sqlalchemy.sql import ClauseElement
+
+from billing import const
+from billing.dao.dao_billing import DAOBilling
+from billing.dao.dao_tasks import DAOTasks
+from billing.db import PersonalBalance, Task
+
+
+DEFAULT_NUMBER = 10000
+
+
+class _Row(dict):
+    value = 0
+
+
+class _Result:
+    async def first(self):
+        return _Row()
+
+    async def scalar(self):
+        return 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        raise StopAsyncIteration
+
+
+class CompilingConnection:
+    """
+    Prepares query like aiopg.sa.SAConnection: compiles SQLAlchemy expression and collects its parameters
+    """
+    dialect = get_dialect()
+
+    async def execute(self, query, *multiparams):
+        if isinstance(query, ClauseElement):
+            compiled = query.compile(dialect=self.dialect)
+            str(compiled), compiled.construct_params()
+        return _Result()
+
+
+def _uncached_list_query(filter_: dict, limit: int, offset: int):
+    query = Task.select().where(Task.c.id.in_(filter_[const.ID]['values']))
+    return query.order_by(Task.c.id.desc()).limit(limit).offset(offset)
+
+
+async def measure(call, number: int) -> float:
+    started = time.perf_counter()
+    for _ in range(number):
+        await call()
+    return (time.perf_counter() - started) / number * 1e6
+
+
+async def main(number: int = DEFAULT_NUMBER):
+    conn = CompilingConnection()
+    dao_tasks = DAOTasks(None)
+    dao_billing = DAOBilling(None)
+    object_id = uuid.uuid4().hex
+    filter_ = {const.ID: {'values': [uuid.uuid4().hex for _ in range(10)]}}
+    order = [{'field': const.ID, 'direction': 'desc'}]
+
+    cases = [
+        (
+            'task by id',
+            lambda: conn.execute(Task.select().where(Task.c.id == object_id)),
+            lambda: dao_tasks._get(conn, object_id),  # pylint: disable = protected-access
+        ),
+        (
+            'tasks by filter',
+            lambda: conn.execute(_uncached_list_query(filter_, 10, 0)),
+            lambda: dao_tasks._get_list_by_filter(conn, filter_, order, 10, 0),  # pylint: disable = protected-access
+        ),
+        (
+            'personal balance',
+            lambda: conn.execute(PersonalBalance.select().where(PersonalBalance.c.user_id == object_id)),
+            lambda: dao_billing._get_personal_balance(conn, object_id),  # pylint: disable = protected-access
+        ),
+    ]
+    print('{:<20} {:>14} {:>14}'.format('query', 'compiled, us', 'cached, us'))
+    for name, compiled, cached in cases:
+        print('{:<20} {:>14.2f} {:>14.2f}'.format(
+            name, await measure(compiled, number), await measure(cached, number)
+        ))
+
+
+if __name__ == '__main__':
+    asyncio.run(main(*[int(arg) for arg in sys.argv[1:2]]))
@@ -2,18 +2,26 @@
 Database objects definitions
 """
 from aiopg.sa import create_engine
-from sqlalchemy import DateTime, Integer, MetaData, Table, Column, String, PrimaryKeyConstraint
+from sqlalchemy import (
+    BigInteger, DateTime, Integer, MetaData, Table, Column, String, PrimaryKeyConstraint, Text, func
+)
+
+from billing.dao.scoped_engine import ScopedEngine
 
 
-async def init_engine(db_config) -> 'Engine':
+async def init_engine(db_config) -> ScopedEngine:
     """
     Engine initialization
     """
-    return await create_engine(
+    engine = await create_engine(
         database=db_config['name'],
         host=db_config['host'],
         user=db_config['user'],
-        password=db_config['password'])
+        password=db_config['password'],
+        minsize=db_config.get('pool_min_size', 1),
+        maxsize=db_config.get('pool_max_size', 10),
+        pool_recycle=db_config.get('pool_recycle', -1))
+    return ScopedEngine(engine, acquire_timeout=db_config.get('acquire_timeout'))
 
 
 metadata = MetaData()
@@ -29,7 +37,8 @@ Operation = Table(
     Column('debit', Integer),  # списание
     Column('credit', Integer),  # пополнение
     Column('time', DateTime),
-    PrimaryKeyConstraint('id', name='operation__id__pkey')
+    # table is partitioned by range of time, so time is a part of primary key
+    PrimaryKeyConstraint('id', 'time', name='operation__id__time__pkey')
 )
 
 # договоримся, что в системе может быть лишь один открытый billing_cycle
@@ -39,24 +48,84 @@ BillingCycle = Table(
     Column('id', DateTime),
     Column('start_date', DateTime),
     Column('end_date', DateTime),  # link to task
-    Column('status', Integer),  # opened | closed
+    Column('status', String),  # opened | closed
+    Column('snapshot_id', String),  # link to balance snapshot, which includes operations of the cycle
     PrimaryKeyConstraint('id', name='operation__id__pkey')
 )
 
+# balances of workers summed over operations of all cycles up to billing_cycle_id.
+# Balance is the latest snapshot plus operations of cycles without snapshot
+BalanceSnapshot = Table(
+    'balance_snapshot',
+    metadata,
+    Column('id', String),
+    Column('billing_cycle_id', String),  # the latest cycle of snapshot
+    Column('taken_at', DateTime, server_default=func.now()),
+    PrimaryKeyConstraint('id', name='balance_snapshot__id__pkey')
+)
+
+BalanceSnapshotValue = Table(
+    'balance_snapshot_value',
+    metadata,
+    Column('snapshot_id', String),
+    Column('user_id', String),
+    Column('value', Integer),
+    PrimaryKeyConstraint('snapshot_id', 'user_id', name='balance_snapshot_value__snapshot_id__user_id__pkey')
+)
+
 
+# projections of tasks and users of streaming events.
+# event_time is time of the last written event, older events don't change a row
 Task = Table(
     'task',
     metadata,
     Column('id', String),
-    Column('assigned_worker', String),
-    Column('price', Integer),
+    Column('name', String),
+    Column('description', String),
+    Column('assigned_worker_id', String),  # link to table 'user'
+    Column('assign_price', Integer),
+    Column('finish_price', Integer),
+    Column('event_time', DateTime(timezone=True)),
     PrimaryKeyConstraint('id', name='task__id__pkey')
 )
 
+User = Table(
+    'user',
+    metadata,
+    Column('id', String),
+    Column('login', String),
+    Column('role', String),
+    Column('event_time', DateTime(timezone=True)),
+    PrimaryKeyConstraint('id', name='user__id__pkey')
+)
+
 PersonalBalance = Table(
     'personal_balance',
     metadata,
     Column('user_id', String),
     Column('value', Integer),
-    PrimaryKeyConstraint('id', name='personal_account__user_id__pkey')
+    PrimaryKeyConstraint('user_id', name='personal_account__user_id__pkey')
+)
+
+# ids of events, which changed ledger. Row is written in the same transaction with operation,
+# so redelivered event can't be applied twice
+ProcessedEvent = Table(
+    'processed_event',
+    metadata,
+    Column('event_id', String),
+    Column('processed_at', DateTime, server_default=func.now()),
+    PrimaryKeyConstraint('event_id', name='processed_event__event_id__pkey')
+)
+
+# events, which are written in the same transaction with ledger changes
+# and are published to RabbitMQ later by outbox relay
+Outbox = Table(
+    'outbox',
+    metadata,
+    Column('id', BigInteger),  # sequence, defines publishing order
+    Column('exchange', String),  # key of exchange in config['exchanges']
+    Column('routing_key', String),
+    Column('body', Text),
+    Column('created_at', DateTime, server_default=func.now()),
+    PrimaryKeyConstraint('id', name='outbox__id__pkey')
 )
@@ -1,43 +1,53 @@
 """
 Provides callbacks for rabbitmq
 """
-from datetime import datetime, timezone
-import json
-
 from billing import const
 from billing.dao.dao_tasks import handle_task_data
-from billing.rmq.message_publishing import get_message, publish_message
-from billing.rmq.publisher import RabbitMQPublisher
+from billing.rmq.deduplication import ProcessedEvents
+from billing.rmq.ledger_batcher import LedgerBatcher
+from billing.rmq.message_publishing import get_message, get_outbox_body
 from billing.schema_registry.validator import SchemaRegistryValidator
 
 
+def entity_partition_key(message: dict) -> str:
+    """
+    Partition key of streaming events: events of one entity are handled in order
+    """
+    return message['body']['data']['id']
+
+
+def worker_partition_key(message: dict) -> str:
+    """
+    Partition key of workflow events: every event changes balance of the assigned worker,
+    so events of one worker are handled in order
+    """
+    data = message['body']['data']
+    return data.get(const.ASSIGNED_WORKER_ID) or data['assigned_task_id']
+
+
 async def user_callback(message, data):
-    message_body = json.loads(message['body'])
+    message_body = message['body']
     app = data
     data = message_body['data']
     event = message_body['event_name']
 
-    if event == const.EVENT__USER_CREATED:
-        await app['dao_users'].add({
+    # created and updated events are written the same way, so replays and events of
+    # parallel consumers can't fail on existent or absent user
+    if event in (const.EVENT__USER_CREATED, const.EVENT__USER_UPDATED):
+        await app['dao_users'].upsert_if_newer({
             'id': data['id'],
             'login': data['name'],
-            'role': data['description']
-        })
-        return
-    if event == const.EVENT__USER_UPDATED:
-        await app['dao_users'].set({
-            'id': data['id'],
-            'login': data['name'],
-            'role': data['description']
+            'role': data['description'],
+            const.EVENT_TIME: message_body[const.EVENT_TIME]
         })
         return
     if event == const.EVENT__USER_DELETED:
-        await app['dao_users'].delete(data['id'])
+        await app['dao_users'].delete_if_newer(data['id'], message_body[const.EVENT_TIME])
         return
 
 
 async def task_callback(message, data):
-    message_body = json.loads(message['body'])
+    message_body = message['body']
     app = data
     data = message_body['data']
     event = message_body['event_name']
@@ -47,95 +57,69 @@ async def task_callback(message, data):
             'id': data['id'],
             'name': data['name'],
             'description': data['description'],
-            'assigned_worker': data['description']
+            const.ASSIGNED_WORKER_ID: data.get(const.ASSIGNED_WORKER_ID),
+            const.EVENT_TIME: message_body[const.EVENT_TIME]
         }
         await handle_task_data(task, app['dao_tasks'])
         return
 
 
-async def _handle_assigned_task(task_id, dao_billing, dao_tasks) -> dict:
-    task = await dao_tasks.get(task_id)
-    billing_cycle = await dao_billing.get_current_billing_cycle()
-    billing_cycle_id = billing_cycle[const.BILLING_CYCLE_ID]
-    credit = 0
-    debit = task[const.ASSIGN_PRICE]
-    operation_time = datetime.now(timezone.utc).isoformat()
-    operation = {
-        const.BILLING_CYCLE_ID: billing_cycle_id,
-        const.TIME: operation_time,
-        const.DESCRIPTION: task_id,
-        const.WORKER_ID: task[const.ASSIGNED_WORKER_ID],
-        const.CREDIT: credit,
-        const.DEBIT: debit
-    }
-    operation[const.ID] = await dao_billing.add_operation(operation)
-    return operation
+async def cache_invalidation_callback(message, data):
+    """
+    Invalidates cached task or user of streaming event. Every process has its own queue of the events
+    for it, while the event is written to table by one of processes
+    """
+    app = data
+    event = message['body']['event_name']
+    object_id = message['body']['data']['id']
 
+    if event in (const.EVENT__USER_CREATED, const.EVENT__USER_UPDATED, const.EVENT__USER_DELETED):
+        app['dao_users'].cache.invalidate_many([object_id])
+        return
+    if event in (const.EVENT__TASK_CREATED, const.EVENT__TASK_UPDATED):
+        app['dao_tasks'].cache.invalidate_many([object_id])
+        return
 
-async def stream_new_operation(
-        operation: dict,
-        routing_key: str,
-        publisher: RabbitMQPublisher,
-        validator: SchemaRegistryValidator
-):
+
+def get_operation_message(operation: dict, validator: SchemaRegistryValidator) -> dict:
     data = {
         **operation,
         const.OPERATION_ID: operation[const.ID]
     }
     data.pop(const.ID)
-    message = get_message(data, const.EVENT__OPERATION_CREATED, validator)
-    await publish_message(
-        publisher,
-        routing_key,
-        message
-    )
-
-
-async def _handle_finished_task(task_id, dao_billing, dao_tasks) -> dict:
-    task = await dao_tasks.get(task_id)
-    billing_cycle = await dao_billing.get_current_billing_cycle()
-    billing_cycle_id = billing_cycle[const.BILLING_CYCLE_ID]
-    credit = task[const.FINISH_PRICE]
-    debit = 0
-    operation_time = datetime.now(timezone.utc).isoformat()
-    operation = {
-        const.BILLING_CYCLE_ID: billing_cycle_id,
-        const.TIME: operation_time,
-        const.DESCRIPTION: task_id,
-        const.WORKER_ID: task[const.ASSIGNED_WORKER_ID],
-        const.CREDIT: credit,
-        const.DEBIT: debit
+    return get_message(data, const.EVENT__OPERATION_CREATED, validator)
+
+
+def get_operation_outbox_message(operation: dict, exchanges: dict, validator: SchemaRegistryValidator) -> dict:
+    """
+    Outbox message of operation created event, exchanges is config['exchanges']
+    """
+    return {
+        'exchange': const.EXCHANGE__OPERATION_STREAMING,
+        'routing_key': exchanges[const.EXCHANGE__OPERATION_STREAMING]['name'],
+        'body': get_outbox_body(get_operation_message(operation, validator))
     }
-    operation[const.ID] = await dao_billing.add_operation(operation)
-    return operation
 
 
 async def task_workflow_callback(message, data):
-    message_body = json.loads(message['body'])
+    message_body = message['body']
     app = data
     data = message_body['data']
     event = message_body['event_name']
+    event_id = message_body['event_id']
+
+    processed_events = app['processed_events']  # type: ProcessedEvents
+    if event_id in processed_events:
+        # redelivered event, which was handled by this process
+        return
+
+    if event not in (const.EVENT__TASK_ASSIGNED_1, const.EVENT__TASK_FINISHED_1):
+        return
+
+    # списание за назначенную задачу или начисление за выполненную.
+    # Operation created event is written to outbox in the transaction of operation,
+    # so event is marked processed only when both are committed
+    ledger_batcher = app['ledger_batcher']  # type: LedgerBatcher
+    await ledger_batcher.add(event, event_id, data['assigned_task_id'])
 
-    if event == const.EVENT__TASK_ASSIGNED_1:
-        task_id = data['assigned_task_id']
-        operation = await _handle_assigned_task(
-            task_id,
-            app['dao_billing'],
-            app['dao_tasks']
-        )  # создать запись о том что бабки списаны
-
-    if event == const.EVENT__TASK_FINISHED_1:
-        task_id = data['assigned_task_id']
-        operation = await _handle_finished_task(
-            task_id,
-            app['dao_billing'],
-            app['dao_tasks']
-        )  # начислить бабки
-
-    if event in (const.EVENT__TASK_FINISHED_1, const.EVENT__TASK_ASSIGNED_1):
-        await stream_new_operation(
-            operation,
-            app['config']['exchanges']['operation_streaming']['name'],
-            app['operation_publisher'],
-            app['schema_validator']
-        )
+    processed_events.add(event_id)
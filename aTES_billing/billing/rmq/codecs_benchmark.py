@@ -0,0 +1,72 @@
+"""
+Compares codecs on messages of the existing event schemas
+
+Usage:
+    python -m billing.rmq.codecs_benchmark [schemas_dir_path] [number]
+"""
+import os
+import sys
+import timeit
+import uuid
+
+from billing.rmq.codecs import CODECS, Codec
+from billing.schema_registry.validator import SchemaRegistryValidator
+from billing.utils import get_default_message_data
+
+
+DEFAULT_SCHEMAS_DIR_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'schema_registry', 'schemas')
+DEFAULT_NUMBER = 10000
+
+SAMPLE_VALUES = {
+    'integer': lambda: 1500,
+    'float': lambda: 15.25,
+    'number': lambda: 15.25,
+    'boolean': lambda: True,
+    'string': lambda: uuid.uuid4().hex,
+}
+
+
+def make_sample(schema: dict) -> dict:
+    """
+    Fills every field of cerberus schema with a value of its type
+    """
+    result = {}
+    for field, rules in schema.items():
+        if rules.get('type') == 'dict':
+            result[field] = make_sample(rules.get('schema', {}))
+        else:
+            result[field] = SAMPLE_VALUES.get(rules.get('type'), SAMPLE_VALUES['string'])()
+    return result
+
+
+def make_message(event_name: str, schema: dict) -> dict:
+    return {
+        **get_default_message_data(version=1),
+        'event_name': event_name,
+        'data': make_sample(schema.get('data', {}).get('schema', {})),
+    }
+
+
+def measure(codec: Codec, message: dict, number: int) -> dict:
+    body = codec.encode(message)
+    return {
+        'size': len(body),
+        'encode': timeit.timeit(lambda: codec.encode(message), number=number) / number * 1e6,
+        'decode': timeit.timeit(lambda: codec.decode(body), number=number) / number * 1e6,
+    }
+
+
+def main(schemas_dir_path: str = DEFAULT_SCHEMAS_DIR_PATH, number: int = DEFAULT_NUMBER):
+    registry = SchemaRegistryValidator(schemas_dir_path)
+    print('{:<22} {:<20} {:>8} {:>12} {:>12}'.format('event', 'content type', 'bytes', 'encode, us', 'decode, us'))
+    for event_name in sorted(registry._validators):  # pylint: disable = protected-access
+        message = make_message(event_name, registry._validators[event_name].schema)  # pylint: disable = protected-access
+        for content_type, codec in CODECS.items():
+            result = measure(codec, message, number)
+            print('{:<22} {:<20} {:>8} {:>12.2f} {:>12.2f}'.format(
+                event_name, content_type, result['size'], result['encode'], result['decode']
+            ))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2], *[int(arg) for arg in sys.argv[2:3]])
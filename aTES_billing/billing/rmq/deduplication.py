@@ -0,0 +1,112 @@
+"""
+Provides tools for skipping redelivered events
+"""
+import asyncio
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional
+
+from billing.dao.dao_billing import DAOBilling
+from billing.metrics import REGISTRY
+
+
+DEFAULT_PROCESSED_EVENTS_CACHE_SIZE = 10000
+
+# redelivery of event comes within the retry delays, but parked event can be replayed later:
+# replayed event, which is older than max age, is applied again
+DEFAULT_PROCESSED_EVENTS_MAX_AGE = 7 * 24 * 3600  # seconds
+DEFAULT_PROCESSED_EVENTS_CHECK_INTERVAL = 3600  # seconds
+DEFAULT_PROCESSED_EVENTS_DELETE_BATCH_SIZE = 10000
+
+DELETED_PROCESSED_EVENTS = REGISTRY.counter(
+    'processed_events_deleted_total',
+    'Ids of processed events deleted by retention'
+)
+
+
+class ProcessedEvents:
+    """
+    Bounded LRU set of ids of recently processed events.
+
+    It's the fast path for redeliveries to the same process. Events, which were processed
+    by another process or before restart, are detected by 'processed_event' table.
+    """
+    def __init__(self, max_size: int = DEFAULT_PROCESSED_EVENTS_CACHE_SIZE):
+        self.max_size = max_size
+        self._event_ids = OrderedDict()
+
+    def __contains__(self, event_id: str) -> bool:
+        if event_id not in self._event_ids:
+            return False
+        self._event_ids.move_to_end(event_id)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._event_ids)
+
+    def add(self, event_id: str) -> None:
+        self._event_ids[event_id] = None
+        self._event_ids.move_to_end(event_id)
+        while len(self._event_ids) > self.max_size:
+            self._event_ids.popitem(last=False)
+
+
+class ProcessedEventsRetention:
+    """
+    Deletes rows of 'processed_event' table, which are older than `max_age` seconds.
+
+    Every `check_interval` seconds expired rows are deleted by batches of `batch_size` rows,
+    so a long backlog doesn't hold locks of one big transaction.
+    """
+    def __init__(
+            self,
+            dao_billing: DAOBilling,
+            max_age: float = DEFAULT_PROCESSED_EVENTS_MAX_AGE,
+            check_interval: float = DEFAULT_PROCESSED_EVENTS_CHECK_INTERVAL,
+            batch_size: int = DEFAULT_PROCESSED_EVENTS_DELETE_BATCH_SIZE
+    ):
+        self.dao_billing = dao_billing
+        self.max_age = timedelta(seconds=max_age)
+        self.check_interval = check_interval
+        self.batch_size = batch_size
+        self._watcher = None  # type: Optional[asyncio.Task]
+
+    async def delete_expired(self) -> int:
+        """
+        Returns:
+            count of deleted rows
+        """
+        deleted = 0
+        while True:
+            count = await self.dao_billing.delete_processed_events(self.max_age, self.batch_size)
+            DELETED_PROCESSED_EVENTS.inc(count)
+            deleted += count
+            if count < self.batch_size:
+                return deleted
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.delete_expired()
+            except Exception as e:  # pylint: disable = broad-except
+                print('Processed events retention failed: ', e)
+
+    def start(self):
+        """
+        Starts background deletion of expired processed events
+        """
+        if self._watcher is None:
+            self._watcher = asyncio.ensure_future(self._watch())
+
+    async def stop(self):
+        """
+        Stops background deletion of expired processed events
+        """
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
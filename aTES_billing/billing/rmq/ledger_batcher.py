@@ -0,0 +1,129 @@
+"""
+Provides batching of ledger writes for task workflow events
+"""
+import asyncio
+import contextvars
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+from billing import const
+from billing.dao.dao_billing import DAOBilling
+from billing.dao.dao_tasks import DAOTasks
+from billing.exceptions import NotFound
+from billing.rmq.outbox_relay import OutboxRelay
+
+
+class LedgerBatcher:
+    """
+    Collects task workflow events for `linger` seconds (or until `max_size` events)
+    and applies them to ledger in one transaction: one multi-row insert into 'operation'
+    and one balance update per affected worker.
+
+    add() returns only after the transaction is committed, so consumer acknowledges
+    the message only when its operation is stored. Messages of `make_outbox_messages` about
+    added operations are stored in the same transaction and are published by `outbox_relay`.
+    Every event waits in add() until its batch is applied, so a batch can have as many events
+    as consumer handles at once: consumer has to have at least `max_size` handlers.
+    """
+    def __init__(
+            self,
+            dao_billing: DAOBilling,
+            dao_tasks: DAOTasks,
+            max_size: int = 100,
+            linger: float = 0.005,
+            make_outbox_messages: Callable[[List[dict]], List[dict]] = None,
+            outbox_relay: OutboxRelay = None
+    ):
+        self.dao_billing = dao_billing
+        self.dao_tasks = dao_tasks
+        self.make_outbox_messages = make_outbox_messages
+        self.outbox_relay = outbox_relay
+        self.max_size = max(1, max_size)
+        self.linger = linger
+        self._pending = []  # type: List[Tuple[str, str, str, asyncio.Future]]
+        self._linger_timer = None  # type: Optional[asyncio.TimerHandle]
+
+    async def add(self, event_name: str, event_id: str, task_id: str) -> Optional[dict]:
+        """
+        Adds operation for assigned or finished task
+
+        Args:
+            event_name: EVENT__TASK_ASSIGNED_1 or EVENT__TASK_FINISHED_1
+            event_id: id of the event
+            task_id: id of the task
+
+        Returns:
+            added operation or None if the event was processed already
+
+        Raises:
+            NotFound: if task is unknown yet
+
+        """
+        future = asyncio.get_event_loop().create_future()
+        self._pending.append((event_name, event_id, task_id, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._linger_timer is None:
+            self._linger_timer = asyncio.get_event_loop().call_later(self.linger, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._linger_timer is not None:
+            self._linger_timer.cancel()
+            self._linger_timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # batch is applied out of connection scope of the message, which filled it:
+            # the task gets an empty context instead of a copy of the current one
+            contextvars.Context().run(asyncio.ensure_future, self._apply(batch))
+
+    @staticmethod
+    def _make_operation(event_name: str, task: dict) -> dict:
+        if event_name == const.EVENT__TASK_ASSIGNED_1:
+            credit, debit = 0, task[const.ASSIGN_PRICE]  # списание
+        else:
+            credit, debit = task[const.FINISH_PRICE], 0  # начисление
+        return {
+            const.TIME: datetime.now(timezone.utc).isoformat(),
+            const.DESCRIPTION: task[const.ID],
+            const.WORKER_ID: task[const.ASSIGNED_WORKER_ID],
+            const.CREDIT: credit,
+            const.DEBIT: debit
+        }
+
+    async def _apply(self, batch: List[Tuple[str, str, str, asyncio.Future]]) -> None:
+        try:
+            tasks = await self.dao_tasks.get_many(list({task_id for _, _, task_id, _ in batch}))
+
+            applicable = []
+            operations = []
+            for event_name, event_id, task_id, future in batch:
+                if task_id not in tasks:
+                    # only this event fails, the rest of batch is applied
+                    future.set_exception(NotFound('Task {} not found'.format(task_id)))
+                    continue
+                applicable.append((event_id, future))
+                operations.append(self._make_operation(event_name, tasks[task_id]))
+
+            if not operations:
+                return
+            # billing cycle is read in the transaction of operations
+            operation_ids = await self.dao_billing.add_operations_to_current_cycle(
+                operations,
+                [event_id for event_id, _ in applicable],
+                self.make_outbox_messages
+            )
+        except Exception as e:  # pylint: disable = broad-except
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        if self.outbox_relay is not None and any(operation_id is not None for operation_id in operation_ids):
+            self.outbox_relay.wake()
+        for (_, future), operation, operation_id in zip(applicable, operations, operation_ids):
+            if operation_id is None:
+                future.set_result(None)
+                continue
+            operation[const.ID] = operation_id
+            future.set_result(operation)
@@ -1,18 +1,19 @@
 """
 Provides tools for publishing messages
 """
-from datetime import datetime
-import json
+import asyncio
+from datetime import datetime, timezone
 import uuid
 
 from billing.exceptions import InvalidParams
+from billing.rmq.codecs import CONTENT_TYPE__JSON, get_codec
 from billing.rmq.publisher import RabbitMQPublisher
 from billing.schema_registry.validator import SchemaRegistryValidator
 
 
 def get_default_message_data(version: int = 1) -> dict:
     return {
-        'event_time': datetime.now(),
+        'event_time': datetime.now(timezone.utc),
         'event_version': version,
         'event_id': uuid.uuid4().hex
     }
@@ -31,8 +32,26 @@ def get_message(obj: dict, event_name: str, validator: SchemaRegistryValidator):
     }
 
 
+def get_outbox_body(message: dict) -> str:
+    # outbox keeps messages as JSON text, relay re-encodes them with publisher's codec
+    return get_codec(CONTENT_TYPE__JSON).encode(message).decode()
+
+
 async def publish_message(
         publisher: RabbitMQPublisher,
         routing_key: str,
         message: dict):
-    await publisher.publish(routing_key, json.dumps(message))
+    await publisher.publish(routing_key, message)
+
+
+def enqueue_message(
+        publisher: RabbitMQPublisher,
+        routing_key: str,
+        message: dict) -> asyncio.Future:
+    """
+    Puts message to publisher's buffer without waiting for its confirmation
+
+    Returns:
+        future, which is resolved when message is confirmed by RabbitMQ
+    """
+    return publisher.enqueue(routing_key, message)
@@ -1,13 +1,13 @@
 """
 Common tools
 """
-from datetime import datetime
+from datetime import datetime, timezone
 import uuid
 
 
 def get_default_message_data(version: int = 1) -> dict:
     return {
-        'event_time': datetime.now(),
+        'event_time': datetime.now(timezone.utc),
         'event_version': version,
         'event_id': uuid.uuid4().hex
     }
@@ -0,0 +1,85 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from billing.dao.cursor import (
+    decode_cursor,
+    encode_cursor,
+    get_next_cursor,
+    get_order_keys,
+    seek_condition
+)
+from billing.db import Operation
+from billing.exceptions import InvalidParams
+
+
+def render(condition) -> str:
+    return str(condition.compile(dialect=postgresql.dialect()))
+
+
+def test_id_is_added_as_the_last_key_in_direction_of_order():
+    assert get_order_keys(Operation, []) == (('id', True),)
+    assert get_order_keys(Operation, [{'field': 'time', 'direction': 'desc'}]) == (('time', False), ('id', False))
+    assert get_order_keys(Operation, [{'field': 'id', 'direction': 'desc'}, {'field': 'time'}]) == (
+        ('id', False), ('time', True)
+    )
+
+
+def test_cursor_is_decoded_to_values_of_keys():
+    keys = (('time', False), ('debit', True), ('id', True))
+    row = {'time': datetime(2026, 10, 18, 12, 30), 'debit': 10, 'id': 'operation-1'}
+
+    parameters = decode_cursor(encode_cursor(row, keys), Operation, keys)
+
+    assert parameters == {'time__after': row['time'], 'debit__after': 10, 'id__after': 'operation-1'}
+
+
+@pytest.mark.parametrize('cursor', ['not base64!', 'bm90IGpzb24=', 'eyJhIjogMX0='])
+def test_broken_cursor_is_invalid(cursor):
+    with pytest.raises(InvalidParams):
+        decode_cursor(cursor, Operation, (('id', True),))
+
+
+def test_cursor_of_another_order_is_invalid():
+    cursor = encode_cursor({'time': '2026-10-18', 'id': '1'}, (('time', True), ('id', True)))
+
+    with pytest.raises(InvalidParams):
+        decode_cursor(cursor, Operation, (('id', True),))
+
+
+def test_cursor_with_invalid_time_is_invalid():
+    cursor = encode_cursor({'time': 'yesterday', 'id': '1'}, (('time', True), ('id', True)))
+
+    with pytest.raises(InvalidParams):
+        decode_cursor(cursor, Operation, (('time', True), ('id', True)))
+
+
+def test_keys_of_one_direction_are_compared_as_row():
+    ascending = (('time', True), ('id', True))
+    descending = (('time', False), ('id', False))
+
+    assert render(seek_condition(Operation, ascending, {})) == (
+        '(operation.time, operation.id) > (%(time__after)s, %(id__after)s)'
+    )
+    assert render(seek_condition(Operation, descending, {})) == (
+        '(operation.time, operation.id) < (%(time__after)s, %(id__after)s)'
+    )
+
+
+def test_keys_of_mixed_directions_are_expanded():
+    keys = (('time', False), ('debit', True), ('id', True))
+
+    assert render(seek_condition(Operation, keys, {})) == (
+        'operation.time < %(time__after)s '
+        'OR operation.time = %(time__after)s AND operation.debit > %(debit__after)s '
+        'OR operation.time = %(time__after)s AND operation.debit = %(debit__after)s AND operation.id > %(id__after)s'
+    )
+
+
+def test_next_cursor_is_made_of_the_last_row_of_page():
+    keys = (('id', True),)
+    rows = [{'id': '1'}, {'id': '2'}, {'id': '3'}]
+
+    assert get_next_cursor(rows[:2], 2, keys) is None
+    assert decode_cursor(get_next_cursor(rows, 2, keys), Operation, keys) == {'id__after': '2'}
@@ -0,0 +1,68 @@
+import asyncio
+
+from billing.rmq.deduplication import ProcessedEvents, ProcessedEventsRetention
+
+
+def test_added_event_is_processed():
+    processed_events = ProcessedEvents(max_size=2)
+    processed_events.add('event-1')
+
+    assert 'event-1' in processed_events
+    assert 'event-2' not in processed_events
+
+
+def test_least_recently_used_event_is_evicted():
+    processed_events = ProcessedEvents(max_size=2)
+    processed_events.add('event-1')
+    processed_events.add('event-2')
+    processed_events.add('event-3')
+
+    assert len(processed_events) == 2
+    assert 'event-1' not in processed_events
+    assert 'event-2' in processed_events
+    assert 'event-3' in processed_events
+
+
+def test_lookup_makes_event_recently_used():
+    processed_events = ProcessedEvents(max_size=2)
+    processed_events.add('event-1')
+    processed_events.add('event-2')
+    assert 'event-1' in processed_events
+
+    processed_events.add('event-3')
+
+    assert 'event-1' in processed_events
+    assert 'event-2' not in processed_events
+
+
+def test_added_again_event_is_not_duplicated():
+    processed_events = ProcessedEvents(max_size=2)
+    processed_events.add('event-1')
+    processed_events.add('event-2')
+    processed_events.add('event-1')
+    processed_events.add('event-3')
+
+    assert len(processed_events) == 2
+    assert 'event-1' in processed_events
+    assert 'event-2' not in processed_events
+
+
+class FakeDAOBilling:
+    def __init__(self, expired: int):
+        self.expired = expired
+        self.calls = []
+
+    async def delete_processed_events(self, max_age, limit):
+        self.calls.append((max_age, limit))
+        deleted = min(self.expired, limit)
+        self.expired -= deleted
+        return deleted
+
+
+def test_retention_deletes_expired_events_by_batches():
+    dao_billing = FakeDAOBilling(expired=25)
+    retention = ProcessedEventsRetention(dao_billing, max_age=60, batch_size=10)
+
+    assert asyncio.run(retention.delete_expired()) == 25
+    assert [limit for _, limit in dao_billing.calls] == [10, 10, 10]
+    assert dao_billing.calls[0][0].total_seconds() == 60
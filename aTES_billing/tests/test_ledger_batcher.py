@@ -0,0 +1,176 @@
+import asyncio
+
+import pytest
+
+from billing import const
+from billing.exceptions import NotFound
+from billing.rmq.ledger_batcher import LedgerBatcher
+
+
+TASKS = {
+    'task-1': {const.ID: 'task-1', const.ASSIGN_PRICE: 10, const.FINISH_PRICE: 30, const.ASSIGNED_WORKER_ID: 'worker-1'},
+    'task-2': {const.ID: 'task-2', const.ASSIGN_PRICE: 15, const.FINISH_PRICE: 25, const.ASSIGNED_WORKER_ID: 'worker-2'},
+}
+
+
+class FakeDAOTasks:
+    async def get_many(self, task_ids):
+        return {task_id: TASKS[task_id] for task_id in task_ids if task_id in TASKS}
+
+
+class FakeDAOBilling:
+    def __init__(self, processed=(), error=None):
+        self.processed = set(processed)
+        self.error = error
+        self.batches = []
+        self.outbox_messages = []
+
+    async def add_operations_to_current_cycle(self, operations, event_ids, make_outbox_messages=None):
+        self.batches.append((operations, event_ids))
+        if self.error is not None:
+            raise self.error
+        operation_ids = [
+            None if event_id in self.processed else 'operation-{}'.format(event_id)
+            for event_id in event_ids
+        ]
+        self.processed.update(event_ids)
+        added = [operation for operation, operation_id in zip(operations, operation_ids) if operation_id is not None]
+        if added and make_outbox_messages is not None:
+            self.outbox_messages.extend(make_outbox_messages(added))
+        return operation_ids
+
+
+class FakeOutboxRelay:
+    def __init__(self):
+        self.wakes = 0
+
+    def wake(self):
+        self.wakes += 1
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_batch_is_flushed_by_size():
+    dao_billing = FakeDAOBilling()
+    batcher = LedgerBatcher(dao_billing, FakeDAOTasks(), max_size=2, linger=60)
+
+    async def add_events():
+        return await asyncio.wait_for(asyncio.gather(
+            batcher.add(const.EVENT__TASK_ASSIGNED_1, 'event-1', 'task-1'),
+            batcher.add(const.EVENT__TASK_FINISHED_1, 'event-2', 'task-2'),
+        ), timeout=1)
+
+    run(add_events())
+    assert [event_ids for _, event_ids in dao_billing.batches] == [['event-1', 'event-2']]
+
+
+def test_batch_is_flushed_by_linger():
+    dao_billing = FakeDAOBilling()
+    batcher = LedgerBatcher(dao_billing, FakeDAOTasks(), max_size=100, linger=0.01)
+
+    operation = run(asyncio.wait_for(batcher.add(const.EVENT__TASK_ASSIGNED_1, 'event-1', 'task-1'), timeout=1))
+
+    assert operation[const.ID] == 'operation-event-1'
+    assert len(dao_billing.batches) == 1
+
+
+def test_batches_are_split_by_max_size():
+    dao_billing = FakeDAOBilling()
+    batcher = LedgerBatcher(dao_billing, FakeDAOTasks(), max_size=2, linger=0.01)
+
+    async def add_events():
+        return await asyncio.gather(*[
+            batcher.add(const.EVENT__TASK_ASSIGNED_1, 'event-{}'.format(index), 'task-1') for index in range(5)
+        ])
+
+    run(add_events())
+    assert [len(event_ids) for _, event_ids in dao_billing.batches] == [2, 2, 1]
+
+
+def test_results_are_fanned_out_to_events():
+    dao_billing = FakeDAOBilling(processed={'event-2'})
+    batcher = LedgerBatcher(dao_billing, FakeDAOTasks(), max_size=3, linger=60)
+
+    async def add_events():
+        return await asyncio.gather(
+            batcher.add(const.EVENT__TASK_ASSIGNED_1, 'event-1', 'task-1'),
+            batcher.add(const.EVENT__TASK_FINISHED_1, 'event-2', 'task-2'),
+            batcher.add(const.EVENT__TASK_FINISHED_1, 'event-3', 'unknown'),
+            return_exceptions=True
+        )
+
+    assigned, duplicate, unknown = run(add_events())
+
+    assert assigned[const.ID] == 'operation-event-1'
+    assert assigned[const.WORKER_ID] == 'worker-1'
+    assert (assigned[const.DEBIT], assigned[const.CREDIT]) == (10, 0)
+    assert duplicate is None
+    assert isinstance(unknown, NotFound)
+    # event of unknown task isn't written, the rest of batch is
+    assert dao_billing.batches[0][1] == ['event-1', 'event-2']
+
+
+def test_finished_task_credits_worker():
+    batcher = LedgerBatcher(FakeDAOBilling(), FakeDAOTasks(), max_size=1)
+
+    operation = run(batcher.add(const.EVENT__TASK_FINISHED_1, 'event-1', 'task-2'))
+
+    assert (operation[const.DEBIT], operation[const.CREDIT]) == (0, 25)
+    assert operation[const.DESCRIPTION] == 'task-2'
+
+
+def test_failed_batch_fails_every_event():
+    error = RuntimeError('database is down')
+    batcher = LedgerBatcher(FakeDAOBilling(error=error), FakeDAOTasks(), max_size=2)
+
+    async def add_events():
+        return await asyncio.gather(
+            batcher.add(const.EVENT__TASK_ASSIGNED_1, 'event-1', 'task-1'),
+            batcher.add(const.EVENT__TASK_ASSIGNED_1, 'event-2', 'task-2'),
+            return_exceptions=True
+        )
+
+    assert run(add_events()) == [error, error]
+
+
+def test_outbox_messages_are_made_of_added_operations():
+    dao_billing = FakeDAOBilling(processed={'event-2'})
+    outbox_relay = FakeOutboxRelay()
+    batcher = LedgerBatcher(
+        dao_billing,
+        FakeDAOTasks(),
+        max_size=2,
+        make_outbox_messages=lambda operations: [operation[const.DESCRIPTION] for operation in operations],
+        outbox_relay=outbox_relay
+    )
+
+    async def add_events():
+        return await asyncio.gather(
+            batcher.add(const.EVENT__TASK_ASSIGNED_1, 'event-1', 'task-1'),
+            batcher.add(const.EVENT__TASK_ASSIGNED_1, 'event-2', 'task-2'),
+        )
+
+    run(add_events())
+    assert dao_billing.outbox_messages == ['task-1']
+    assert outbox_relay.wakes == 1
+
+
+def test_outbox_relay_is_not_woken_without_added_operations():
+    outbox_relay = FakeOutboxRelay()
+    batcher = LedgerBatcher(
+        FakeDAOBilling(processed={'event-1'}),
+        FakeDAOTasks(),
+        max_size=1,
+        make_outbox_messages=lambda operations: operations,
+        outbox_relay=outbox_relay
+    )
+
+    assert run(batcher.add(const.EVENT__TASK_ASSIGNED_1, 'event-1', 'task-1')) is None
+    assert outbox_relay.wakes == 0
+
+
+@pytest.mark.parametrize('max_size', [0, -1])
+def test_max_size_is_at_least_one(max_size):
+    assert LedgerBatcher(FakeDAOBilling(), FakeDAOTasks(), max_size=max_size).max_size == 1
@@ -0,0 +1,93 @@
+from billing.dao import lookup_cache
+from billing.dao.lookup_cache import LookupCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(lookup_cache.time, 'monotonic', clock)
+    return LookupCache('test', **kwargs), clock
+
+
+def test_put_rows_are_found(monkeypatch):
+    cache, _ = make_cache(monkeypatch)
+    cache.put_many({'1': {'id': '1'}}, cache.generation)
+
+    found, missing = cache.get_many(['1', '2'])
+
+    assert found == {'1': {'id': '1'}}
+    assert missing == ['2']
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.hit_ratio == 0.5
+
+
+def test_cached_row_is_a_copy(monkeypatch):
+    cache, _ = make_cache(monkeypatch)
+    row = {'id': '1'}
+    cache.put_many({'1': row}, cache.generation)
+    row['id'] = 'changed'
+
+    found, _ = cache.get_many(['1'])
+    found['1']['id'] = 'changed too'
+
+    assert cache.get_many(['1'])[0] == {'1': {'id': '1'}}
+
+
+def test_row_expires_in_ttl(monkeypatch):
+    cache, clock = make_cache(monkeypatch, ttl=5)
+    cache.put_many({'1': {'id': '1'}}, cache.generation)
+
+    clock.now += 4.9
+    assert cache.get_many(['1'])[1] == []
+
+    clock.now += 0.1
+    assert cache.get_many(['1'])[1] == ['1']
+    assert len(cache) == 0
+
+
+def test_put_of_old_generation_is_skipped(monkeypatch):
+    cache, _ = make_cache(monkeypatch)
+    generation = cache.generation
+    # row is changed while it is read from database
+    cache.invalidate_many(['1'])
+
+    cache.put_many({'1': {'id': '1'}}, generation)
+
+    assert cache.get_many(['1'])[1] == ['1']
+
+
+def test_invalidated_row_is_missing(monkeypatch):
+    cache, _ = make_cache(monkeypatch)
+    cache.put_many({'1': {'id': '1'}, '2': {'id': '2'}}, cache.generation)
+
+    cache.invalidate_many(['1'])
+
+    assert cache.get_many(['1', '2']) == ({'2': {'id': '2'}}, ['1'])
+
+
+def test_clear_removes_rows_and_changes_generation(monkeypatch):
+    cache, _ = make_cache(monkeypatch)
+    generation = cache.generation
+    cache.put_many({'1': {'id': '1'}}, generation)
+
+    cache.clear()
+
+    assert len(cache) == 0
+    assert cache.generation != generation
+
+
+def test_least_recently_used_row_is_evicted(monkeypatch):
+    cache, _ = make_cache(monkeypatch, max_size=2)
+    cache.put_many({'1': {'id': '1'}, '2': {'id': '2'}}, cache.generation)
+    cache.get_many(['1'])
+
+    cache.put_many({'3': {'id': '3'}}, cache.generation)
+
+    assert cache.get_many(['1', '2', '3']) == ({'1': {'id': '1'}, '3': {'id': '3'}}, ['2'])
@@ -0,0 +1,53 @@
+from billing.rmq.retry import RetryPolicy, get_retry_policy
+
+
+def test_delay_grows_by_multiplier():
+    policy = RetryPolicy(initial_delay=1, multiplier=2, max_delay=300)
+
+    assert [policy.get_delay(attempt) for attempt in (1, 2, 3, 4)] == [1000, 2000, 4000, 8000]
+
+
+def test_delay_is_capped_by_max_delay():
+    policy = RetryPolicy(initial_delay=1, multiplier=10, max_delay=30)
+
+    assert policy.get_delay(2) == 10000
+    assert policy.get_delay(3) == 30000
+    assert policy.get_delay(10) == 30000
+
+
+def test_delays_are_unique_delays_before_parking():
+    policy = RetryPolicy(max_attempts=5, initial_delay=1, multiplier=10, max_delay=30)
+
+    # the last attempt parks message, so it has no delay
+    assert policy.delays == [1000, 10000, 30000]
+
+
+def test_single_attempt_has_no_delays():
+    assert RetryPolicy(max_attempts=0).max_attempts == 1
+    assert RetryPolicy(max_attempts=1).delays == []
+
+
+def test_consumer_options_override_default_ones():
+    retry_policies = {
+        'default': {'max_attempts': 5, 'initial_delay': 1, 'max_delay': 300},
+        'billing.workflow': {'max_attempts': 10},
+    }
+
+    policy = get_retry_policy(retry_policies, 'billing.workflow')
+
+    assert policy.max_attempts == 10
+    assert policy.initial_delay == 1
+    assert policy.max_delay == 300
+
+
+def test_default_options_are_used_for_unknown_consumer():
+    policy = get_retry_policy({'default': {'max_attempts': 3}}, 'billing.user')
+
+    assert policy.max_attempts == 3
+    assert policy.multiplier == 2
+
+
+def test_policy_without_config_has_default_options():
+    policy = get_retry_policy({}, 'billing.user')
+
+    assert (policy.max_attempts, policy.initial_delay, policy.multiplier, policy.max_delay) == (5, 1, 2, 300)
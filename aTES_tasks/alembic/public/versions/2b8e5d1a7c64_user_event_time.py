@@ -0,0 +1,25 @@
+"""Time of the last written event of user
+
+Revision ID: 2b8e5d1a7c64
+Revises: 6e8b1d4f2a97
+Create Date: 2026-10-18 21:37:08.240915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b8e5d1a7c64'
+down_revision = '6e8b1d4f2a97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # user is written by streaming events, older events don't change a row
+    op.add_column('user', sa.Column('event_time', sa.DateTime(timezone=True)))
+
+
+def downgrade():
+    op.drop_column('user', 'event_time')
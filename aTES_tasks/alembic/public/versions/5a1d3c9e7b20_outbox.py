@@ -0,0 +1,32 @@
+"""Outbox for task events
+
+Revision ID: 5a1d3c9e7b20
+Revises: 11c205c4cc4c
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a1d3c9e7b20'
+down_revision = '11c205c4cc4c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'outbox',
+        sa.Column('id', sa.BigInteger),  # bigserial, defines publishing order
+        sa.Column('exchange', sa.String),
+        sa.Column('routing_key', sa.String),
+        sa.Column('body', sa.Text),
+        sa.Column('created_at', sa.DateTime, server_default=sa.func.now()),
+        sa.PrimaryKeyConstraint('id', name='outbox__id__pkey')
+    )
+
+
+def downgrade():
+    op.drop_table('outbox')
@@ -0,0 +1,58 @@
+"""Search of tasks: trigram indexes and tsvector index
+
+Revision ID: 6e8b1d4f2a97
+Revises: 9d2c5f7b1e46
+Create Date: 2026-10-18 15:12:40.208331
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e8b1d4f2a97'
+down_revision = '9d2c5f7b1e46'
+branch_labels = None
+depends_on = None
+
+# name, table, column, operator class
+INDEXES = [
+    # like and ilike with leading wildcard and "search" of fields without tsvector
+    ('task__name__trgm_idx', 'task', 'name', 'gin_trgm_ops'),
+    ('task__description__trgm_idx', 'task', 'description', 'gin_trgm_ops'),
+]
+
+# "search" of name and description. Index of expression is built without rewrite of table,
+# queries use the same expression (TASK_SEARCH_VECTOR), config is TEXT_SEARCH_CONFIG of filters
+SEARCH_INDEX = 'task__search_vector__idx'
+SEARCH_VECTOR = "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))"
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    # CREATE INDEX CONCURRENTLY doesn't lock writes, but can't run inside transaction
+    with op.get_context().autocommit_block():
+        for name, table, column, ops in INDEXES:
+            op.create_index(
+                name,
+                table,
+                [column],
+                postgresql_using='gin',
+                postgresql_ops={column: ops},
+                postgresql_concurrently=True
+            )
+        op.create_index(
+            SEARCH_INDEX,
+            'task',
+            [sa.text(SEARCH_VECTOR)],
+            postgresql_using='gin',
+            postgresql_concurrently=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(SEARCH_INDEX, table_name='task', postgresql_concurrently=True)
+        for name, table, *_ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,53 @@
+"""Search of tasks by tsvector of every field
+
+Revision ID: 9a4c7e2f5b18
+Revises: 2b8e5d1a7c64
+Create Date: 2026-10-19 00:24:51.617302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c7e2f5b18'
+down_revision = '2b8e5d1a7c64'
+branch_labels = None
+depends_on = None
+
+# "search" filter of a field matches words of the field only. Queries use the same expressions
+# (TASK_SEARCH_VECTORS), config is TEXT_SEARCH_CONFIG of filters
+FIELDS = ['name', 'description']
+SEARCH_INDEX = 'task__{}__tsv_idx'
+SEARCH_VECTOR = "to_tsvector('simple', coalesce({}, ''))"
+
+# index of name and description together, made by 6e8b1d4f2a97
+COMBINED_SEARCH_INDEX = 'task__search_vector__idx'
+COMBINED_SEARCH_VECTOR = "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))"
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY doesn't lock writes, but can't run inside transaction
+    with op.get_context().autocommit_block():
+        for field in FIELDS:
+            op.create_index(
+                SEARCH_INDEX.format(field),
+                'task',
+                [sa.text(SEARCH_VECTOR.format(field))],
+                postgresql_using='gin',
+                postgresql_concurrently=True
+            )
+        op.drop_index(COMBINED_SEARCH_INDEX, table_name='task', postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            COMBINED_SEARCH_INDEX,
+            'task',
+            [sa.text(COMBINED_SEARCH_VECTOR)],
+            postgresql_using='gin',
+            postgresql_concurrently=True
+        )
+        for field in reversed(FIELDS):
+            op.drop_index(SEARCH_INDEX.format(field), table_name='task', postgresql_concurrently=True)
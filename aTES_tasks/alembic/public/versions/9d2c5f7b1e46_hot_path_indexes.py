@@ -0,0 +1,35 @@
+"""Indexes of hot query paths
+
+Revision ID: 9d2c5f7b1e46
+Revises: 5a1d3c9e7b20
+Create Date: 2026-10-18 12:47:19.552870
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2c5f7b1e46'
+down_revision = '5a1d3c9e7b20'
+branch_labels = None
+depends_on = None
+
+# name, table, columns
+INDEXES = [
+    ('task__status__idx', 'task', ['status']),
+    ('task__assigned_worker_id__idx', 'task', ['assigned_worker_id']),
+    ('user__role__idx', 'user', ['role']),
+]
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY doesn't lock writes, but can't run inside transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,23 @@
+"""
+Admin handlers of workers index
+"""
+from aiohttp import web
+from aiohttp.web_request import Request
+
+from task_tracker.dao.workers_index import WorkersIndex
+
+
+async def handle_check_workers_index(request: Request) -> web.Response:
+    """
+    Compares workers index of the process with user table
+
+    Query parameters:
+        repair: 1 to make index the same as the table
+
+    Returns:
+        {"size": count of workers in index, "missing": [...], "extra": [...]}
+    """
+    workers_index = request.app['workers_index']  # type: WorkersIndex
+    repair = request.query.get('repair') == '1'
+    missing, extra = await workers_index.check(request.app['dao_users'], repair)
+    return web.json_response({'size': len(workers_index), 'missing': missing, 'extra': extra})
@@ -19,6 +19,10 @@ EVENT__USER_CREATED = 'created'
 EVENT__USER_UPDATED = 'updated'
 EVENT__USER_DELETED = 'deleted'
 
+# keys of config['exchanges'], which are used in outbox
+EXCHANGE__TASK_STREAMING = 'task_streaming'
+EXCHANGE__WORKFLOW = 'workflow'
+
 
 NAME = 'name'
 DESCRIPTION = 'description'
@@ -31,6 +35,7 @@ TASK_STATUS__IN_PROGRESS = 'in_progress'
 
 LOGIN = 'login'
 ROLE = 'role'
+EVENT_TIME = 'event_time'
 
 USER_ROLE__ADMIN = 'popug_admin'
 USER_ROLE__WORKER = 'popug_worker'
@@ -2,18 +2,20 @@
 Implementation of a service
 """
 from datetime import datetime
-import json
-import random
-from typing import List
+from typing import List, Union
 import uuid
 
 from aiohttp_jsonrpc.handler import JSONRPCView
 from aiohttp_cors import CorsViewMixin
 
 from task_tracker.api import const
+from task_tracker.dao.bulk import BULK_CHUNK_SIZE
 from task_tracker.dao.dao_users import DAOUsers
+from task_tracker.dao.server_cursor import iter_chunks
+from task_tracker.dao.workers_index import WorkersIndex
 from task_tracker.exceptions import Forbidden, InvalidParams, NotFound, Unauthorized
-from task_tracker.rmq.publisher import RabbitMQPublisher
+from task_tracker.rmq.codecs import CONTENT_TYPE__JSON, get_codec
+from task_tracker.rmq.outbox_relay import OutboxRelay
 from task_tracker.utils import get_default_message_data
 from task_tracker.validation import schemas
 from task_tracker.dao.dao_tasks import DAOTasks
@@ -39,12 +41,12 @@ class TaskTrackerService(CorsViewMixin, JSONRPCView):
         return self.request.app['dao_users']
 
     @property
-    def _task_publisher(self) -> RabbitMQPublisher:
-        return self.request.app['task_streaming_publisher']
+    def _workers_index(self) -> WorkersIndex:
+        return self.request.app['workers_index']
 
     @property
-    def _workflow_event_publisher(self) -> RabbitMQPublisher:
-        return self.request.app['workflow_event_publisher']
+    def _outbox_relay(self) -> OutboxRelay:
+        return self.request.app['outbox_relay']
 
     @property
     def _config(self) -> dict:
@@ -68,6 +70,25 @@ class TaskTrackerService(CorsViewMixin, JSONRPCView):
             'data': obj,
         }
 
+    @staticmethod
+    def _outbox_body(message: dict) -> str:
+        # outbox keeps messages as JSON text, relay re-encodes them with publisher's codec
+        return get_codec(CONTENT_TYPE__JSON).encode(message).decode()
+
+    def _streaming_message(self, task: dict, event_name: str) -> dict:
+        return {
+            'exchange': const.EXCHANGE__TASK_STREAMING,
+            'routing_key': self._streaming_routing_key,
+            'body': self._outbox_body(self._message(task, event_name))
+        }
+
+    def _workflow_message(self, task: dict, event_name: str) -> dict:
+        return {
+            'exchange': const.EXCHANGE__WORKFLOW,
+            'routing_key': self._workflow_routing_key,
+            'body': self._outbox_body(self._message(task, event_name))
+        }
+
     def _authenticated(self):
         """
         Raises
@@ -125,27 +146,25 @@ class TaskTrackerService(CorsViewMixin, JSONRPCView):
             raise InvalidParams
 
         try:
-            assigned_worker_id_id = await self._dao_users.get_random_user_id()
+            assigned_worker_id_id = self._workers_index.get_random_worker_id()
         except NotFound as e:
             print('User for task not found')
             raise NotFound from e
         task = {
+            const.NAME: None,
+            const.DESCRIPTION: None,
             **task,
+            const.ID: task.get(const.ID) or uuid.uuid4().hex,
             const.ASSIGNED_WORKER_ID: assigned_worker_id_id,
             const.STATUS: const.TASK_STATUS__IN_PROGRESS
         }
 
-        task_id = await self._dao_tasks.add(task)
-        task = await self._dao_tasks.get(task_id)
-
-        await self._task_publisher.publish(
-            self._streaming_routing_key,
-            json.dumps(self._message(task, const.EVENT__TASK_CREATED))
-        )
-        await self._task_publisher.publish(
-            self._workflow_routing_key,
-            json.dumps(self._message(task, const.EVENT__TASK_ASSIGNED))
-        )
+        # events are stored in the same transaction and published by outbox relay
+        task_id = await self._dao_tasks.add(task, [
+            self._streaming_message(task, const.EVENT__TASK_CREATED),
+            self._workflow_message(task, const.EVENT__TASK_ASSIGNED)
+        ])
+        self._outbox_relay.wake()
         return task_id
 
     async def rpc_task_finished(self, task_id: str):
@@ -169,40 +188,38 @@ class TaskTrackerService(CorsViewMixin, JSONRPCView):
             {
                 const.ID: task_id,
                 const.STATUS: const.TASK_STATUS__FINISHED
-            }
-        )
-
-        await self._workflow_event_publisher.publish(
-            self._workflow_routing_key,
-            json.dumps(self._message(task, const.EVENT__TASK_FINISHED))
+            },
+            [self._workflow_message(task, const.EVENT__TASK_FINISHED)]
         )
+        self._outbox_relay.wake()
 
     async def shuffle(self):
         """
         Shuffles all not finished task between all employees (not admins and not managers)
         """
-        workers = await self._dao_users.get_all_workers()
-        if not workers:
+        if not self._workers_index:
             print('Workers for tasks not found!')
             raise NotFound('Workers for tasks not found')
 
-        not_finished_tasks = await self._dao_tasks.get_not_finished_tasks()
-        workers_count = len(workers) - 1
-
-        for task in not_finished_tasks:
-            random_index = random.randint(0, workers_count)
-            task[const.ASSIGNED_WORKER_ID] = workers[random_index][const.ID]
-            await self._dao_tasks.set(task)
-            # task streaming
-            await self._task_publisher.publish(
-                self._streaming_routing_key,
-                json.dumps(self._message(task, const.EVENT__TASK_UPDATED))
-            )
-            # business event - worker changed
-            await self._workflow_event_publisher.publish(
-                self._workflow_routing_key,
-                json.dumps(self._message(task, const.EVENT__TASK_ASSIGNED))
-            )
+        # tasks are streamed by server-side cursor, only one chunk of them is in memory
+        not_finished_tasks = self._dao_tasks.iter_by_filter({
+            const.STATUS: {
+                'values': [const.TASK_STATUS__OPENED, const.TASK_STATUS__IN_PROGRESS]
+            }
+        })
+        async for tasks in iter_chunks(not_finished_tasks, BULK_CHUNK_SIZE):
+            outbox_messages = []
+            for task in tasks:
+                task[const.ASSIGNED_WORKER_ID] = self._workers_index.get_random_worker_id()
+                outbox_messages += [
+                    # task streaming
+                    self._streaming_message(task, const.EVENT__TASK_UPDATED),
+                    # business event - worker changed
+                    self._workflow_message(task, const.EVENT__TASK_ASSIGNED)
+                ]
+            # chunk of tasks is reassigned by one statement in one transaction with their events
+            await self._dao_tasks.set_many(tasks, outbox_messages)
+        self._outbox_relay.wake()
 
     async def rpc_get_count_by_filter(self, filter: dict) -> int:  # pylint: disable = redefined-builtin
         """
@@ -222,7 +239,8 @@ class TaskTrackerService(CorsViewMixin, JSONRPCView):
                                      filter: dict,  # pylint: disable = redefined-builtin
                                      order: List[dict],
                                      limit: int,
-                                     offset: int) -> List[dict]:
+                                     offset: int = 0,
+                                     cursor: str = None) -> Union[List[dict], dict]:
         """
         Get items by filter
 
@@ -244,11 +262,48 @@ class TaskTrackerService(CorsViewMixin, JSONRPCView):
                     ...
                 ]
             limit: maximum count of items
-            offset: offset from the beginning of the query
+            offset: offset from the beginning of the query, isn't used with cursor
+            cursor: turns on cursor mode: "" for the first page, then "next_cursor" of the previous page.
+                Page is found by seek on sort keys instead of skipping `offset` items,
+                so it takes the same time at any depth
 
         Returns:
-            List of dicts with entities
+            List of dicts with entities, in cursor mode
+                {
+                    "items": [...],
+                    "next_cursor": "..." or null on the last page
+                }
 
         """
         self._authenticated()
+        if cursor is not None:
+            items, next_cursor = await self._dao_tasks.get_list_by_cursor(filter, order, limit, cursor)
+            return {'items': items, 'next_cursor': next_cursor}
         return await self._dao_tasks.get_list_by_filter(filter, order, limit, offset)
+
+    async def rpc_get_page(self,
+                           filter: dict,  # pylint: disable = redefined-builtin
+                           order: List[dict],
+                           limit: int,
+                           offset: int = 0) -> dict:
+        """
+        Get page of items by filter with total count of filtered items.
+        Replaces get_count_by_filter + get_list_by_filter: both are read by one query
+
+        Args:
+            filter: same as in get_list_by_filter
+            order: same as in get_list_by_filter
+            limit: maximum count of items
+            offset: offset from the beginning of the query
+
+        Returns:
+            {
+                "items": [...],
+                "total": count of filtered items,
+                "total_exact": false if total of not filtered large table is estimated by database statistics
+            }
+
+        """
+        self._authenticated()
+        items, total, total_exact = await self._dao_tasks.get_page(filter, order, limit, offset)
+        return {'items': items, 'total': total, 'total_exact': total_exact}
@@ -7,14 +7,24 @@ import aio_pika
 from aiohttp import web
 import aiohttp_cors
 
+from task_tracker.dao.dao_outbox import DAOOutbox
 from task_tracker.dao.dao_users import DAOUsers
+from task_tracker.admin.parked import handle_replay_parked
+from task_tracker.admin.workers_index import handle_check_workers_index
+from task_tracker.dao.scoped_engine import connection_scope_middleware, with_connection_scope
 from task_tracker.db import init_engine
+from task_tracker.metrics import handle_metrics
 from task_tracker.dao.dao_tasks import DAOTasks
+from task_tracker.dao.workers_index import WorkersIndex
 
+from task_tracker.api import const
 from task_tracker.api.tasks import TaskTrackerService
-from task_tracker.rmq.callbacks import user_callback
+from task_tracker.rmq.callbacks import entity_partition_key, user_callback, workers_index_callback
+from task_tracker.rmq.codecs import get_codec
 from task_tracker.rmq.consumer import RabbitMQConsumer
+from task_tracker.rmq.outbox_relay import OutboxRelay
 from task_tracker.rmq.publisher import RabbitMQPublisher
+from task_tracker.rmq.retry import get_retry_policy
 
 
 async def on_app_start(app):
@@ -36,10 +46,19 @@ async def on_app_start(app):
     )
 
     app['rabbit_connection'] = rabbit_connection
+    codec = get_codec(rabbitmq_config.get('content_type'))
+    exchange_options = {
+        'exchange_durable': rabbitmq_config.get('exchange_durable', False),
+        'exchange_auto_delete': rabbitmq_config.get('exchange_auto_delete', True)
+    }
     task_publisher = RabbitMQPublisher(
         rabbit_connection,
         exchange_name=config['exchanges']['task_streaming']['name'],
-        exchange_type=config['exchanges']['task_streaming']['type']
+        exchange_type=config['exchanges']['task_streaming']['type'],
+        batch_size=rabbitmq_config.get('publish_batch_size', 1),
+        linger=rabbitmq_config.get('publish_linger', 0.005),
+        codec=codec,
+        **exchange_options
     )
     await task_publisher.connect()
     app['task_streaming_publisher'] = task_publisher
@@ -47,34 +66,86 @@ async def on_app_start(app):
     workflow_event_publisher = RabbitMQPublisher(
         rabbit_connection,
         exchange_name=config['exchanges']['workflow']['name'],
-        exchange_type=config['exchanges']['workflow']['type']
+        exchange_type=config['exchanges']['workflow']['type'],
+        batch_size=rabbitmq_config.get('publish_batch_size', 1),
+        linger=rabbitmq_config.get('publish_linger', 0.005),
+        codec=codec,
+        **exchange_options
     )
     await workflow_event_publisher.connect()
     app['workflow_event_publisher'] = workflow_event_publisher
 
+    app['dao_tasks'] = DAOTasks(engine)
+    app['dao_users'] = DAOUsers(engine)
+
+    outbox_config = config.get('outbox', {})
+    outbox_relay = OutboxRelay(
+        DAOOutbox(engine),
+        publishers={
+            const.EXCHANGE__TASK_STREAMING: task_publisher,
+            const.EXCHANGE__WORKFLOW: workflow_event_publisher
+        },
+        batch_size=outbox_config.get('batch_size', 100),
+        interval=outbox_config.get('interval', 1)
+    )
+    outbox_relay.start()
+    app['outbox_relay'] = outbox_relay
+
+    # index is updated by its own server-named queue, so every process gets all user events.
+    # Consumer is connected before index is built, so events of the build time aren't lost
+    app['workers_index'] = WorkersIndex()
+    workers_index_consumer = RabbitMQConsumer(
+        rabbit_connection,
+        exchange_name=config['exchange_subscriptions']['user_streaming'],
+        exchange_type='topic',
+        routing_key='*.user',
+        callback=workers_index_callback,
+        callback_data=app,
+        prefetch_count=rabbitmq_config.get('prefetch_count', 1),
+        concurrency=rabbitmq_config.get('consumer_concurrency', 1),
+        partition_key=entity_partition_key,
+        name='task_tracker.workers_index',
+        **exchange_options
+    )
+    await workers_index_consumer.connect()
+    app['workers_index_consumer'] = workers_index_consumer
+    await app['workers_index'].rebuild(app['dao_users'])
+
+    retry_policies = rabbitmq_config.get('retry_policies', {})
     user_consumer = RabbitMQConsumer(
         rabbit_connection,
         exchange_name=config['exchange_subscriptions']['user_streaming'],
         exchange_type='topic',
         routing_key='*.user',
-        callback=user_callback,
-        callback_data=app
+        callback=with_connection_scope(user_callback, engine),
+        callback_data=app,
+        prefetch_count=rabbitmq_config.get('prefetch_count', 1),
+        concurrency=rabbitmq_config.get('consumer_concurrency', 1),
+        partition_key=entity_partition_key,
+        retry_policy=get_retry_policy(retry_policies, 'task_tracker.user'),
+        queue_name='task_tracker.user',
+        queue_durable=rabbitmq_config.get('queue_durable', False),
+        **exchange_options
     )
     await user_consumer.connect()
     app['user_consumer'] = user_consumer
 
-    app['dao_tasks'] = DAOTasks(engine)
-    app['dao_users'] = DAOUsers(engine)
+    app['consumers'] = {
+        user_consumer.name: user_consumer,
+        workers_index_consumer.name: workers_index_consumer
+    }
 
 
 async def on_app_stop(app):
     """
     Stop tasks on application destroy
     """
-    await app['rabbit_connection'].close()
-    await app['task_streaming_publisher'].disconnect()
     await app['user_consumer'].disconnect()
+    await app['workers_index_consumer'].disconnect()
+    await app['outbox_relay'].stop()
+    await app['task_streaming_publisher'].disconnect()
     await app['workflow_event_publisher'].disconnect()
+    await app['rabbit_connection'].close()
 
     app['engine'].close()
     await app['engine'].wait_closed()
@@ -97,7 +168,7 @@ def create_app(loop: AbstractEventLoop = None, config: dict = None) -> web.Appli
         application
 
     """
-    app = web.Application()
+    app = web.Application(middlewares=[connection_scope_middleware()])
     cors = aiohttp_cors.setup(app, defaults={
         "*": aiohttp_cors.ResourceOptions(
             allow_credentials=True,
@@ -106,6 +177,9 @@ def create_app(loop: AbstractEventLoop = None, config: dict = None) -> web.Appli
         )
     })
 
+    app.router.add_route('GET', '/metrics', handle_metrics)
+    app.router.add_route('POST', '/admin/replay-parked', handle_replay_parked)
+    app.router.add_route('POST', '/admin/check-workers-index', handle_check_workers_index)
     cors.add(app.router.add_route('*', '/jsonrpc/tasks', TaskTrackerService))
 
     app['config'] = config
@@ -0,0 +1,110 @@
+"""
+Helpers of bulk DAO methods
+"""
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from aiopg.sa.engine import get_dialect
+from sqlalchemy import Table, or_
+from sqlalchemy.dialects import postgresql
+
+
+# keeps count of statement parameters and size of statement reasonable for very large inputs
+BULK_CHUNK_SIZE = 1000
+
+_dialect = get_dialect()
+
+
+def chunked(items: list, size: int = BULK_CHUNK_SIZE) -> Iterator[list]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def grouped_by_fields(objects: List[dict], size: int = BULK_CHUNK_SIZE) -> Iterator[List[dict]]:
+    """
+    Splits objects to chunks, which can be written by one multi-row statement:
+    objects of a chunk have the same fields
+    """
+    groups = {}  # type: Dict[Tuple[str, ...], List[dict]]
+    for obj in objects:
+        groups.setdefault(tuple(sorted(obj)), []).append(obj)
+    for group in groups.values():
+        yield from chunked(group, size)
+
+
+def make_update_from_values(table: Table, objects: List[dict], key: str = 'id') -> Tuple[str, dict]:
+    """
+    Makes `UPDATE table SET ... FROM (VALUES ...) AS v (...) WHERE table.key = v.key`,
+    which sets every object by one statement. Objects have to have the same fields.
+
+    Returns:
+        SQL and its parameters
+
+    """
+    quote = _dialect.identifier_preparer.quote
+    fields = sorted(objects[0])
+    parameters = {}
+    rows = []
+    for index, obj in enumerate(objects):
+        values = []
+        for field in fields:
+            name = '{}_{}'.format(field, index)
+            parameters[name] = obj[field]
+            # VALUES has no column types, so values are cast to types of table columns
+            values.append('CAST(%({})s AS {})'.format(name, table.c[field].type.compile(dialect=_dialect)))
+        rows.append('({})'.format(', '.join(values)))
+
+    sql = 'UPDATE {table} SET {set} FROM (VALUES {rows}) AS v ({columns}) WHERE {table}.{key} = v.{key}'.format(
+        table=quote(table.name),
+        set=', '.join('{0} = v.{0}'.format(quote(field)) for field in fields if field != key),
+        rows=', '.join(rows),
+        columns=', '.join(quote(field) for field in fields),
+        key=quote(key)
+    )
+    return sql, parameters
+
+
+def make_upsert(table: Table, objects: List[dict], key: str = 'id'):
+    """
+    Makes multi-row insert, which updates existent rows. Objects have to have the same fields.
+    """
+    query = postgresql.insert(table).values(objects)
+    fields = [field for field in objects[0] if field != key]
+    if not fields:
+        return query.on_conflict_do_nothing(index_elements=[table.c[key]])
+    return query.on_conflict_do_update(
+        index_elements=[table.c[key]],
+        set_={field: query.excluded[field] for field in fields}
+    )
+
+
+def make_upsert_if_newer(
+        table: Table,
+        objects: List[dict],
+        version: str,
+        key: str = 'id',
+        insert_only: Iterable[str] = ()
+):
+    """
+    Makes multi-row upsert of rows, which are written by events. Existent row is updated
+    only by a newer event than the written one, so replayed and reordered events change nothing.
+    Objects have to have the same fields and different keys.
+
+    Args:
+        table: table of rows
+        objects: rows
+        version: field, which orders events of a row, e.g. event time
+        key: unique field of row
+        insert_only: fields, which are written to new rows only
+
+    Returns:
+        query, which returns keys of written rows
+
+    """
+    query = postgresql.insert(table).values(objects)
+    fields = [field for field in objects[0] if field != key and field not in insert_only]
+    column = table.c[version]
+    return query.on_conflict_do_update(
+        index_elements=[table.c[key]],
+        set_={field: query.excluded[field] for field in fields},
+        where=or_(column.is_(None), column < query.excluded[version])
+    ).returning(table.c[key])
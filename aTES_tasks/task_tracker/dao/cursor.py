@@ -0,0 +1,120 @@
+"""
+Keyset (cursor) pagination of DAO lists.
+
+Cursor is an opaque string with values of sort keys of the last row of page.
+The next page is found by seek `WHERE (sort_key, id) > (...)` instead of skipping
+`offset` rows, so it takes the same time at any depth, if there is an index on sort keys.
+Sort keys are expected to be not null.
+"""
+import base64
+import binascii
+from datetime import datetime
+import json
+from typing import List, Optional, Tuple
+
+from sqlalchemy import DateTime, Table, and_, bindparam, or_, tuple_
+
+from task_tracker.dao.filters import get_parameter_name
+from task_tracker.exceptions import InvalidParams
+
+
+def get_order_keys(table: Table, order: List[dict]) -> Tuple[Tuple[str, bool], ...]:
+    """
+    Args:
+        table: table of query
+        order: order of get_list_by_filter
+
+    Returns:
+        sort keys: fields with flag of ascending order. id is added as the last key,
+        so position of every row is unique
+
+    """
+    keys = [(item['field'], item.get('direction', 'asc') == 'asc') for item in order]
+    if table.c.id.key not in [field for field, _ in keys]:
+        # the same direction as the last key keeps the whole order comparable as a row
+        keys.append((table.c.id.key, keys[-1][1] if keys else True))
+    return tuple(keys)
+
+
+def ordered_by_keys(query, table: Table, keys: Tuple[Tuple[str, bool], ...]):
+    return query.order_by(*[table.c[field] if asc else table.c[field].desc() for field, asc in keys])
+
+
+def seek_condition(table: Table, keys: Tuple[Tuple[str, bool], ...], parameters: dict):
+    """
+    Makes condition of rows after the cursor, values of the cursor are bound parameters.
+    Keys of one direction are compared as row (a, id) > (:a, :id), which is seek in index on (a, id),
+    mixed directions are expanded to `a > :a OR a = :a AND id < :id`.
+
+    Args:
+        table: table of query
+        keys: sort keys
+        parameters: values of the cursor (see decode_cursor)
+
+    """
+    columns = [table.c[field] for field, _ in keys]
+    values = [
+        bindparam(get_parameter_name(field, 'after'), parameters.get(get_parameter_name(field, 'after')),
+                  type_=table.c[field].type)
+        for field, _ in keys
+    ]
+    directions = {asc for _, asc in keys}
+    if len(directions) == 1:
+        if directions.pop():
+            return tuple_(*columns) > tuple_(*values)
+        return tuple_(*columns) < tuple_(*values)
+
+    conditions = []
+    for index, (column, value, (_, asc)) in enumerate(zip(columns, values, keys)):
+        previous_equal = [previous_column == previous_value
+                          for previous_column, previous_value in zip(columns[:index], values[:index])]
+        conditions.append(and_(*previous_equal, column > value if asc else column < value))
+    return or_(*conditions)
+
+
+def encode_cursor(row: dict, keys: Tuple[Tuple[str, bool], ...]) -> str:
+    values = [row[field].isoformat() if isinstance(row[field], datetime) else row[field] for field, _ in keys]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, table: Table, keys: Tuple[Tuple[str, bool], ...]) -> dict:
+    """
+    Returns:
+        values of the cursor as parameters of seek_condition
+
+    Raises:
+        InvalidParams: if cursor is broken or was made for another order
+
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError) as e:
+        raise InvalidParams('Invalid cursor') from e
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise InvalidParams('Cursor does not match order')
+
+    parameters = {}
+    for (field, _), value in zip(keys, values):
+        if value is not None and isinstance(table.c[field].type, DateTime):
+            try:
+                value = datetime.fromisoformat(value)
+            except (TypeError, ValueError) as e:
+                raise InvalidParams('Invalid cursor') from e
+        parameters[get_parameter_name(field, 'after')] = value
+    return parameters
+
+
+def get_next_cursor(rows: List[dict], limit: int, keys: Tuple[Tuple[str, bool], ...]) -> Optional[str]:
+    """
+    Args:
+        rows: rows of page, query should fetch limit + 1 rows to know if there is the next page
+        limit: size of page
+        keys: sort keys
+
+    Returns:
+        cursor of the next page or None for the last page
+
+    """
+    if len(rows) <= limit:
+        return None
+    return encode_cursor(rows[limit - 1], keys)
@@ -1,16 +1,22 @@
 """
 Manipulate in database with Entity of Scaffolded application
 """
-from typing import List
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import uuid
 
 import sqlalchemy
-from sqlalchemy import func
+from sqlalchemy import any_, bindparam, func
 
 from task_tracker.api import const
 from task_tracker.exceptions import NotFound
-from task_tracker.db import Task
-from task_tracker.dao.filters import make_string_filter
+from task_tracker.db import TASK_SEARCH_VECTORS, Task
+from task_tracker.dao.dao_outbox import add_outbox_messages
+from task_tracker.dao.bulk import chunked, grouped_by_fields, make_update_from_values, make_upsert
+from task_tracker.dao.cursor import decode_cursor, get_next_cursor, get_order_keys, ordered_by_keys, seek_condition
+from task_tracker.dao.filters import get_filter_shape, get_order_shape, make_search_rank, make_string_filter
+from task_tracker.dao.page import split_total_count, with_total_count
+from task_tracker.dao.server_cursor import DEFAULT_FETCH_SIZE, iter_rows
+from task_tracker.dao.statement_cache import StatementCache
 
 
 class DAOTasks:
@@ -19,39 +25,86 @@ class DAOTasks:
     """
     def __init__(self, engine):
         self.engine = engine
+        self._statements = StatementCache()
 
     async def _add(self, conn, obj: dict) -> str:
-        if const.ID not in obj:
-            obj[const.ID] = uuid.uuid4().hex
-        await conn.execute(
-            Task.insert().values(**obj)
-        )
-        return obj[const.ID]
+        return (await self._add_many(conn, [obj]))[0]
 
     async def _set(self, conn, obj: dict) -> None:
-        await conn.execute(
-            Task.update().values(**obj).
-            where(Task.c.id == obj[const.ID])
-        )
+        await self._set_many(conn, [obj])
+
+    async def _add_many(self, conn, objects: List[dict]) -> List[str]:
+        for obj in objects:
+            if const.ID not in obj:
+                obj[const.ID] = uuid.uuid4().hex
+        for chunk in grouped_by_fields(objects):
+            await conn.execute(Task.insert().values(chunk))
+        return [obj[const.ID] for obj in objects]
+
+    async def _set_many(self, conn, objects: List[dict]) -> None:
+        for chunk in grouped_by_fields(objects):
+            if len(chunk[0]) > 1:
+                await conn.execute(*make_update_from_values(Task, chunk))
+
+    async def _upsert_many(self, conn, objects: List[dict]) -> List[str]:
+        for obj in objects:
+            if const.ID not in obj:
+                obj[const.ID] = uuid.uuid4().hex
+        for chunk in grouped_by_fields(objects):
+            await conn.execute(make_upsert(Task, chunk))
+        return [obj[const.ID] for obj in objects]
 
     async def _delete(self, conn, object_id: str):
         await conn.execute(Task.delete().where(Task.c.id == object_id))
 
     async def _get(self, conn, object_id: str):
-        row = await (
-            await conn.execute(Task.select().where(Task.c.id == object_id))
-        ).first()
-
-        if row is None:
+        objects = await self._get_many(conn, [object_id])
+        if object_id not in objects:
             raise NotFound()
-        return dict(row)
+        return objects[object_id]
+
+    async def _get_many(self, conn, object_ids: List[str]) -> Dict[str, dict]:
+        result = {}
+        for chunk in chunked(list(object_ids)):
+            rows = await self._statements.execute(
+                conn,
+                'get_many',
+                lambda: Task.select().where(Task.c.id == any_(bindparam('ids'))),
+                {'ids': chunk}
+            )
+            async for row in rows:
+                result[row[const.ID]] = dict(row)
+        return result
+
+    # fields of filter, which are used by _filtered_query
+    _filter_fields = (const.TASK_NAME, const.DESCRIPTION, const.ID, const.STATUS)
+
+    # fields, which rows are ranked by in "search" mode of their filter
+    _search_fields = (Task.c.name, Task.c.description)
 
     def _filtered_query(self, query, filter_: dict):
         if const.TASK_NAME in filter_:
-            query = query.where(make_string_filter(Task.c.name, filter_[const.TASK_NAME]))
+            query = query.where(make_string_filter(Task.c.name, filter_[const.TASK_NAME], TASK_SEARCH_VECTORS[Task.c.name.key]))
+        if const.DESCRIPTION in filter_:
+            query = query.where(
+                make_string_filter(Task.c.description, filter_[const.DESCRIPTION], TASK_SEARCH_VECTORS[Task.c.description.key])
+            )
         if const.ID in filter_:
-            values = filter_[const.ID]['values']
-            query = query.where(Task.c.id.in_(values))
+            query = query.where(make_string_filter(Task.c.id, filter_[const.ID]))
+        if const.STATUS in filter_:
+            query = query.where(make_string_filter(Task.c.status, filter_[const.STATUS]))
+        return query
+
+    def _ranked_query(self, query, filter_: dict, order: List[dict]):
+        """
+        Orders rows found by "search" condition by rank, the best are the first. Explicit order wins
+        """
+        if order:
+            return query
+        for field in self._search_fields:
+            field_filter = filter_.get(field.key)
+            if field_filter and field_filter.get('search'):
+                return query.order_by(make_search_rank(field, field_filter, TASK_SEARCH_VECTORS[field.key]).desc())
         return query
 
     @staticmethod
@@ -68,31 +121,108 @@ class DAOTasks:
         return query
 
     async def _get_count_by_filter(self, conn, filter_: dict) -> int:
-        query = sqlalchemy.select([func.count(Task.c.id)])
-        query = self._filtered_query(query, filter_)
-        return await conn.scalar(query)
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+
+        def build():
+            query = sqlalchemy.select([func.count(Task.c.id)])
+            return self._filtered_query(query, filter_)
+
+        result = await self._statements.execute(conn, ('count', filter_shape), build, parameters)
+        return await result.scalar()
 
     async def _get_list_by_filter(self, conn, filter_: dict, order: List[dict], limit: int, offset: int) -> List[dict]:
-        query = Task.select()
-        query = self._filtered_query(query, filter_)
-        query = self._ordered_query(query, order)
-        query = query.limit(limit)
-        query = query.offset(offset)
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
 
+        def build():
+            query = Task.select()
+            query = self._filtered_query(query, filter_)
+            query = self._ranked_query(query, filter_, order)
+            query = self._ordered_query(query, order)
+            return query.limit(bindparam('limit')).offset(bindparam('offset'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('list', filter_shape, get_order_shape(order)),
+            build,
+            {**parameters, 'limit': limit, 'offset': offset}
+        )
         result = []
-        async for row in conn.execute(query):
+        async for row in rows:
             result.append(dict(row))
         return result
 
-    async def add(self, obj: dict) -> str:
+    async def _get_list_by_cursor(
+            self,
+            conn,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            cursor: str = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        keys = get_order_keys(Task, order)
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+        if cursor:
+            parameters.update(decode_cursor(cursor, Task, keys))
+
+        def build():
+            query = self._filtered_query(Task.select(), filter_)
+            if cursor:
+                query = query.where(seek_condition(Task, keys, parameters))
+            return ordered_by_keys(query, Task, keys).limit(bindparam('limit'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('cursor', filter_shape, keys, bool(cursor)),
+            build,
+            # one more row shows if there is the next page
+            {**parameters, 'limit': limit + 1}
+        )
+        result = []
+        async for row in rows:
+            result.append(dict(row))
+        return result[:limit], get_next_cursor(result, limit, keys)
+
+    async def _get_page(
+            self,
+            conn,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            offset: int
+    ) -> Tuple[List[dict], int, bool]:
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+
+        def build():
+            query = self._filtered_query(Task.select(), filter_)
+            query = with_total_count(query, Task, bool(filter_shape))
+            query = self._ranked_query(query, filter_, order)
+            query = self._ordered_query(query, order)
+            return query.limit(bindparam('limit')).offset(bindparam('offset'))
+
+        rows = await self._statements.execute(
+            conn,
+            ('page', filter_shape, get_order_shape(order)),
+            build,
+            {**parameters, 'limit': limit, 'offset': offset}
+        )
+        items, total, exact = split_total_count([dict(row) async for row in rows], limit, offset)
+        if total is None:
+            # page is after the last row
+            total, exact = await self._get_count_by_filter(conn, filter_), True
+        return items, total, exact
+
+    async def add(self, obj: dict, outbox_messages: List[dict] = None) -> str:
         async with self.engine.acquire() as conn:
             async with conn.begin():
-                return await self._add(conn, obj)
+                object_id = await self._add(conn, obj)
+                await add_outbox_messages(conn, outbox_messages)
+                return object_id
 
-    async def set(self, obj: dict):
+    async def set(self, obj: dict, outbox_messages: List[dict] = None):
         async with self.engine.acquire() as conn:
             async with conn.begin():
                 await self._set(conn, obj)
+                await add_outbox_messages(conn, outbox_messages)
 
     async def delete(self, object_id: str):
         async with self.engine.acquire() as conn:
@@ -103,6 +233,37 @@ class DAOTasks:
         async with self.engine.acquire() as conn:
             return await self._get(conn, object_id)
 
+    async def get_many(self, object_ids: List[str]) -> Dict[str, dict]:
+        """
+        Returns:
+            objects by id, missing ids are skipped
+        """
+        async with self.engine.acquire() as conn:
+            return await self._get_many(conn, object_ids)
+
+    async def add_many(self, objects: List[dict], outbox_messages: List[dict] = None) -> List[str]:
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                object_ids = await self._add_many(conn, objects)
+                await add_outbox_messages(conn, outbox_messages)
+                return object_ids
+
+    async def set_many(self, objects: List[dict], outbox_messages: List[dict] = None):
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                await self._set_many(conn, objects)
+                await add_outbox_messages(conn, outbox_messages)
+
+    async def upsert_many(self, objects: List[dict], outbox_messages: List[dict] = None) -> List[str]:
+        """
+        Adds new objects and sets existent ones
+        """
+        async with self.engine.acquire() as conn:
+            async with conn.begin():
+                object_ids = await self._upsert_many(conn, objects)
+                await add_outbox_messages(conn, outbox_messages)
+                return object_ids
+
     async def get_count_by_filter(self, filter_: dict) -> int:
         async with self.engine.acquire() as conn:
             return await self._get_count_by_filter(conn, filter_)
@@ -111,15 +272,59 @@ class DAOTasks:
         async with self.engine.acquire() as conn:
             return await self._get_list_by_filter(conn, filter_, order, limit, offset)
 
-    async def get_not_finished_tasks(self):
+    async def get_list_by_cursor(
+            self,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            cursor: str = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        Returns:
+            page after the cursor (the first page without it) and cursor of the next page,
+            which is None for the last page
+        """
+        async with self.engine.acquire() as conn:
+            return await self._get_list_by_cursor(conn, filter_, order, limit, cursor)
+
+    async def get_page(
+            self,
+            filter_: dict,
+            order: List[dict],
+            limit: int,
+            offset: int
+    ) -> Tuple[List[dict], int, bool]:
+        """
+        Returns:
+            page of filtered objects, total count of filtered objects and flag of exact count.
+            Total count of page and its rows are read by one query
+        """
         async with self.engine.acquire() as conn:
-            # we need to set real limits in future
-            filter_ = {
-                const.STATUS: {
-                    'values': [const.TASK_STATUS__OPENED, const.TASK_STATUS__IN_PROGRESS]
-                }
+            return await self._get_page(conn, filter_, order, limit, offset)
+
+    async def iter_by_filter(
+            self,
+            filter_: dict,
+            order: List[dict] = None,
+            fetch_size: int = DEFAULT_FETCH_SIZE
+    ) -> AsyncIterator[dict]:
+        """
+        Iterates all filtered objects without limit, only `fetch_size` of them are kept in memory at once
+        """
+        filter_shape, parameters = get_filter_shape(filter_, self._filter_fields)
+
+        def build():
+            query = self._filtered_query(Task.select(), filter_)
+            return self._ordered_query(query, order) if order else query
+
+        sql = self._statements.get_sql(('iter', filter_shape, get_order_shape(order or [])), build)
+        async for row in iter_rows(self.engine, sql, parameters, fetch_size):
+            yield row
+
+    async def get_not_finished_tasks(self) -> List[dict]:
+        filter_ = {
+            const.STATUS: {
+                'values': [const.TASK_STATUS__OPENED, const.TASK_STATUS__IN_PROGRESS]
             }
-            order = []
-            limit = 1000
-            offset = 0
-            return await self._get_list_by_filter(conn, filter_, order, limit, offset)
+        }
+        return [task async for task in self.iter_by_filter(filter_)]
@@ -0,0 +1,63 @@
+"""
+Page of DAO list with total count of filtered rows, which is read by the same query
+"""
+from typing import List, Optional, Tuple
+
+from aiopg.sa.engine import get_dialect
+from sqlalchemy import Table, func, literal_column, true
+
+
+# tables estimated by planner below this count of rows are counted exactly
+EXACT_COUNT_THRESHOLD = 10000
+
+TOTAL_COUNT = 'total_count'
+TOTAL_COUNT_EXACT = 'total_count_exact'
+
+_dialect = get_dialect()
+
+
+def with_total_count(query, table: Table, filtered: bool, threshold: int = EXACT_COUNT_THRESHOLD):
+    """
+    Adds total count of rows of the query to every row of it.
+
+    Filtered query is counted by `COUNT(*) OVER ()` while page rows are read.
+    Count of the whole table is taken from planner statistics (pg_class.reltuples) if the table
+    is large, because its exact count scans the whole table. Small tables are counted exactly.
+
+    Args:
+        query: select of table rows without order, limit and offset
+        table: table of query
+        filtered: query has conditions
+        threshold: tables with more estimated rows aren't counted exactly
+
+    """
+    if filtered:
+        return query.column(func.count().over().label(TOTAL_COUNT)).column(true().label(TOTAL_COUNT_EXACT))
+
+    name = _dialect.identifier_preparer.quote(table.name)
+    estimate = "(SELECT reltuples::bigint FROM pg_class WHERE oid = '{}'::regclass)".format(name)
+    # uncounted table has reltuples -1, so it's counted exactly too
+    exact = '{} < {:d}'.format(estimate, threshold)
+    total = 'CASE WHEN {} THEN (SELECT count(*) FROM {}) ELSE {} END'.format(exact, name, estimate)
+    return query.column(literal_column(total).label(TOTAL_COUNT)).column(literal_column(exact).label(TOTAL_COUNT_EXACT))
+
+
+def split_total_count(rows: List[dict], limit: int, offset: int) -> Tuple[List[dict], Optional[int], bool]:
+    """
+    Removes total count from rows of query made by with_total_count
+
+    Returns:
+        rows, total count and flag of exact count. Total count is None for empty page after the first one,
+        because nothing is known about rows before the page
+
+    """
+    if not rows:
+        return rows, (None if offset else 0), True
+    total, exact = rows[0][TOTAL_COUNT], rows[0][TOTAL_COUNT_EXACT]
+    for row in rows:
+        del row[TOTAL_COUNT], row[TOTAL_COUNT_EXACT]
+    if len(rows) < limit:
+        # the last page shows exact count
+        return rows, offset + len(rows), True
+    # estimate can be less than rows, which are already read
+    return rows, max(int(total), offset + len(rows)), exact
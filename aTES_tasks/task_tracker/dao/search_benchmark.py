@@ -0,0 +1,132 @@
+"""
+Seeds a few million tasks and compares plans and timings of name and description filters
+with search indexes and without them (sequential scan).
+
+Data is seeded inside a transaction, which is rolled back at the end,
+so the script can be run against any database with applied migrations.
+
+Usage:
+    python -m task_tracker.dao.search_benchmark config_file_path [result_file_path] [tasks]
+"""
+import asyncio
+import hashlib
+import json
+import sys
+from typing import List, Tuple
+
+from aiopg.sa.engine import get_dialect
+from sqlalchemy import bindparam
+
+from task_tracker.dao.dao_tasks import DAOTasks
+from task_tracker.dao.filters import get_filter_shape
+from task_tracker.db import Task, init_engine
+
+
+DEFAULT_TASKS = 3000000
+LIMIT = 20
+
+SEED = """
+    INSERT INTO task (id, name, description, assigned_worker_id, status)
+    SELECT
+        'benchmark' || n,
+        (ARRAY['fix', 'refactor', 'deploy', 'review', 'migrate', 'optimize', 'document', 'test'])[1 + n %% 8]
+            || ' '
+            || (ARRAY['billing', 'analytics', 'accounts', 'tracker', 'ledger', 'queue', 'cache', 'search'])[1 + n / 8 %% 8]
+            || ' #' || n,
+        'Description of task ' || md5(n::text),
+        'worker' || n %% 1000,
+        'opened'
+    FROM generate_series(1, %(tasks)s) AS n
+"""
+
+# planner can't use any index with these settings, so filter is checked by sequential scan
+WITHOUT_INDEXES = ['SET LOCAL enable_bitmapscan = off', 'SET LOCAL enable_indexscan = off']
+WITH_INDEXES = ['SET LOCAL enable_bitmapscan = on', 'SET LOCAL enable_indexscan = on']
+
+
+def get_filters(tasks: int) -> List[Tuple[str, dict]]:
+    n = tasks // 2
+    digest = hashlib.md5(str(n).encode()).hexdigest()
+    return [
+        ('ilike of name', {'name': {'ilike': '%ledger #{}%'.format(n)}}),
+        ('ilike of description', {'description': {'ilike': '%{}%'.format(digest[8:20])}}),
+        ('search of name', {'name': {'search': 'migrate ledger'}}),
+        ('search of description', {'description': {'search': digest}}),
+    ]
+
+
+def get_list_sql(dao: DAOTasks, filter_: dict) -> Tuple[str, dict]:
+    """
+    Returns:
+        SQL of the first page of dao.get_list_by_filter and its parameters
+    """
+    # pylint: disable = protected-access
+    _, parameters = get_filter_shape(filter_, dao._filter_fields)
+    query = dao._filtered_query(Task.select(), filter_)
+    query = dao._ranked_query(query, filter_, [])
+    query = dao._ordered_query(query, []).limit(bindparam('limit'))
+    return str(query.compile(dialect=get_dialect())), {**parameters, 'limit': LIMIT}
+
+
+async def explain(conn, sql: str, parameters: dict) -> dict:
+    row = await (await conn.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql, parameters)).first()
+    return row[0][0]
+
+
+async def run(conn, tasks: int) -> list:
+    await conn.execute(SEED, {'tasks': tasks})
+    await conn.execute('ANALYZE task')
+
+    dao = DAOTasks(None)
+    results = []
+    for name, filter_ in get_filters(tasks):
+        sql, parameters = get_list_sql(dao, filter_)
+        for mode, settings in (('seq scan', WITHOUT_INDEXES), ('indexes', WITH_INDEXES)):
+            for setting in settings:
+                await conn.execute(setting)
+            plan = await explain(conn, sql, parameters)
+            results.append({
+                'query': name,
+                'mode': mode,
+                'filter': filter_,
+                'sql': sql,
+                'node': plan['Plan']['Node Type'],
+                'rows': plan['Plan']['Actual Rows'],
+                'planning_ms': plan['Planning Time'],
+                'execution_ms': plan['Execution Time'],
+                'plan': plan,
+            })
+    return results
+
+
+async def main(config_file_path: str, result_file_path: str = None, tasks: int = DEFAULT_TASKS):
+    with open(config_file_path) as f:
+        config = json.load(f)
+    engine = await init_engine(config['database'])
+    try:
+        async with engine.acquire() as conn:
+            transaction = await conn.begin()
+            try:
+                results = await run(conn, tasks)
+            finally:
+                # seeded rows must not stay in the database
+                await transaction.rollback()
+    finally:
+        engine.close()
+        await engine.wait_closed()
+
+    print('{:<25} {:<10} {:<20} {:>6} {:>14} {:>14}'.format(
+        'query', 'mode', 'top node', 'rows', 'planning, ms', 'execution, ms'
+    ))
+    for result in results:
+        print('{:<25} {:<10} {:<20} {:>6} {:>14.3f} {:>14.3f}'.format(
+            result['query'], result['mode'], result['node'], result['rows'],
+            result['planning_ms'], result['execution_ms']
+        ))
+    if result_file_path:
+        with open(result_file_path, 'w') as f:
+            json.dump({'tasks': tasks, 'results': results}, f, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(*sys.argv[1:3], *[int(arg) for arg in sys.argv[3:4]]))
@@ -0,0 +1,139 @@
+"""
+Provides in-memory index of workers, which tasks are assigned to
+"""
+import random
+from typing import Dict, List, Optional, Set, Tuple
+
+from task_tracker.api import const
+from task_tracker.dao.dao_users import DAOUsers
+from task_tracker.exceptions import NotFound
+from task_tracker.metrics import REGISTRY
+
+
+INDEX_SIZE = REGISTRY.gauge('workers_index_size', 'Workers in index of task assignment')
+INDEX_DIFFERENCES = REGISTRY.counter(
+    'workers_index_differences_total',
+    'Differences of index from user table found by consistency check: missing or extra ids',
+    ('kind',)
+)
+
+
+class WorkersIndex:
+    """
+    Ids of users with worker role in an array with positions of ids.
+
+    Random worker is picked by random position, add and remove take O(1): removed id is replaced
+    by the last one. Index is built from 'user' table at start and then is updated by streaming
+    events of users, so assignment of task doesn't read database.
+    """
+    def __init__(self):
+        self._ids = []  # type: List[str]
+        self._positions = {}  # type: Dict[str, int]
+        # events, which came while index is rebuilt, they are applied to the new index
+        self._pending = None  # type: Optional[List[Tuple[str, bool]]]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._positions
+
+    def _add(self, user_id: str) -> None:
+        if user_id in self._positions:
+            return
+        self._positions[user_id] = len(self._ids)
+        self._ids.append(user_id)
+
+    def _remove(self, user_id: str) -> None:
+        position = self._positions.pop(user_id, None)
+        if position is None:
+            return
+        last = self._ids.pop()
+        if last != user_id:
+            self._ids[position] = last
+            self._positions[last] = position
+
+    def _set(self, user_id: str, is_worker: bool) -> None:
+        if self._pending is not None:
+            self._pending.append((user_id, is_worker))
+        if is_worker:
+            self._add(user_id)
+        else:
+            self._remove(user_id)
+        INDEX_SIZE.set(len(self._ids))
+
+    def apply_user(self, user: dict) -> None:
+        """
+        Adds created or updated user with worker role, removes user with other role
+        """
+        self._set(user[const.ID], user.get(const.ROLE) == const.USER_ROLE__WORKER)
+
+    def remove_user(self, user_id: str) -> None:
+        self._set(user_id, False)
+
+    def get_random_worker_id(self) -> str:
+        """
+        Raises:
+            NotFound: if there are no workers
+        """
+        if not self._ids:
+            raise NotFound('Workers for tasks not found')
+        return self._ids[random.randrange(len(self._ids))]
+
+    @staticmethod
+    async def _read_worker_ids(dao_users: DAOUsers) -> Set[str]:
+        filter_ = {
+            const.ROLE: {
+                'values': [const.USER_ROLE__WORKER]
+            }
+        }
+        return {user[const.ID] async for user in dao_users.iter_by_filter(filter_)}
+
+    async def rebuild(self, dao_users: DAOUsers) -> None:
+        """
+        Builds index from 'user' table. Events, which are applied while table is read,
+        are applied to the new index too
+        """
+        self._pending = []
+        try:
+            worker_ids = await self._read_worker_ids(dao_users)
+            pending = self._pending
+        finally:
+            self._pending = None
+
+        self._ids = []
+        self._positions = {}
+        for user_id in worker_ids:
+            self._add(user_id)
+        for user_id, is_worker in pending:
+            self._set(user_id, is_worker)
+        INDEX_SIZE.set(len(self._ids))
+        print('Workers index is built: {} workers'.format(len(self._ids)))
+
+    async def check(self, dao_users: DAOUsers, repair: bool = False) -> Tuple[List[str], List[str]]:
+        """
+        Compares index with 'user' table. Events of users, which aren't written to the table yet,
+        are shown as differences too, so a difference isn't always an error
+
+        Args:
+            dao_users: DAO of 'user' table
+            repair: make index the same as the table
+
+        Returns:
+            ids of workers missing in index and ids, which are extra in index
+
+        """
+        worker_ids = await self._read_worker_ids(dao_users)
+        missing = sorted(worker_ids.difference(self._positions))
+        extra = sorted(set(self._positions).difference(worker_ids))
+        INDEX_DIFFERENCES.inc(len(missing), kind='missing')
+        INDEX_DIFFERENCES.inc(len(extra), kind='extra')
+        if missing or extra:
+            print('Workers index differs from user table: {} missing, {} extra'.format(len(missing), len(extra)))
+        if repair:
+            for user_id in missing:
+                self._add(user_id)
+            for user_id in extra:
+                self._remove(user_id)
+            INDEX_SIZE.set(len(self._ids))
+        return missing, extra
@@ -2,18 +2,27 @@
 Database objects definitions
 """
 from aiopg.sa import create_engine
-from sqlalchemy import MetaData, Table, Column, String, PrimaryKeyConstraint
+from sqlalchemy import (
+    BigInteger, DateTime, MetaData, Table, Column, String, Text, PrimaryKeyConstraint, func, literal_column
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+from task_tracker.dao.scoped_engine import ScopedEngine
 
 
-async def init_engine(db_config) -> 'Engine':
+async def init_engine(db_config) -> ScopedEngine:
     """
     Engine initialization
     """
-    return await create_engine(
+    engine = await create_engine(
         database=db_config['name'],
         host=db_config['host'],
         user=db_config['user'],
-        password=db_config['password'])
+        password=db_config['password'],
+        minsize=db_config.get('pool_min_size', 1),
+        maxsize=db_config.get('pool_max_size', 10),
+        pool_recycle=db_config.get('pool_recycle', -1))
+    return ScopedEngine(engine, acquire_timeout=db_config.get('acquire_timeout'))
 
 
 metadata = MetaData()
@@ -30,6 +39,13 @@ Task = Table(
     PrimaryKeyConstraint('id', name='task__id__pkey')
 )
 
+# words of task's fields by name of field, they are used by search only, so they aren't columns of Task.
+# They are the same expressions as of GIN indexes 'task__<field>__tsv_idx', so the indexes are used by queries
+TASK_SEARCH_VECTORS = {
+    field: literal_column("to_tsvector('simple', coalesce(task.{}, ''))".format(field), TSVECTOR)
+    for field in ('name', 'description')
+}
+
 User = Table(
     'user',
     metadata,
@@ -37,5 +53,19 @@ User = Table(
     # решил, что в контексте данной задачи не буду реализовывать
     Column('role', String),
     Column('login', String),
+    Column('event_time', DateTime(timezone=True)),  # time of the last written event
     PrimaryKeyConstraint('id', name='user__id__pkey')
 )
+
+# events, which are written in the same transaction with tasks changes
+# and are published to RabbitMQ later by outbox relay
+Outbox = Table(
+    'outbox',
+    metadata,
+    Column('id', BigInteger),  # sequence, defines publishing order
+    Column('exchange', String),  # key of exchange in config['exchanges']
+    Column('routing_key', String),
+    Column('body', Text),
+    Column('created_at', DateTime, server_default=func.now()),
+    PrimaryKeyConstraint('id', name='outbox__id__pkey')
+)
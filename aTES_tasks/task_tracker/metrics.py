@@ -0,0 +1,185 @@
+"""
+Provides in-process metrics exposed in Prometheus text format
+"""
+from abc import ABC, abstractmethod
+import bisect
+from typing import Dict, List, Sequence, Tuple
+
+from aiohttp import web
+from aiohttp.web_request import Request
+
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(label_names: Sequence[str], label_values: Sequence[str], extra: str = '') -> str:
+    labels = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+              for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return '{{{}}}'.format(','.join(labels)) if labels else ''
+
+
+class Metric(ABC):
+    """
+    Base of metrics, values are kept per combination of label values
+    """
+    type = None  # type: str
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        pass
+
+    def render(self) -> str:
+        return '\n'.join([
+            '# HELP {} {}'.format(self.name, self.description),
+            '# TYPE {} {}'.format(self.name, self.type),
+            *self._samples()
+        ])
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        super().__init__(name, description, label_names)
+        self._values = {}  # type: Dict[Tuple[str, ...], float]
+
+    def inc(self, value: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def _samples(self) -> List[str]:
+        return [
+            '{}{} {}'.format(self.name, _format_labels(self.label_names, key), value)
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        super().__init__(name, description, label_names)
+        self._values = {}  # type: Dict[Tuple[str, ...], float]
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def _samples(self) -> List[str]:
+        return [
+            '{}{} {}'.format(self.name, _format_labels(self.label_names, key), value)
+            for key, value in self._values.items()
+        ]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(
+            self,
+            name: str,
+            description: str,
+            label_names: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # label values: [count in every bucket (not cumulative) + count above the last bucket, sum]
+        self._values = {}  # type: Dict[Tuple[str, ...], Tuple[List[int], List[float]]]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        if key not in self._values:
+            self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = self._values[key]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def _samples(self) -> List[str]:
+        result = []
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                result.append('{}_bucket{} {}'.format(
+                    self.name, _format_labels(self.label_names, key, 'le="{}"'.format(bound)), cumulative
+                ))
+            labels = _format_labels(self.label_names, key)
+            result.append('{}_sum{} {}'.format(self.name, labels, total[0]))
+            result.append('{}_count{} {}'.format(self.name, labels, cumulative))
+        return result
+
+
+class MetricsRegistry:
+    """
+    Keeps all metrics of the process
+    """
+    def __init__(self):
+        self._metrics = {}  # type: Dict[str, Metric]
+
+    def _register(self, metric: Metric) -> Metric:
+        # modules can be imported by several apps of one process, metric is created once
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, description: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, description, label_names))
+
+    def gauge(self, name: str, description: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, description, label_names))
+
+    def histogram(
+            self,
+            name: str,
+            description: str,
+            label_names: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, description, label_names, buckets))
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+QUEUE_MESSAGES = REGISTRY.gauge(
+    'rmq_queue_messages',
+    'Messages ready in queue, read by passive declare on scrape',
+    ('consumer', 'queue')
+)
+QUEUE_CONSUMERS = REGISTRY.gauge(
+    'rmq_queue_consumers',
+    'Consumers of queue, read by passive declare on scrape',
+    ('consumer', 'queue')
+)
+
+
+def get_event_name(message) -> str:
+    if not isinstance(message, dict):
+        return ''
+    return message.get('event_name') or message.get('event') or ''
+
+
+async def handle_metrics(request: Request) -> web.Response:
+    """
+    Scrape endpoint of the service
+    """
+    for consumer in request.app.get('consumers', {}).values():
+        try:
+            depths = await consumer.get_queue_depths()
+        except Exception as e:  # pylint: disable = broad-except
+            print('Queue depth of {} is not available: {}'.format(consumer.name, e))
+            continue
+        for queue_name, (message_count, consumer_count) in depths.items():
+            QUEUE_MESSAGES.set(message_count, consumer=consumer.name, queue=queue_name)
+            QUEUE_CONSUMERS.set(consumer_count, consumer=consumer.name, queue=queue_name)
+    return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8')
@@ -1,31 +1,60 @@
 """
 Provides callbacks for rabbitmq
 """
-import json
-
 from task_tracker.api import const
+from task_tracker.dao.workers_index import WorkersIndex
+
+
+def entity_partition_key(message: dict) -> str:
+    """
+    Partition key of streaming events: events of one entity are handled in order
+    """
+    return message['body']['data']['id']
+
+
+def get_user(data: dict) -> dict:
+    """
+    User of streaming event
+    """
+    return {
+        'id': data['id'],
+        'login': data['name'],
+        'role': data['description']
+    }
 
 
 async def user_callback(message, data):
-    message_body = json.loads(message['body'])
+    message_body = message['body']
     app = data
     data = message_body['data']
     event = message_body['event_name']
 
-    if event == const.EVENT__USER_CREATED:
-        await app['dao_users'].add({
-            'id': data['id'],
-            'login': data['name'],
-            'role': data['description']
+    # created and updated events are written the same way, so replays and events of
+    # parallel consumers can't fail on existent or absent user
+    if event in (const.EVENT__USER_CREATED, const.EVENT__USER_UPDATED):
+        await app['dao_users'].upsert_if_newer({
+            **get_user(data),
+            const.EVENT_TIME: message_body[const.EVENT_TIME]
         })
         return
-    if event == const.EVENT__USER_UPDATED:
-        await app['dao_users'].set({
-            'id': data['id'],
-            'login': data['name'],
-            'role': data['description']
-        })
+    if event == const.EVENT__USER_DELETED:
+        await app['dao_users'].delete_if_newer(data['id'], message_body[const.EVENT_TIME])
+        return
+
+
+async def workers_index_callback(message, data):
+    """
+    Updates workers index of the process. Every process has its own queue of user events for it,
+    while user table is written by one of processes
+    """
+    message_body = message['body']
+    workers_index = data['workers_index']  # type: WorkersIndex
+    data = message_body['data']
+    event = message_body['event_name']
+
+    if event in (const.EVENT__USER_CREATED, const.EVENT__USER_UPDATED):
+        workers_index.apply_user(get_user(data))
         return
     if event == const.EVENT__USER_DELETED:
-        await app['dao_users'].delete(data['id'])
+        workers_index.remove_user(data['id'])
         return
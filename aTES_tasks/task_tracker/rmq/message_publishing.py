@@ -1,24 +1,25 @@
 """
 Provides tools for publishing messages
 """
-from datetime import datetime
-import json
+import asyncio
+from datetime import datetime, timezone
 import uuid
 
-from billing.exceptions import InvalidParams
-from billing.rmq.publisher import RabbitMQPublisher
+from task_tracker.exceptions import InvalidParams
+from task_tracker.rmq.publisher import RabbitMQPublisher
+from task_tracker.schema_registry.validator import SchemaRegistryValidator
 
 
 def get_default_message_data(version: int = 1) -> dict:
     return {
-        'event_time': datetime.now(),
+        'event_time': datetime.now(timezone.utc),
         'event_version': version,
         'event_id': uuid.uuid4().hex
     }
 
 
-def get_message(self, obj: dict, event_name: str):
-    errors = self.schema_validator.validate(obj, event_name)
+def get_message(obj: dict, event_name: str, validator: SchemaRegistryValidator):
+    errors = validator.validate(obj, event_name)
     if errors:
         print('>>>>> Event data is not valid:')
         print('>>>>> data: %s', obj)
@@ -30,8 +31,21 @@ def get_message(self, obj: dict, event_name: str):
     }
 
 
-def publish_message(
+async def publish_message(
         publisher: RabbitMQPublisher,
         routing_key: str,
         message: dict):
-    await publisher.publish(routing_key, json.dumps(message))
+    await publisher.publish(routing_key, message)
+
+
+def enqueue_message(
+        publisher: RabbitMQPublisher,
+        routing_key: str,
+        message: dict) -> asyncio.Future:
+    """
+    Puts message to publisher's buffer without waiting for its confirmation
+
+    Returns:
+        future, which is resolved when message is confirmed by RabbitMQ
+    """
+    return publisher.enqueue(routing_key, message)
@@ -0,0 +1,85 @@
+"""
+Provides relay of outbox messages to rabbitmq
+"""
+import asyncio
+from typing import Dict, List
+
+from task_tracker.dao.dao_outbox import DAOOutbox
+from task_tracker.rmq import codecs
+from task_tracker.rmq.publisher import RabbitMQPublisher
+
+
+class OutboxRelay:
+    """
+    Publishes messages from outbox table in batches.
+
+    Relay checks outbox every `interval` seconds, or right after wake() is called.
+    Message is removed from outbox only after RabbitMQ confirms it, so message can be
+    published twice (if process dies between confirm and commit), but never gets lost.
+    """
+    def __init__(
+            self,
+            dao_outbox: DAOOutbox,
+            publishers: Dict[str, RabbitMQPublisher],
+            batch_size: int = 100,
+            interval: float = 1
+    ):
+        self.dao_outbox = dao_outbox
+        self.publishers = publishers
+        self.batch_size = batch_size
+        self.interval = interval
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        """
+        Asks relay to check outbox without waiting for the next interval
+        """
+        self._wakeup.set()
+
+    async def _publish(self, messages: List[dict]):
+        confirmations = [
+            self.publishers[message['exchange']].enqueue(
+                message['routing_key'],
+                codecs.decode(message['body'].encode(), codecs.CONTENT_TYPE__JSON),
+                persistent=True
+            )
+            for message in messages
+        ]
+        await asyncio.gather(*confirmations)
+
+    async def relay_batch(self) -> int:
+        """
+        Returns:
+            count of published messages
+        """
+        return await self.dao_outbox.process_batch(self.batch_size, self._publish)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                relayed = await self.relay_batch()
+            except Exception as e:  # pylint: disable = broad-except
+                print('Outbox relay failed: ', e)
+                relayed = 0
+            if relayed >= self.batch_size:
+                # there are more messages in outbox
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
@@ -4,42 +4,172 @@ Provides handler for validating certain event messager
 import asyncio
 import json
 import os
-from typing import Dict
+from typing import Dict, Optional, Tuple
 
 from cerberus import Validator
 
+from task_tracker.metrics import REGISTRY
+
+
+SCHEMA_FILE_EXTENSION = '.json'
+DEFAULT_RELOAD_INTERVAL = 5  # seconds
+
+SCHEMA_LOOKUPS = REGISTRY.counter(
+    'schema_registry_lookups_total',
+    'Lookups of event schemas by result: hit or miss',
+    ('result',)
+)
+SCHEMA_RELOADS = REGISTRY.counter(
+    'schema_registry_reloads_total',
+    'Reloads of schema registry, which changed its schemas'
+)
+SCHEMAS = REGISTRY.gauge(
+    'schema_registry_schemas',
+    'Event schemas in schema registry'
+)
+
 
 class ValidationSchemaNotFound(Exception):
     """
     Raises if validation schema for specified event wasn't found
     """
 
-# потенциально тут нужен класс-загрузчик, который с некоторой периодичностью будет
-# осматривать все доступные схемы и загружать их в память сервиса для оперативного доступа
-
 
 class SchemaRegistryValidator:
+    """
+    Keeps compiled validators of all event schemas in memory.
+
+    Every '<entity>/<event>/<version>.json' file under schemas_dir_path is loaded once
+    on creation. Background watcher compares files mtimes and swaps the whole registry
+    in one assignment, so validate() never sees a half-loaded state and never touches disk.
+    """
     def __init__(
             self,
-            schemas_dir_path
+            schemas_dir_path,
+            reload_interval: float = DEFAULT_RELOAD_INTERVAL
     ):
-        self.schemas_dir_path = schemas_dir_path
-
-    def _get_schema(self, event):
-        event_name_with_slashes = event.replace('.', '/')
-        schema_path = '{schemas_dir_path}/{event_name_with_slashes}.json'.format(
-            schemas_dir_path=self.schemas_dir_path, event_name_with_slashes=event_name_with_slashes
-        )
-        if not os.path.isfile(schema_path):
-            raise ValidationSchemaNotFound
-        with open(schema_path) as file:
-            return json.load(file)
+        self.schemas_dir_path = os.path.expanduser(schemas_dir_path)
+        self.reload_interval = reload_interval
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+        self._mtimes = {}  # type: Dict[str, float]
+        self._validators = {}  # type: Dict[str, Validator]
+        self._watcher = None  # type: Optional[asyncio.Task]
+
+        self._mtimes, self._validators = self._load(self._scan(), {}, {})
+        SCHEMAS.set(len(self._validators))
+
+    def _scan(self) -> Dict[str, Tuple[str, float]]:
+        """
+        Returns:
+            {event name: (schema path, schema mtime)} for every schema in registry directory
+        """
+        result = {}
+        for dir_path, _, file_names in os.walk(self.schemas_dir_path):
+            for file_name in file_names:
+                if not file_name.endswith(SCHEMA_FILE_EXTENSION):
+                    continue
+                schema_path = os.path.join(dir_path, file_name)
+                relative_path = os.path.relpath(schema_path, self.schemas_dir_path)
+                parts = relative_path[:-len(SCHEMA_FILE_EXTENSION)].split(os.sep)
+                if len(parts) != 3:
+                    # only <entity>/<event>/<version>.json files are schemas
+                    continue
+                result['.'.join(parts)] = (schema_path, os.path.getmtime(schema_path))
+        return result
+
+    @staticmethod
+    def _load(
+            scanned: Dict[str, Tuple[str, float]],
+            mtimes: Dict[str, float],
+            validators: Dict[str, Validator]
+    ) -> Tuple[Dict[str, float], Dict[str, Validator]]:
+        """
+        Builds new registry state reusing validators of unchanged schemas
+        """
+        new_mtimes = {}
+        new_validators = {}
+        for event, (schema_path, mtime) in scanned.items():
+            if mtimes.get(event) == mtime and event in validators:
+                new_validators[event] = validators[event]
+            else:
+                with open(schema_path) as file:
+                    new_validators[event] = Validator(json.load(file))
+            new_mtimes[event] = mtime
+        return new_mtimes, new_validators
+
+    def _reload(self) -> bool:
+        """
+        Re-reads changed, added and removed schemas
+
+        Returns:
+            True if registry was changed
+        """
+        scanned = self._scan()
+        if {event: mtime for event, (_, mtime) in scanned.items()} == self._mtimes:
+            return False
+        mtimes, validators = self._load(scanned, self._mtimes, self._validators)
+        self._mtimes, self._validators = mtimes, validators
+        SCHEMAS.set(len(validators))
+        return True
+
+    async def _watch(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                # scanning is a blocking disk I/O, so it is kept out of event loop
+                if await loop.run_in_executor(None, self._reload):
+                    self.reloads += 1
+                    SCHEMA_RELOADS.inc()
+            except Exception as e:  # pylint: disable = broad-except
+                print('Schema registry reload failed: ', e)
+
+    def start(self):
+        """
+        Starts background watching for schemas changes
+        """
+        if self._watcher is None:
+            self._watcher = asyncio.ensure_future(self._watch())
+
+    async def stop(self):
+        """
+        Stops background watching for schemas changes
+        """
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            'schemas': len(self._validators),
+            'hits': self.hits,
+            'misses': self.misses,
+            'reloads': self.reloads
+        }
+
+    def _get_validator(self, event) -> Validator:
+        validator = self._validators.get(event)
+        if validator is None:
+            self.misses += 1
+            SCHEMA_LOOKUPS.inc(result='miss')
+            raise ValidationSchemaNotFound(event)
+        self.hits += 1
+        SCHEMA_LOOKUPS.inc(result='hit')
+        return validator
 
     def validate(self, data: dict, event: str) -> Dict[str, list]:
         """
         Validates data of certain event according to event's version
         """
-        schema = self._get_schema(event)
-        validator = Validator(schema)
+        validator = self._get_validator(event)
         validator.validate(data)
         return validator.errors
@@ -63,21 +63,27 @@ STRING_FILTER = {
         'type': 'string',
         'coerce': 'strip',
         'minlength': 1,
-        'excludes': ['ilike', 'value']
+        'excludes': ['ilike', 'value', 'search']
     },
     'ilike': {
         'type': 'string',
         'coerce': 'strip',
         'minlength': 1,
-        'excludes': ['like', 'value']
+        'excludes': ['like', 'value', 'search']
     },
     'values': {
         'type': 'list',
         'minlength': 1,
-        'excludes': ['like', 'ilike'],
+        'excludes': ['like', 'ilike', 'search'],
         'schema': {
             'type': 'string'
         }
+    },
+    'search': {
+        'type': 'string',
+        'coerce': 'strip',
+        'minlength': 1,
+        'excludes': ['like', 'ilike', 'value']
     }
 }
 
@@ -104,6 +110,10 @@ FILTER = {
         'type': 'dict',
         'schema': STRING_FILTER
     },
+    const.DESCRIPTION: {
+        'type': 'dict',
+        'schema': STRING_FILTER
+    },
     const.SIMPLE_FILTER: {
         'type': 'dict',
         'schema': SIMPLE_FILTER
@@ -150,9 +160,15 @@ GET_LIST_BY_FILTER = {
     'offset': {
         'type': 'integer',
         'min': 0
+    },
+    'cursor': {
+        'type': 'string',
+        'nullable': True
     }
 }
 
+GET_PAGE = {key: value for key, value in GET_LIST_BY_FILTER.items() if key != 'cursor'}
+
 
 def validate_task(obj: dict, schema: dict) -> Dict[str, list]:
     """
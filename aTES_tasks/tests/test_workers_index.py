@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from task_tracker.api import const
+from task_tracker.dao.workers_index import WorkersIndex
+from task_tracker.exceptions import NotFound
+
+
+def worker(user_id: str) -> dict:
+    return {const.ID: user_id, const.ROLE: const.USER_ROLE__WORKER}
+
+
+def assert_consistent(workers_index: WorkersIndex):
+    # every id is at its position, so the next remove swaps the right ids
+    assert len(workers_index._ids) == len(workers_index._positions)
+    for position, user_id in enumerate(workers_index._ids):
+        assert workers_index._positions[user_id] == position
+
+
+def make_index(*user_ids) -> WorkersIndex:
+    workers_index = WorkersIndex()
+    for user_id in user_ids:
+        workers_index.apply_user(worker(user_id))
+    return workers_index
+
+
+def test_workers_are_added_once():
+    workers_index = make_index('1', '2', '1')
+
+    assert len(workers_index) == 2
+    assert '1' in workers_index
+    assert_consistent(workers_index)
+
+
+def test_removed_worker_is_replaced_by_the_last_one():
+    workers_index = make_index('1', '2', '3')
+
+    workers_index.remove_user('1')
+
+    assert workers_index._ids == ['3', '2']
+    assert '1' not in workers_index
+    assert_consistent(workers_index)
+
+
+def test_the_last_worker_is_removed():
+    workers_index = make_index('1', '2', '3')
+
+    workers_index.remove_user('3')
+
+    assert workers_index._ids == ['1', '2']
+    assert_consistent(workers_index)
+
+
+def test_remove_of_unknown_user_changes_nothing():
+    workers_index = make_index('1', '2')
+
+    workers_index.remove_user('3')
+
+    assert workers_index._ids == ['1', '2']
+
+
+def test_user_with_other_role_is_removed():
+    workers_index = make_index('1', '2')
+
+    workers_index.apply_user({const.ID: '1', const.ROLE: const.USER_ROLE__MANAGER})
+
+    assert '1' not in workers_index
+    assert_consistent(workers_index)
+
+
+def test_index_stays_consistent_after_many_changes():
+    workers_index = make_index(*[str(user_id) for user_id in range(10)])
+    for user_id in ('0', '9', '4', '5', '1'):
+        workers_index.remove_user(user_id)
+        assert_consistent(workers_index)
+    workers_index.apply_user(worker('10'))
+
+    assert sorted(workers_index._ids, key=int) == ['2', '3', '6', '7', '8', '10']
+    assert_consistent(workers_index)
+
+
+def test_random_worker_is_in_index():
+    workers_index = make_index('1', '2', '3')
+    workers_index.remove_user('2')
+
+    assert {workers_index.get_random_worker_id() for _ in range(50)} <= {'1', '3'}
+
+
+def test_random_worker_of_empty_index_is_not_found():
+    with pytest.raises(NotFound):
+        WorkersIndex().get_random_worker_id()
+
+
+class FakeDAOUsers:
+    def __init__(self, workers_index: WorkersIndex, worker_ids):
+        self.workers_index = workers_index
+        self.worker_ids = worker_ids
+
+    async def iter_by_filter(self, filter_):
+        # events, which come while the table is read
+        self.workers_index.remove_user('1')
+        self.workers_index.apply_user(worker('4'))
+        for user_id in self.worker_ids:
+            yield {const.ID: user_id}
+
+
+def test_events_of_rebuild_time_are_applied_to_new_index():
+    workers_index = WorkersIndex()
+
+    asyncio.run(workers_index.rebuild(FakeDAOUsers(workers_index, ['1', '2', '3'])))
+
+    assert sorted(workers_index._ids) == ['2', '3', '4']
+    assert_consistent(workers_index)
@@ -0,0 +1,38 @@
+#!/bin/sh
+
+# Exchanges were declared non-durable and auto-delete. RabbitMQ refuses to redeclare an exchange
+# with other flags (PRECONDITION_FAILED), so durable exchanges have new names: '<old name>.durable'.
+#
+# Rolling deploy:
+#   ./migrate_exchanges.sh bridge   - before deploy: declares durable exchanges and routes messages
+#                                     of not yet updated publishers from old exchanges to them
+#   deploy all services
+#   ./migrate_exchanges.sh cleanup  - after every process of every service is updated
+#                                     and queues bound to old exchanges are drained: deletes old exchanges
+#
+# Until cleanup, named queues, which are bound to both exchanges, can get a message twice:
+# workflow events are deduplicated by billing and streamed entities are written by upsert_if_newer.
+
+EXCHANGES="streaming.user streaming.task streaming.operation workflow billing"
+RABBITMQADMIN=${RABBITMQADMIN:-rabbitmqadmin}
+
+case "$1" in
+    bridge)
+        for exchange in ${EXCHANGES}; do
+            ${RABBITMQADMIN} declare exchange name="${exchange}.durable" type=topic durable=true auto_delete=false
+            # old exchange exists only while something is bound to it
+            ${RABBITMQADMIN} declare binding source="${exchange}" destination="${exchange}.durable" \
+                destination_type=exchange routing_key='#' \
+                || echo "Exchange ${exchange} doesn't exist, nothing to bridge"
+        done
+        ;;
+    cleanup)
+        for exchange in ${EXCHANGES}; do
+            ${RABBITMQADMIN} delete exchange name="${exchange}" || echo "Exchange ${exchange} doesn't exist"
+        done
+        ;;
+    *)
+        echo "Usage: $0 bridge|cleanup"
+        exit 1
+        ;;
+esac